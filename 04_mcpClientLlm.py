@@ -6,15 +6,22 @@ import requests
 import json
 import re
 from typing import Dict, Any, List
-from dotenv import load_dotenv
 import os
-from openai import OpenAI
 
-# 環境変数を読み込み
-load_dotenv()
+# OpenAIクライアント（起動を速くするため、最初のLLM呼び出し時に作成する）
+_openai_client = None
 
-# OpenAIクライアントを初期化
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+def get_openai_client():
+    """OpenAIクライアントを取得（openai と .env の読み込みは初回のみ）"""
+    global _openai_client
+    if _openai_client is None:
+        from dotenv import load_dotenv
+        from openai import OpenAI
+        
+        # 環境変数を読み込み
+        load_dotenv()
+        _openai_client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+    return _openai_client
 
 # MCPClientクラス（既存と同じ）
 class MCPClient:
@@ -53,7 +60,7 @@ class MCPClient:
 def call_llm(messages: List[Dict[str, str]], model: str = "gpt-4.1-mini") -> str:
     """LLMを呼び出してレスポンスを取得"""
     try:
-        response = client.chat.completions.create(
+        response = get_openai_client().chat.completions.create(
             model=model,
             messages=messages,
             temperature=0.1,
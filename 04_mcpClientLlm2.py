@@ -5,7 +5,7 @@
 import requests
 import json
 import re
-from typing import Dict, Any, List
+from typing import Dict, Any, List, Optional
 from dotenv import load_dotenv
 import os
 from openai import OpenAI
@@ -63,6 +63,20 @@ def call_llm(messages: List[Dict[str, str]], model: str = "gpt-4o-mini") -> str:
     except Exception as e:
         return f"LLM呼び出しエラー: {e}"
 
+def build_tool_registry(available_tools: List[Dict[str, Any]]) -> Dict[str, Dict[str, Any]]:
+    """
+    ツール名をキーにしたレジストリを作成（検索・検証・表示で毎回リストを走査しないため）
+    """
+    registry = {}
+    for tool in available_tools:
+        params = tool.get("parameters", {}) or {}
+        registry[tool["name"]] = {
+            "tool": tool,
+            "properties": params.get("properties", {}),
+            "required": tuple(params.get("required", []))
+        }
+    return registry
+
 def create_tools_schema(available_tools: List[Dict[str, Any]]) -> Dict[str, Any]:
     """
     利用可能なツールからOpenAI Function Calling用のスキーマを作成
@@ -86,7 +100,7 @@ def create_tools_schema(available_tools: List[Dict[str, Any]]) -> Dict[str, Any]
     
     return tools_schema
 
-def analyze_user_input_with_llm_dynamic(input_text: str, available_tools: List[Dict[str, Any]], is_tool_result: bool = False) -> Dict[str, Any]:
+def analyze_user_input_with_llm_dynamic(input_text: str, available_tools: List[Dict[str, Any]], is_tool_result: bool = False, tool_registry: Optional[Dict[str, Dict[str, Any]]] = None) -> Dict[str, Any]:
     """
     LLMを使用してユーザー入力を分析し、動的にツールを選択
     """
@@ -187,8 +201,9 @@ def analyze_user_input_with_llm_dynamic(input_text: str, available_tools: List[D
         result = json.loads(response)
         
         # ツール名の検証
-        valid_tool_names = [tool["name"] for tool in available_tools]
-        if result.get("plan") not in valid_tool_names and result.get("plan") != "answer_directly":
+        if tool_registry is None:
+            tool_registry = build_tool_registry(available_tools)
+        if result.get("plan") not in tool_registry and result.get("plan") != "answer_directly":
             print(f"警告: 無効なツール名 '{result.get('plan')}' が選択されました。直接回答にフォールバックします。")
             result["plan"] = "answer_directly"
             result["reasoning"] = "無効なツール名のため直接回答にフォールバック"
@@ -263,25 +278,20 @@ def generate_dynamic_result_display(tool_name: str, parameters: Dict[str, Any],
         else:
             return f"{tool_name}の結果: {result}"
 
-def execute_tool_dynamically(client: MCPClient, tool_name: str, parameters: Dict[str, Any], available_tools: List[Dict[str, Any]]) -> str:
+def execute_tool_dynamically(client: MCPClient, tool_name: str, parameters: Dict[str, Any], tool_registry: Dict[str, Dict[str, Any]]) -> str:
     """
     動的にツールを実行
     """
-    # ツールが存在するかチェック
-    tool_exists = any(tool["name"] == tool_name for tool in available_tools)
+    # ツールの登録情報を取得（存在確認を兼ねる）
+    entry = tool_registry.get(tool_name)
     
-    if not tool_exists:
+    if entry is None:
         return f"エラー: ツール '{tool_name}' が見つかりません"
     
-    # ツールの詳細情報を取得
-    tool_info = next((tool for tool in available_tools if tool["name"] == tool_name), None)
-    
-    if not tool_info:
-        return f"エラー: ツール '{tool_name}' の情報を取得できません"
+    tool_info = entry["tool"]
     
     # パラメータの検証
-    required_params = tool_info.get("parameters", {}).get("required", [])
-    missing_params = [param for param in required_params if param not in parameters]
+    missing_params = [param for param in entry["required"] if param not in parameters]
     
     if missing_params:
         return f"エラー: 必須パラメータが不足しています: {missing_params}"
@@ -296,7 +306,7 @@ def execute_tool_dynamically(client: MCPClient, tool_name: str, parameters: Dict
     except Exception as e:
         return f"ツール実行エラー: {e}"
 
-def react_loop_with_llm_dynamic(client: MCPClient, user_input: str, available_tools: List[Dict[str, Any]]):
+def react_loop_with_llm_dynamic(client: MCPClient, user_input: str, available_tools: List[Dict[str, Any]], tool_registry: Optional[Dict[str, Dict[str, Any]]] = None):
     """
     動的ツール対応のMCPループを実行
     Observation → Thought → Action → Feedback の流れ
@@ -304,6 +314,9 @@ def react_loop_with_llm_dynamic(client: MCPClient, user_input: str, available_to
     print(f"\n=== MCP Loop with Dynamic Tools ===")
     print(f"User Input: {user_input}")
     
+    if tool_registry is None:
+        tool_registry = build_tool_registry(available_tools)
+    
     observation = user_input
     max_iterations = 5  # 無限ループを防ぐ
     iteration = 0
@@ -316,7 +329,7 @@ def react_loop_with_llm_dynamic(client: MCPClient, user_input: str, available_to
         
         # --- Thought (LLM使用) ---
         print(f"\n--- Thought (LLM) ---")
-        thought = analyze_user_input_with_llm_dynamic(observation, available_tools, is_tool_result)
+        thought = analyze_user_input_with_llm_dynamic(observation, available_tools, is_tool_result, tool_registry)
         print(f"Plan: {thought['plan']}")
         print(f"Reasoning: {thought['reasoning']}")
         print(f"Parameters: {thought['parameters']}")
@@ -361,7 +374,7 @@ def react_loop_with_llm_dynamic(client: MCPClient, user_input: str, available_to
                 client, 
                 thought['plan'], 
                 thought['parameters'], 
-                available_tools
+                tool_registry
             )
             is_tool_result = True  # 次の反復ではツール結果として処理
         
@@ -411,6 +424,9 @@ def main():
         print("警告: サーバーに接続できませんでした。サーバーが起動しているか確認してください。")
         return
     
+    # ツールレジストリを一度だけ構築
+    tool_registry = build_tool_registry(tools)
+    
     # LLM接続テスト
     print("LLM接続テスト中...")
     test_response = call_llm([{"role": "user", "content": "Hello"}])
@@ -434,7 +450,7 @@ def main():
                 continue
             
             # MCPループを実行
-            react_loop_with_llm_dynamic(client, user_input, tools)
+            react_loop_with_llm_dynamic(client, user_input, tools, tool_registry)
             
         except KeyboardInterrupt:
             print("\n\n終了します。")
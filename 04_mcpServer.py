@@ -3,13 +3,20 @@
 # multiply と get_weather をツールとして提供
 
 from fastapi import FastAPI
+from fastapi.responses import Response
 from pydantic import BaseModel
-import uvicorn
+import time
 from typing import Dict, Any, List
+from metrics_utils import CONTENT_TYPE, MetricsRegistry
 
 # FastAPIアプリケーションを作成
 app = FastAPI(title="MCP Learning Server")
 
+# メトリクス（/metrics でPrometheus形式に出力）
+metrics = MetricsRegistry()
+tool_calls_total = metrics.counter("mcp_tool_calls_total", "ツール呼び出し回数", ("tool", "status"))
+tool_latency_seconds = metrics.histogram("mcp_tool_latency_seconds", "ツール呼び出しのレイテンシ（秒）", ("tool",))
+
 # --- ツール関数 ---
 def multiply(a: int, b: int) -> int:
     """
@@ -67,6 +74,14 @@ def divide(a: float, b: float) -> float:
     print(f"divide({a}, {b}) = {result}")
     return result
 
+# ツール名 → (関数, 必須パラメータ)。dispatch_tool とメトリクスのラベルはこの表から作る
+TOOL_TABLE = {
+    "multiply": (multiply, ("a", "b")),
+    "divide": (divide, ("a", "b")),
+    "get_weather": (get_weather, ("city",)),
+}
+KNOWN_TOOLS = frozenset(TOOL_TABLE)
+
 # ツール一覧を取得するエンドポイント
 @app.get("/tools")
 async def get_tools():
@@ -118,39 +133,50 @@ class ToolCallRequest(BaseModel):
 # ツールを呼び出すエンドポイント
 @app.post("/call")
 async def call_tool(request: ToolCallRequest):
-    """ツールを呼び出し"""
+    """ツールを呼び出し（呼び出し回数とレイテンシを記録）"""
+    started_at = time.perf_counter()
+    response = dispatch_tool(request)
+    
+    # 未知のツール名はラベルの種類が増えないようまとめる
+    tool_label = request.tool if request.tool in KNOWN_TOOLS else "unknown"
+    tool_calls_total.inc(tool=tool_label, status="error" if "error" in response else "success")
+    tool_latency_seconds.observe(time.perf_counter() - started_at, tool=tool_label)
+    return response
+
+# メトリクスを出力するエンドポイント
+@app.get("/metrics")
+async def get_metrics():
+    """メトリクスをPrometheusのテキスト形式で出力"""
+    return Response(content=metrics.render(), media_type=CONTENT_TYPE)
+
+def dispatch_tool(request: ToolCallRequest) -> Dict[str, Any]:
+    """ツール名に応じて関数を実行"""
     tool_name = request.tool
     parameters = request.parameters
     
-    if tool_name == "multiply":
-        a = parameters.get("a")
-        b = parameters.get("b")
-        if a is None or b is None:
-            return {"error": "Parameters 'a' and 'b' are required for multiply"}
-        result = multiply(a, b)
-    elif tool_name == "divide":
-        a = parameters.get("a")
-        b = parameters.get("b")
-        if a is None or b is None:
-            return {"error": "Parameters 'a' and 'b' are required for divide"}
-        try:
-            result = divide(a, b)
-        except ValueError as e:
-            return {"error": str(e)}
-    elif tool_name == "get_weather":
-        city = parameters.get("city")
-        if city is None:
-            return {"error": "Parameter 'city' is required for get_weather"}
-        result = get_weather(city)
-    else:
+    if tool_name not in TOOL_TABLE:
         return {"error": f"Tool '{tool_name}' not found"}
+    function, required = TOOL_TABLE[tool_name]
+    
+    missing = [name for name in required if parameters.get(name) is None]
+    if missing:
+        names = " and ".join(f"'{name}'" for name in required)
+        label = "Parameters" if len(required) > 1 else "Parameter"
+        verb = "are" if len(required) > 1 else "is"
+        return {"error": f"{label} {names} {verb} required for {tool_name}"}
+    
+    try:
+        result = function(**{name: parameters[name] for name in required})
+    except ValueError as e:
+        return {"error": str(e)}
     
     return {"result": result}
 
 if __name__ == "__main__":
     print("MCP Server starting on port 8001...")
-    print("Available tools: multiply, divide, get_weather")
+    print(f"Available tools: {', '.join(TOOL_TABLE)}")
     print("Press Ctrl+C to stop the server")
     
-    # サーバーを起動
+    # サーバーを起動（uvicorn は起動時だけ必要なのでここで読み込む）
+    import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8001)
\ No newline at end of file
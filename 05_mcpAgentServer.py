@@ -0,0 +1,282 @@
+# 05_mcpAgentServer.py
+# ConfigurableMCPAgent のHTTPサービス版
+# 1プロセスで1つのエージェント（MCPセッションプール・LLMクライアント・キャッシュ）を共有し、
+# 多数のクライアントからの同時リクエストを処理する
+#
+#   POST /query         {"query": "3 と 6 を掛けて", "session_id": "任意"} → 回答・レイテンシ・コスト
+#   POST /query/stream  同上。回答を Server-Sent Events で順次返し、最後に event: done で集計を返す
+#   GET  /sessions/{id}  セッションの往復数・累計コスト
+#   DELETE /sessions/{id}  セッションを終了
+#   GET  /health        初期化・MCP接続の状態、処理中/待機中のクエリ数・セッション数（未接続なら 503）
+#   GET  /metrics       Prometheus形式のメトリクス
+#
+#   python 05_mcpAgentServer.py                 # mcp.json の agent.server.host / port で待ち受け
+#   python 05_mcpAgentServer.py --port 8020 --debug
+
+import argparse
+import asyncio
+import importlib
+import json
+import time
+from contextlib import asynccontextmanager
+from dataclasses import asdict, dataclass
+from typing import Any, AsyncIterator, Dict, Mapping, Optional, Tuple
+
+from fastapi import FastAPI, HTTPException
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+from pydantic import BaseModel
+from metrics_utils import CONTENT_TYPE
+
+# 数字始まりのモジュール名は通常の import 文では読み込めないため importlib を使う
+mcp_client4 = importlib.import_module("05_mcpClient4")
+ConfigurableMCPAgent = mcp_client4.ConfigurableMCPAgent
+SessionCostTracker = mcp_client4.SessionCostTracker
+
+class QueryRequest(BaseModel):
+    query: str
+    session_id: Optional[str] = None  # 指定時は同じIDの会話履歴を使い、コストもセッションに集計する
+
+@dataclass
+class AgentServerConfig:
+    host: str = "127.0.0.1"
+    port: int = 8010
+    max_concurrent_queries: int = 256  # 同時に処理するクエリ数
+    max_queued_queries: int = 1024  # 処理待ちの上限（超えたら 503 を返す）
+    debug: bool = False  # 反復ごとのデバッグ出力（並行処理ではログが混ざるため既定は無効）
+
+    @classmethod
+    def from_config(cls, server_config: Mapping[str, Any]) -> "AgentServerConfig":
+        """mcp.json の agent.server 設定から生成"""
+        return cls(
+            host=server_config.get("host", "127.0.0.1"),
+            port=server_config.get("port", 8010),
+            max_concurrent_queries=server_config.get("maxConcurrentQueries", 256),
+            max_queued_queries=server_config.get("maxQueuedQueries", 1024),
+            debug=server_config.get("debug", False)
+        )
+
+class AdmissionControl:
+    """同時実行数の上限と処理待ちの長さを管理（待ちが上限に達したら受け付けない）"""
+
+    def __init__(self, max_concurrent: int, max_queued: int):
+        self.max_concurrent = max_concurrent
+        self.max_queued = max_queued
+        self._semaphore = asyncio.Semaphore(max_concurrent)
+        self.in_flight = 0
+        self.waiting = 0
+        self.rejected = 0
+
+    def check(self):
+        """処理待ちが満杯なら 503（ストリーミングではレスポンス開始前に確認する）"""
+        if self.in_flight >= self.max_concurrent and self.waiting >= self.max_queued:
+            self.rejected += 1
+            raise HTTPException(status_code=503, detail="混雑しています。しばらくしてから再試行してください")
+
+    @asynccontextmanager
+    async def slot(self) -> AsyncIterator[None]:
+        """処理枠を確保（空くまで先着順で待つ）"""
+        self.waiting += 1
+        try:
+            await self._semaphore.acquire()
+        finally:
+            self.waiting -= 1
+        self.in_flight += 1
+        try:
+            yield
+        finally:
+            self.in_flight -= 1
+            self._semaphore.release()
+
+def _sse(event: str, data: Dict[str, Any]) -> str:
+    """Server-Sent Events の1イベント"""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+def create_app(config_path: str = "mcp.json", server_name: Optional[str] = None,
+               debug: Optional[bool] = None) -> Tuple[FastAPI, ConfigurableMCPAgent]:
+    """エージェントを共有するFastAPIアプリケーションを作成（初期化は起動時に行う）"""
+    agent = ConfigurableMCPAgent(config_path, server_name)
+    state: Dict[str, Any] = {"ready": False}
+
+    @asynccontextmanager
+    async def lifespan(app: FastAPI):
+        if not await agent.initialize():
+            raise RuntimeError("エージェントの初期化に失敗しました")
+        server_config = AgentServerConfig.from_config(agent.mcp_config.current.agent.get("server", {}))
+        agent.debug_override = server_config.debug if debug is None else debug
+        agent.agent_config.debug_mode = agent.debug_override
+        # 会話履歴は session_id ごとにエージェントのセッションテーブルで持つ。
+        # session_id のないリクエストは履歴なしで処理するため、エージェント共有のメモリは使わない
+        agent.memory = None
+        state["admission"] = AdmissionControl(server_config.max_concurrent_queries, server_config.max_queued_queries)
+        state["ready"] = True
+        print(f"🚀 エージェントサーバー準備完了（同時実行数: {server_config.max_concurrent_queries}, "
+              f"待ち行列: {server_config.max_queued_queries}）")
+        try:
+            yield
+        finally:
+            state["ready"] = False
+            await agent.cleanup()
+
+    app = FastAPI(title="MCP Agent Server", lifespan=lifespan)
+    http_requests = agent.metrics.registry.counter(
+        "agent_http_requests_total", "HTTPリクエスト数", ("endpoint", "status")
+    )
+
+    def require_ready():
+        if not state["ready"]:
+            raise HTTPException(status_code=503, detail="エージェントを初期化中です")
+
+    def session_totals(session_id: Optional[str]) -> Dict[str, Any]:
+        """レスポンスに添えるセッションの累計"""
+        session = agent.sessions.find(session_id) if session_id is not None else None
+        if session is None:
+            return {"session_id": session_id}
+        return {
+            "session_id": session_id,
+            "session_queries": session.queries,
+            "session_cost": session.cost_tracker.total_cost
+        }
+
+    @app.post("/query")
+    async def query(request: QueryRequest):
+        """クエリを処理して回答と集計を返す"""
+        require_ready()
+        admission: AdmissionControl = state["admission"]
+        try:
+            admission.check()
+        except HTTPException:
+            http_requests.inc(endpoint="query", status="rejected")
+            raise
+        try:
+            async with admission.slot():
+                result = await agent.run_query(request.query, session_id=request.session_id)
+        except Exception as e:
+            http_requests.inc(endpoint="query", status="error")
+            agent.metrics.errors.inc(kind="http")
+            raise HTTPException(status_code=500, detail=f"{type(e).__name__}: {e}")
+        http_requests.inc(endpoint="query", status="ok")
+        return {**asdict(result), **session_totals(request.session_id)}
+
+    @app.post("/query/stream")
+    async def query_stream(request: QueryRequest):
+        """回答をSSEで順次返す（event: token → event: done、失敗時は event: error）"""
+        require_ready()
+        admission: AdmissionControl = state["admission"]
+        try:
+            admission.check()
+        except HTTPException:
+            http_requests.inc(endpoint="stream", status="rejected")
+            raise
+
+        async def events() -> AsyncIterator[str]:
+            tracker = SessionCostTracker()
+            start_time = time.perf_counter()
+            first_token_time: Optional[float] = None
+            answer_parts = []
+            try:
+                async with admission.slot():
+                    async for text in agent.process_query_stream(request.query, query_tracker=tracker,
+                                                                 session_id=request.session_id):
+                        if first_token_time is None:
+                            first_token_time = time.perf_counter()
+                        answer_parts.append(text)
+                        yield _sse("token", {"text": text})
+            except asyncio.CancelledError:
+                # クライアントが切断した（エージェント側の処理は process_query_stream の finally で片付く）
+                http_requests.inc(endpoint="stream", status="disconnected")
+                raise
+            except Exception as e:
+                http_requests.inc(endpoint="stream", status="error")
+                agent.metrics.errors.inc(kind="http")
+                yield _sse("error", {"error": f"{type(e).__name__}: {e}"})
+                return
+            http_requests.inc(endpoint="stream", status="ok")
+            yield _sse("done", {
+                "query": request.query,
+                "answer": "".join(answer_parts),
+                "latency_ms": (time.perf_counter() - start_time) * 1000,
+                "ttft_ms": (first_token_time - start_time) * 1000 if first_token_time else None,
+                "prompt_tokens": tracker.total_prompt_tokens,
+                "completion_tokens": tracker.total_completion_tokens,
+                "cost": tracker.total_cost,
+                "llm_requests": tracker.request_count,
+                "cache_hits": tracker.cache_hits,
+                **session_totals(request.session_id)
+            })
+
+        # プロキシにバッファリングさせず、トークンをそのまま流す
+        headers = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+        return StreamingResponse(events(), media_type="text/event-stream", headers=headers)
+
+    @app.get("/health")
+    async def health():
+        """初期化状態と負荷状況"""
+        if not state["ready"]:
+            return JSONResponse({"status": "starting"}, status_code=503)
+        mcp_status = agent.mcp_status
+        if mcp_status != "ok":
+            # ウォームスタートの接続待ち、またはどのMCPサーバーにもつながっていない（裏で再接続中）
+            return JSONResponse({"status": mcp_status, "servers": agent.get_server_status()}, status_code=503)
+        admission: AdmissionControl = state["admission"]
+        return {
+            "status": "ok",
+            "in_flight": admission.in_flight,
+            "waiting": admission.waiting,
+            "rejected": admission.rejected,
+            "sessions": agent.sessions.get_summary(),
+            "servers": agent.get_server_status(),
+            "tools": len(agent.tool_registry),
+            "config_generation": agent.mcp_config.current.generation
+        }
+
+    @app.get("/sessions/{session_id}")
+    async def get_session(session_id: str):
+        """セッションの状態と累計コスト"""
+        require_ready()
+        session = agent.sessions.find(session_id)
+        if session is None:
+            raise HTTPException(status_code=404, detail="セッションが見つかりません")
+        return {
+            **session_totals(session_id),
+            "idle_seconds": time.monotonic() - session.last_used,
+            "active": session.active,
+            "estimated_bytes": session.size_bytes,
+            "memory": session.memory.get_summary() if session.memory is not None else None,
+            "usage": session.cost_tracker.get_session_summary()
+        }
+
+    @app.delete("/sessions/{session_id}")
+    async def delete_session(session_id: str):
+        """セッションを終了（処理中のクエリはそのまま完了する）"""
+        require_ready()
+        if not agent.sessions.close(session_id):
+            raise HTTPException(status_code=404, detail="セッションが見つかりません")
+        return {"session_id": session_id, "closed": True}
+
+    @app.get("/metrics")
+    async def metrics():
+        """Prometheus形式のメトリクス"""
+        return Response(content=agent.metrics.registry.render(), media_type=CONTENT_TYPE)
+
+    return app, agent
+
+def main():
+    parser = argparse.ArgumentParser(description="ConfigurableMCPAgent のHTTPサービス")
+    parser.add_argument("-c", "--config", default="mcp.json", help="設定ファイル")
+    parser.add_argument("-s", "--server", default=None, help="接続するサーバー名（既定: clients.default.servers の全サーバー）")
+    parser.add_argument("--host", default=None, help="待ち受けるホスト（既定: agent.server.host）")
+    parser.add_argument("--port", type=int, default=None, help="待ち受けるポート（既定: agent.server.port）")
+    parser.add_argument("--debug", action="store_true", default=None, help="反復ごとのデバッグ出力を有効化")
+    args = parser.parse_args()
+
+    # 待ち受け先だけ先に決める（設定の検証と環境変数の展開は起動時にエージェントが行う）
+    with open(args.config, "r", encoding="utf-8") as f:
+        server_config = AgentServerConfig.from_config(json.load(f).get("agent", {}).get("server", {}))
+    app, _ = create_app(args.config, args.server, args.debug)
+
+    # サーバーを起動（uvicorn は起動時だけ必要なのでここで読み込む）
+    import uvicorn
+    uvicorn.run(app, host=args.host or server_config.host, port=args.port or server_config.port)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,165 @@
+# 05_mcpBatch.py
+# ConfigurableMCPAgent のバッチ実行版
+# JSONLファイル（またはstdin）のクエリを、同時実行数を制限して並行処理する
+#
+# 入力: 1行1クエリ。{"id": "q1", "query": "3 と 6 を掛けて"} 形式、または生のテキスト行
+# 出力: 1行1結果のJSONL（回答・反復回数・レイテンシ・コスト）
+#
+#   python 05_mcpBatch.py queries.jsonl -o results.jsonl
+#   cat queries.jsonl | python 05_mcpBatch.py - > results.jsonl
+
+import argparse
+import asyncio
+import contextlib
+import importlib
+import json
+import sys
+import time
+from typing import Dict, Any, Optional, TextIO
+
+# 数字始まりのモジュール名は通常の import 文では読み込めないため importlib を使う
+mcp_client4 = importlib.import_module("05_mcpClient4")
+ConfigurableMCPAgent = mcp_client4.ConfigurableMCPAgent
+
+def parse_query_line(line: str, index: int) -> Optional[Dict[str, Any]]:
+    """入力1行をクエリに変換（JSONでなければ生テキストとして扱う）"""
+    line = line.strip()
+    if not line:
+        return None
+
+    try:
+        data = json.loads(line)
+    except json.JSONDecodeError:
+        return {"id": index, "query": line}
+
+    if isinstance(data, dict):
+        query = data.get("query")
+        if not isinstance(query, str) or not query.strip():
+            return {"id": data.get("id", index), "query": None}
+        return {"id": data.get("id", index), "query": query.strip()}
+    if isinstance(data, str):
+        return {"id": index, "query": data.strip()}
+    return {"id": index, "query": None}
+
+async def read_queries(source: TextIO, queue: asyncio.Queue, worker_count: int):
+    """入力を1行ずつ読み込んでキューに投入（大きなファイルでもメモリを使い切らない）"""
+    index = 0
+    while True:
+        line = await asyncio.to_thread(source.readline)
+        if not line:
+            break
+        item = parse_query_line(line, index)
+        if item is not None:
+            await queue.put(item)
+            index += 1
+
+    # ワーカーへの終了通知
+    for _ in range(worker_count):
+        await queue.put(None)
+
+async def run_worker(agent: Any, queue: asyncio.Queue, output: TextIO, stats: Dict[str, Any]):
+    """キューからクエリを取り出して処理し、結果をJSONLで書き出す"""
+    while True:
+        item = await queue.get()
+        if item is None:
+            break
+
+        record: Dict[str, Any] = {"id": item["id"], "query": item["query"]}
+        if item["query"] is None:
+            record["error"] = "query が指定されていません"
+        else:
+            try:
+                result = await agent.run_query(item["query"])
+                record.update({
+                    "answer": result.answer,
+                    "iterations": result.iterations,
+                    "latency_ms": round(result.latency_ms, 1),
+                    "llm_requests": result.llm_requests,
+                    "cache_hits": result.cache_hits,
+                    "prompt_tokens": result.prompt_tokens,
+                    "completion_tokens": result.completion_tokens,
+                    "cost": result.cost
+                })
+                stats["cost"] += result.cost
+            except Exception as e:
+                record["error"] = f"{type(e).__name__}: {e}"
+
+        if "error" in record:
+            stats["errors"] += 1
+        stats["processed"] += 1
+
+        output.write(json.dumps(record, ensure_ascii=False) + "\n")
+        output.flush()
+
+async def run_batch(agent: Any, source: TextIO, output: TextIO, concurrency: int) -> Dict[str, Any]:
+    """1つのMCPセッションとLLMクライアントを共有して、クエリを並行処理"""
+    queue: asyncio.Queue = asyncio.Queue(maxsize=concurrency * 2)
+    stats = {"processed": 0, "errors": 0, "cost": 0.0}
+
+    start_time = time.perf_counter()
+    workers = [
+        asyncio.create_task(run_worker(agent, queue, output, stats))
+        for _ in range(concurrency)
+    ]
+    reader = asyncio.create_task(read_queries(source, queue, concurrency))
+
+    try:
+        await asyncio.gather(reader, *workers)
+    finally:
+        for task in [reader, *workers]:
+            task.cancel()
+
+    stats["elapsed_seconds"] = time.perf_counter() - start_time
+    return stats
+
+async def main():
+    """メイン関数"""
+    parser = argparse.ArgumentParser(description="ConfigurableMCPAgent バッチ実行")
+    parser.add_argument("input", help="クエリのJSONLファイル（'-' で標準入力）")
+    parser.add_argument("-o", "--output", default="-", help="結果のJSONLファイル（既定: 標準出力）")
+    parser.add_argument("-c", "--config", default="mcp.json", help="設定ファイル")
+    parser.add_argument("-s", "--server", default=None, help="接続するサーバー名（既定: clients.default.servers の全サーバー）")
+    parser.add_argument("-n", "--concurrency", type=int, default=None,
+                        help="同時実行数（既定: mcp.json の agent.maxConcurrentQueries）")
+    parser.add_argument("--debug", action="store_true", help="反復ごとのデバッグ出力を有効化")
+    args = parser.parse_args()
+
+    source = sys.stdin if args.input == "-" else open(args.input, "r", encoding="utf-8")
+    output = sys.stdout if args.output == "-" else open(args.output, "w", encoding="utf-8")
+
+    # 結果を標準出力に書く場合、エージェントのログは標準エラーへ逃がす
+    log_target = sys.stderr if output is sys.stdout else sys.stdout
+
+    agent = ConfigurableMCPAgent(args.config, args.server)
+    # 並行実行では反復ごとのログが混ざるため、既定では抑制する
+    agent.debug_override = args.debug
+    try:
+        with contextlib.redirect_stdout(log_target):
+            if not await agent.initialize():
+                print("❌ エージェントの初期化に失敗しました")
+                return
+
+            concurrency = args.concurrency or agent.agent_config.max_concurrent_queries
+            print(f"🚀 バッチ実行開始（同時実行数: {concurrency}）")
+
+            stats = await run_batch(agent, source, output, max(1, concurrency))
+
+            print("\n" + "=" * 50)
+            print("📊 バッチ実行結果")
+            print("=" * 50)
+            print(f"処理件数: {stats['processed']}")
+            print(f"エラー件数: {stats['errors']}")
+            print(f"経過時間: {stats['elapsed_seconds']:.2f}秒")
+            if stats["elapsed_seconds"] > 0:
+                print(f"スループット: {stats['processed'] / stats['elapsed_seconds']:.2f} クエリ/秒")
+            print(f"総コスト: ${stats['cost']:.6f}")
+    finally:
+        with contextlib.redirect_stdout(log_target):
+            await agent.cleanup()
+        if source is not sys.stdin:
+            source.close()
+        if output is not sys.stdout:
+            output.close()
+
+if __name__ == "__main__":
+    asyncio.run(main())
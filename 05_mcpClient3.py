@@ -5,16 +5,15 @@
 import asyncio
 import json
 import re
-from typing import Dict, Any, List, Optional, Tuple
-from fastmcp import Client
-from openai import OpenAI
-from dotenv import load_dotenv
+from typing import TYPE_CHECKING, Dict, Any, List, Optional, Tuple
 import os
 from dataclasses import dataclass
 from enum import Enum
 
-# 環境変数を読み込み
-load_dotenv()
+if TYPE_CHECKING:
+    # 型注釈用。fastmcp / openai は読み込みが重いため、実行時は使う直前に import する
+    from fastmcp import Client
+    from openai import AsyncOpenAI
 
 # 設定クラス
 @dataclass
@@ -31,6 +30,19 @@ class AgentConfig:
     fallback_to_direct: bool = True
     timeout: int = 30
 
+@dataclass
+class ToolSpec:
+    """ツールの登録情報（解析済みスキーマを保持）"""
+    name: str
+    description: str
+    properties: Dict[str, Any]
+    required: Tuple[str, ...]
+    tool: Any = None
+    
+    def missing_parameters(self, parameters: Dict[str, Any]) -> List[str]:
+        """不足している必須パラメータを返す"""
+        return [name for name in self.required if name not in parameters]
+
 class ToolDecision(Enum):
     TOOL = "TOOL"
     DIRECT = "DIRECT"
@@ -43,15 +55,19 @@ class MCPAgent:
         self.server_url = server_url
         self.llm_config = llm_config
         self.agent_config = agent_config
-        self.client: Optional[Client] = None
+        self.client: Optional["Client"] = None
         self.tools: List[Any] = []
-        self.llm_client: Optional[OpenAI] = None
+        self.tool_registry: Dict[str, ToolSpec] = {}  # ツール名 → 登録情報
+        self.llm_client: Optional["AsyncOpenAI"] = None
         
     async def initialize(self) -> bool:
         """エージェントを初期化"""
         try:
-            # LLMクライアントの初期化
-            self.llm_client = OpenAI(api_key=self.llm_config.api_key or os.getenv("OPENAI_API_KEY"))
+            from fastmcp import Client
+            from openai import AsyncOpenAI
+            
+            # LLMクライアントの初期化（非同期クライアントでイベントループを塞がない）
+            self.llm_client = AsyncOpenAI(api_key=self.llm_config.api_key or os.getenv("OPENAI_API_KEY"))
             
             # MCPクライアントの初期化
             self.client = Client(self.server_url)
@@ -59,6 +75,7 @@ class MCPAgent:
             
             # ツール一覧の取得
             self.tools = await self.client.list_tools()
+            self.tool_registry = self._build_tool_registry(self.tools)
             
             print(f"✅ エージェント初期化完了")
             print(f"📡 サーバー: {self.server_url}")
@@ -78,21 +95,36 @@ class MCPAgent:
                 await self.client.__aexit__(None, None, None)
             except Exception as e:
                 print(f"⚠️ クリーンアップエラー: {e}")
+        if self.llm_client:
+            try:
+                await self.llm_client.close()
+            except Exception as e:
+                print(f"⚠️ LLMクライアントのクリーンアップエラー: {e}")
+    
+    def _build_tool_registry(self, tools: List[Any]) -> Dict[str, ToolSpec]:
+        """ツール一覧から名前をキーにしたレジストリを構築"""
+        registry = {}
+        for tool in tools:
+            schema = getattr(tool, 'inputSchema', None) or {}
+            registry[tool.name] = ToolSpec(
+                name=tool.name,
+                description=tool.description,
+                properties=schema.get('properties', {}),
+                required=tuple(schema.get('required', [])),
+                tool=tool
+            )
+        return registry
     
     def _create_tools_schema(self) -> str:
         """利用可能なツールのスキーマ情報を生成"""
         tools_info = []
-        for tool in self.tools:
-            schema = getattr(tool, 'inputSchema', {})
-            properties = schema.get('properties', {}) if schema else {}
-            required = schema.get('required', []) if schema else {}
-            
-            tool_info = f"- {tool.name}: {tool.description}"
-            if properties:
+        for spec in self.tool_registry.values():
+            tool_info = f"- {spec.name}: {spec.description}"
+            if spec.properties:
                 param_details = []
-                for param_name, param_info in properties.items():
+                for param_name, param_info in spec.properties.items():
                     param_type = param_info.get('type', 'string')
-                    is_required = param_name in required
+                    is_required = param_name in spec.required
                     param_details.append(f"{param_name}({param_type}{'必須' if is_required else '任意'})")
                 tool_info += f" [パラメータ: {', '.join(param_details)}]"
             tools_info.append(tool_info)
@@ -127,7 +159,7 @@ class MCPAgent:
 
 重要: パラメータは必ずJSON形式で出力し、必須パラメータは必ず含めてください。"""
 
-            response = self.llm_client.chat.completions.create(
+            response = await self.llm_client.chat.completions.create(
                 model=self.llm_config.model,
                 messages=[
                     {"role": "system", "content": system_prompt},
@@ -166,15 +198,15 @@ class MCPAgent:
         """ツールを実行"""
         try:
             # ツールの存在確認
-            selected_tool = None
-            for tool in self.tools:
-                if tool.name == tool_name:
-                    selected_tool = tool
-                    break
-            
-            if not selected_tool:
+            spec = self.tool_registry.get(tool_name)
+            if spec is None:
                 return False, f"ツール '{tool_name}' が見つかりません", None
             
+            # 必須パラメータの検証
+            missing_params = spec.missing_parameters(parameters)
+            if missing_params:
+                return False, f"必須パラメータが不足しています: {missing_params}", None
+            
             # ツール実行
             result = await self.client.call_tool(tool_name, parameters)
             
@@ -260,7 +292,7 @@ class MCPAgent:
                     
                     # フォールバック処理
                     try:
-                        fallback_response = self.llm_client.chat.completions.create(
+                        fallback_response = await self.llm_client.chat.completions.create(
                             model=self.llm_config.model,
                             messages=[
                                 {"role": "system", "content": "ユーザーの質問に直接回答してください。"},
@@ -287,6 +319,10 @@ async def main():
     print("FastMCP Agent - エージェント抽象化版")
     print("=" * 50)
     
+    # 環境変数を読み込み
+    from dotenv import load_dotenv
+    load_dotenv()
+    
     # 設定の初期化
     llm_config = LLMConfig(
         model="gpt-4o-mini",
@@ -317,7 +353,7 @@ async def main():
         # メインループ
         while True:
             try:
-                user_input = input("\nUser query: ").strip()
+                user_input = (await asyncio.to_thread(input, "\nUser query: ")).strip()
                 
                 if user_input.lower() in ['quit', 'exit', '終了']:
                     print("👋 終了します。")
@@ -3,19 +3,35 @@
 # 設定の外部化とエージェント抽象化を統合
 
 import asyncio
+import functools
 import json
+import math
 import re
-from typing import Dict, Any, List, Optional, Tuple
-from pathlib import Path
-from fastmcp import Client
-from openai import OpenAI
-from dotenv import load_dotenv
+import time
+from contextvars import ContextVar
+from typing import TYPE_CHECKING, AsyncIterator, Dict, Any, List, Mapping, Optional, Tuple
 import os
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 from enum import Enum
+from router_utils import KeywordRouter, RouteDecision, RouterStats
+from cache_utils import LLMResponseCache, ToolResultCache
+from cost_utils import estimate_messages_tokens, estimate_tokens
+from memory_utils import ConversationMemory
+from trace_utils import Tracer
+from metrics_utils import MetricsRegistry, start_metrics_server
+from resilience_utils import (
+    CircuitBreaker, HedgeOutcome, HedgingPolicy, RetryPolicy, RetryStats, call_with_resilience, is_retryable_error
+)
+from rate_limit_utils import RateLimiter, get_rate_limiter
+from mcp_pool_utils import MCPClientPool
+from snapshot_utils import ToolSnapshotStore, config_fingerprint, tool_catalog
+from config_utils import CompiledConfig, MCPConfig, thaw
+from session_utils import SessionManager
 
-# 環境変数を読み込み
-load_dotenv()
+if TYPE_CHECKING:
+    # 型注釈用。fastmcp / openai は読み込みが重いため、実行時は使う直前に import する
+    from fastmcp import Client
+    from openai import AsyncOpenAI
 
 # モデルごとの料金（1,000 tokens あたりのドル）
 MODEL_RATES = {
@@ -81,6 +97,14 @@ class SessionCostTracker:
     total_cost: float = 0.0
     request_count: int = 0
     model: str = ""
+    cache_hits: int = 0
+    cache_misses: int = 0
+    cache_saved_cost: float = 0.0
+    usage_by_model: Dict[str, Dict[str, Any]] = field(default_factory=dict)
+    hedged_requests: int = 0
+    hedge_wins: int = 0
+    hedge_extra_tokens: int = 0
+    hedge_extra_cost: float = 0.0
 
     def add_usage(self, cost_calc: UsageCostCalculator):
         """使用量を追加"""
@@ -91,6 +115,32 @@ class SessionCostTracker:
         if not self.model:
             self.model = cost_calc.model
 
+        # モデル別の内訳
+        usage = self.usage_by_model.setdefault(
+            cost_calc.model, {"requests": 0, "prompt_tokens": 0, "completion_tokens": 0, "cost": 0.0}
+        )
+        usage["requests"] += 1
+        usage["prompt_tokens"] += cost_calc.prompt_tokens
+        usage["completion_tokens"] += cost_calc.completion_tokens
+        usage["cost"] += cost_calc.total_cost
+
+    def add_cache_hit(self, cost_calc: UsageCostCalculator):
+        """キャッシュヒットを記録（本来かかったはずのコストを節約額として加算）"""
+        self.cache_hits += 1
+        self.cache_saved_cost += cost_calc.total_cost
+
+    def add_cache_miss(self):
+        """キャッシュミスを記録"""
+        self.cache_misses += 1
+
+    def add_hedge(self, hedge_won: bool, extra_tokens: int, extra_cost: float):
+        """ヘッジで送った重複リクエストの追加トークンとコスト（見積もりを含む）を記録"""
+        self.hedged_requests += 1
+        if hedge_won:
+            self.hedge_wins += 1
+        self.hedge_extra_tokens += extra_tokens
+        self.hedge_extra_cost += extra_cost
+
     def get_session_summary(self):
         """セッション全体のサマリーを返す"""
         return {
@@ -100,68 +150,143 @@ class SessionCostTracker:
             "total_completion_tokens": self.total_completion_tokens,
             "total_tokens": self.total_prompt_tokens + self.total_completion_tokens,
             "total_cost": self.total_cost,
-            "average_cost_per_request": self.total_cost / self.request_count if self.request_count > 0 else 0
+            "average_cost_per_request": self.total_cost / self.request_count if self.request_count > 0 else 0,
+            "cache_hits": self.cache_hits,
+            "cache_misses": self.cache_misses,
+            "cache_saved_cost": self.cache_saved_cost,
+            "usage_by_model": {model: dict(usage) for model, usage in self.usage_by_model.items()},
+            "hedged_requests": self.hedged_requests,
+            "hedge_wins": self.hedge_wins,
+            "hedge_extra_tokens": self.hedge_extra_tokens,
+            "hedge_extra_cost": self.hedge_extra_cost
         }
 
-# 設定クラス
 @dataclass
-class MCPConfig:
-    """MCP設定管理クラス"""
-    
-    def __init__(self, config_path: str = "mcp.json"):
-        self.config_path = Path(config_path)
-        self.config = self.load_config()
+class SpeculationStats:
+    """投機的な直接回答リクエストの損益集計"""
+    launched: int = 0
+    used: int = 0
+    cancelled: int = 0
+    wasted_completed: int = 0
+    wasted_cost: float = 0.0
+    wasted_tokens: int = 0
+    estimated_cancelled_cost: float = 0.0
+    estimated_cancelled_tokens: int = 0
+    latency_saved_seconds: float = 0.0
+
+    def get_summary(self):
+        """集計結果のサマリーを返す"""
+        return {
+            "launched": self.launched,
+            "used": self.used,
+            "cancelled": self.cancelled,
+            "wasted_completed": self.wasted_completed,
+            "extra_tokens": self.wasted_tokens + self.estimated_cancelled_tokens,
+            "extra_cost": self.wasted_cost + self.estimated_cancelled_cost,
+            "latency_saved_seconds": self.latency_saved_seconds,
+            "average_latency_saved_seconds": self.latency_saved_seconds / self.used if self.used else 0.0
+        }
+
+@dataclass
+class RoutingPolicy:
+    """モデルルーティングの方針（各チェーンは安いモデルから順に並べる）"""
+    decision_models: Tuple[str, ...]
+    phrasing_models: Tuple[str, ...]
+    fallbacks: Dict[str, str] = field(default_factory=dict)  # API呼び出しに失敗した時の代替モデル
+    min_confidence: float = 0.0  # logprobs から求めた確信度がこれ未満なら上位モデルへ
+
+    @classmethod
+    def from_config(cls, routing_config: Dict[str, Any], default_model: str) -> "RoutingPolicy":
+        """mcp.json の llm.routing 設定から生成（無効なら既定モデルだけのチェーン）"""
+        if not routing_config.get("enabled", False):
+            return cls(decision_models=(default_model,), phrasing_models=(default_model,))
+        decision_models = tuple(routing_config.get("decisionModels", [default_model]))
+        return cls(
+            decision_models=decision_models,
+            phrasing_models=tuple(routing_config.get("phrasingModels", decision_models)),
+            fallbacks=dict(routing_config.get("fallbacks", {})),
+            min_confidence=routing_config.get("minConfidence", 0.0)
+        )
+
+    def all_models(self) -> List[str]:
+        """ルーティングで使う全モデル（重複なし、出現順）"""
+        models = list(self.decision_models) + list(self.phrasing_models)
+        models += list(self.fallbacks.keys()) + list(self.fallbacks.values())
+        return list(dict.fromkeys(models))
+
+@dataclass
+class RoutingStats:
+    """モデルの格上げ・代替の集計"""
+    escalations: int = 0
+    escalations_by_reason: Dict[str, int] = field(default_factory=dict)
+    fallbacks: int = 0
+
+    def record_escalation(self, reason: str):
+        self.escalations += 1
+        self.escalations_by_reason[reason] = self.escalations_by_reason.get(reason, 0) + 1
+
+class AgentMetrics:
+    """エージェントのメトリクス定義（/metrics でPrometheus形式に出力する）"""
     
-    def load_config(self) -> Dict[str, Any]:
-        """設定ファイルを読み込み"""
-        if not self.config_path.exists():
-            raise FileNotFoundError(f"設定ファイルが見つかりません: {self.config_path}")
-        
-        try:
-            with open(self.config_path, 'r', encoding='utf-8') as f:
-                config = json.load(f)
-            print(f"✅ 設定ファイル読み込み完了: {self.config_path}")
-            return config
-        except json.JSONDecodeError as e:
-            raise ValueError(f"設定ファイルのJSON形式が無効です: {e}")
-        except Exception as e:
-            raise RuntimeError(f"設定ファイル読み込みエラー: {e}")
-    
-    def get_server_config(self, server_name: str) -> Dict[str, Any]:
-        """サーバー設定を取得"""
-        servers = self.config.get("mcpServers", {})
-        if server_name not in servers:
-            raise KeyError(f"サーバー '{server_name}' が見つかりません")
-        return servers[server_name]
-    
-    def get_client_config(self, client_name: str = "default") -> Dict[str, Any]:
-        """クライアント設定を取得"""
-        clients = self.config.get("clients", {})
-        if client_name not in clients:
-            raise KeyError(f"クライアント '{client_name}' が見つかりません")
-        return clients[client_name]
-    
-    def get_llm_config(self) -> Dict[str, Any]:
-        """LLM設定を取得"""
-        return self.config.get("llm", {})
-    
-    def get_agent_config(self) -> Dict[str, Any]:
-        """エージェント設定を取得"""
-        return self.config.get("agent", {})
-    
-    def get_tool_config(self, tool_name: str) -> Dict[str, Any]:
-        """ツール設定を取得"""
-        tools = self.config.get("tools", {})
-        return tools.get(tool_name, {})
-    
-    def build_server_url(self, server_name: str) -> str:
-        """サーバーURLを構築"""
-        server_config = self.get_server_config(server_name)
-        host = server_config.get("host", "localhost")
-        port = server_config.get("port", 8001)
-        path = server_config.get("path", "/mcp")
-        return f"http://{host}:{port}{path}"
+    def __init__(self, registry: MetricsRegistry):
+        self.registry = registry
+        self.llm_requests = registry.counter("agent_llm_requests_total", "LLM呼び出し回数", ("model", "cached"))
+        self.llm_tokens = registry.counter("agent_llm_tokens_total", "LLMのトークン数", ("model", "type"))
+        self.llm_cost = registry.counter("agent_llm_cost_dollars_total", "LLMのコスト（ドル）", ("model",))
+        self.llm_latency = registry.histogram("agent_llm_latency_seconds", "LLM呼び出しのレイテンシ（秒）", ("model",))
+        self.tool_calls = registry.counter("agent_tool_calls_total", "ツール呼び出し回数", ("tool", "status"))
+        self.tool_latency = registry.histogram("agent_tool_latency_seconds", "ツール呼び出しのレイテンシ（秒）", ("tool",))
+        self.errors = registry.counter("agent_errors_total", "エラー回数", ("kind",))
+        self.fallbacks = registry.counter("agent_fallbacks_total", "直接回答へのフォールバック回数")
+        self.llm_hedges = registry.counter("agent_llm_hedges_total", "ヘッジで送った重複リクエスト数", ("model", "winner"))
+        self.retries = registry.counter("agent_retries_total", "一時的な障害による再試行回数", ("target",))
+        self.mcp_pool_wait = registry.histogram(
+            "agent_mcp_pool_wait_seconds", "MCPセッションを借りるまでの待ち時間（秒）", ("server",)
+        )
+        self.mcp_pool_in_use = registry.gauge("agent_mcp_pool_in_use", "貸し出し中のMCPセッション数", ("server",))
+        self.rate_limit_wait = registry.histogram(
+            "agent_llm_rate_limit_wait_seconds", "レート制限による待ち時間（秒）", ("model",)
+        )
+        self.queries = registry.counter("agent_queries_total", "処理したクエリ数", ("mode",))
+        self.queries_in_flight = registry.gauge("agent_queries_in_flight", "処理中のクエリ数")
+        self.query_latency = registry.histogram("agent_query_latency_seconds", "クエリ全体のレイテンシ（秒）", ("mode",))
+        self.query_iterations = registry.histogram(
+            "agent_query_iterations", "クエリあたりの反復回数", buckets=(1, 2, 3, 4, 5, 6, 8, 10)
+        )
+
+# 接続できなかったMCPサーバーへの再接続間隔（秒）。失敗するたびに倍にし、上限で止める
+RECONNECT_INITIAL_DELAY = 1.0
+RECONNECT_MAX_DELAY = 60.0
+
+# 起動時に作るもの（接続・プール・キャッシュなど）に関わる設定。再読み込みしても再起動まで反映されない
+RESTART_REQUIRED_SETTINGS = (
+    "llm.cache", "llm.provider", "llm.maxConnections", "agent.memory", "agent.tracing", "agent.metrics", "agent.warmStart", "agent.configReload"
+)
+
+# 実行中クエリ単位のコスト追跡（並行実行時もタスクごとに分離される）
+_query_cost_tracker: ContextVar[Optional[SessionCostTracker]] = ContextVar("query_cost_tracker", default=None)
+# 実行中クエリが属するセッションのコスト追跡（session_id を指定した時のみ）
+_session_cost_tracker: ContextVar[Optional[SessionCostTracker]] = ContextVar("session_cost_tracker", default=None)
 
+@dataclass
+class QueryResult:
+    """1クエリの処理結果"""
+    query: str
+    answer: str
+    iterations: int
+    latency_ms: float
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    cost: float = 0.0
+    llm_requests: int = 0
+    cache_hits: int = 0
+
+@dataclass
+class LoopOutcome:
+    """MCP Loop の終わり方（エラーで終わった往復は会話メモリに残さない）"""
+    failed: bool = False
+
+# 設定クラス
 @dataclass
 class LLMConfig:
     model: str = "gpt-4o-mini"
@@ -170,6 +295,9 @@ class LLMConfig:
     api_key: str = ""
     use_max_completion_tokens: bool = False
     use_temperature: bool = True
+    supports_logprobs: bool = False
+    requests_per_minute: int = 0  # 0なら制限なし（プロセス内の全エージェントで共有）
+    tokens_per_minute: int = 0
 
 @dataclass
 class AgentConfig:
@@ -177,6 +305,66 @@ class AgentConfig:
     debug_mode: bool = True
     fallback_to_direct: bool = True
     timeout: int = 30
+    max_concurrent_queries: int = 8
+    tool_calling_mode: str = "text"  # "text": TOOL:/DIRECT: 形式, "native": tools= による構造化呼び出し
+    pre_routing: bool = False  # キーワード事前ルーターで明らかなクエリをLLMなしで振り分ける
+    speculative_direct: bool = False  # 判定呼び出しと並行して直接回答を投機的に要求する
+
+@dataclass
+class ToolSpec:
+    """ツールの登録情報（解析済みスキーマと mcp.json の上書き設定を保持）"""
+    name: str
+    description: str
+    input_schema: Dict[str, Any]
+    properties: Dict[str, Any]
+    required: Tuple[str, ...]
+    config: Dict[str, Any]
+    tool: Any = None
+    server: str = ""  # ツールを提供するサーバー名
+    remote_name: str = ""  # サーバー上のツール名（名前が衝突した場合は name が "サーバー名__ツール名" になる）
+    
+    def missing_parameters(self, parameters: Dict[str, Any]) -> List[str]:
+        """不足している必須パラメータを返す"""
+        return [name for name in self.required if name not in parameters]
+    
+    def to_openai_tool(self) -> Dict[str, Any]:
+        """OpenAIのネイティブツール定義に変換"""
+        parameters = self.input_schema or {"type": "object", "properties": {}}
+        return {
+            "type": "function",
+            "function": {
+                "name": self.name,
+                "description": self.description or "",
+                "parameters": parameters
+            }
+        }
+
+@dataclass
+class MCPServerConnection:
+    """MCPサーバー1台分の状態（接続できていない間も保持し、裏で再接続する）"""
+    name: str
+    url: str
+    retry: RetryPolicy
+    pool: Optional[MCPClientPool] = None  # 並行呼び出し用のセッションプール
+    tools: List[Any] = field(default_factory=list)
+    tools_dirty: bool = False  # ツール一覧の変更通知を受けたか
+    connected: bool = False
+    last_error: Optional[str] = None  # 最後に接続できなかった理由
+    reconnect_delay: float = RECONNECT_INITIAL_DELAY
+    retry_at: float = 0.0  # 次に再接続を試みてよい時刻（time.monotonic）
+    connecting: Optional[asyncio.Task] = None  # 実行中の再接続（同時に呼ばれても1つだけ）
+    
+    def mark_connected(self):
+        self.connected = True
+        self.last_error = None
+        self.reconnect_delay = RECONNECT_INITIAL_DELAY
+    
+    def mark_disconnected(self, error: BaseException):
+        """接続に失敗したことを記録し、次に試す時刻を延ばす"""
+        self.connected = False
+        self.last_error = f"{type(error).__name__}: {error}"
+        self.retry_at = time.monotonic() + self.reconnect_delay
+        self.reconnect_delay = min(self.reconnect_delay * 2, RECONNECT_MAX_DELAY)
 
 class ToolDecision(Enum):
     TOOL = "TOOL"
@@ -186,140 +374,756 @@ class ToolDecision(Enum):
 class ConfigurableMCPAgent:
     """設定可能なMCPエージェント"""
     
-    def __init__(self, config_path: str = "mcp.json", server_name: str = "learning-server"):
+    def __init__(self, config_path: str = "mcp.json", server_name: Optional[str] = None):
         self.config_path = config_path
-        self.server_name = server_name
+        self.server_name = server_name  # 指定時はこのサーバーのみ、省略時は clients.default.servers の全サーバーに接続
+        self.debug_override: Optional[bool] = None  # 指定時は agent.debugMode より優先（設定の再読み込み後も維持）
         self.mcp_config: Optional[MCPConfig] = None
-        self.llm_config: Optional[LLMConfig] = None
+        self.llm_config: Optional[LLMConfig] = None  # llm.model（既定モデル）の設定
+        self.model_configs: Dict[str, LLMConfig] = {}  # ルーティングで使うモデルごとの設定
+        self.routing: Optional[RoutingPolicy] = None
+        self.routing_stats = RoutingStats()
+        self.hedging = HedgingPolicy()  # llm.hedging.enabled が true の時だけ重複リクエストを送る
+        # 期限・リトライ・サーキットブレーカー（mcp.json の timeout / retries / maxRetries から構築）
+        self.llm_retry = RetryPolicy()
+        self.retry_stats = {"mcp": RetryStats(), "llm": RetryStats()}
+        self.breakers: Dict[str, CircuitBreaker] = {}
+        self._breaker_config: Dict[str, Any] = {}
         self.agent_config: Optional[AgentConfig] = None
-        self.client: Optional[Client] = None
+        self.servers: Dict[str, MCPServerConnection] = {}  # サーバー名 → 接続
         self.cost_tracker = SessionCostTracker()  # コスト追跡を追加
         self.tools: List[Any] = []
-        self.llm_client: Optional[OpenAI] = None
+        self.tool_registry: Dict[str, ToolSpec] = {}  # ツール名 → 登録情報
+        self.llm_client: Optional["AsyncOpenAI"] = None
+        self._llm_client_users: Dict[Any, int] = {}  # クライアント → 使用中の呼び出し数（APIキー変更後の古いクライアントを閉じる時期の判断に使う）
+        self.response_cache: Optional[LLMResponseCache] = None
+        self.tool_cache = ToolResultCache()  # mcp.json の tools.*.cacheable が true のツールだけが使う
+        # ツールスキーマとシステムプロンプトのキャッシュ（ツール一覧が変わった時だけ再構築）
+        self._tools_schema: str = ""
+        self._system_prompt: str = ""
+        self._openai_tools: List[Dict[str, Any]] = []
+        # キーワード事前ルーター（ツール一覧の更新時に再構築）
+        self.router: Optional[KeywordRouter] = None
+        self.router_stats = RouterStats()
+        self.speculation_stats = SpeculationStats()
+        self.template_answers = 0  # 結果テンプレートで確定し、言い換えのLLM呼び出しを省いた回数
+        self.memory: Optional[ConversationMemory] = None  # 対話セッションの会話メモリ（agent.memory.enabled が true の時のみ）
+        # ユーザーごとの会話履歴とコスト集計（session_id 指定時に使う）。設定・ツール・クライアント・キャッシュは全セッションで共有
+        self.sessions: Optional[SessionManager] = None
+        self.tracer = Tracer()  # フェーズごとのレイテンシ計測（agent.tracing.enabled が true の時のみ記録）
+        self.metrics = AgentMetrics(MetricsRegistry())
+        self.metrics_server: Optional[asyncio.AbstractServer] = None  # agent.metrics.enabled が true の時に /metrics を公開
+        self._tools_refresh_lock = asyncio.Lock()
+        # ウォームスタート（agent.warmStart.enabled が true の時、前回のツール一覧ですぐに開始する）
+        self.snapshot_store: Optional[ToolSnapshotStore] = None
+        self.warm_started = False
+        self._snapshot_fingerprint = ""
+        self._snapshot_catalog: Dict[str, List[Dict[str, Any]]] = {}
+        self._mcp_ready: Optional[asyncio.Task] = None  # ウォームスタート時の裏での接続・再検証
+        self._reconnector: Optional[asyncio.Task] = None  # 接続できていないサーバーへの再接続
         
     async def initialize(self) -> bool:
         """エージェントを初期化"""
+        init_start = time.perf_counter_ns()
         try:
-            # 設定ファイル読み込み
+            # 環境変数を読み込み（設定ファイルの ${VAR} / ENV: の展開に使う）
+            from dotenv import load_dotenv
+            load_dotenv()
+            
+            # 設定ファイル読み込み（検証・環境変数の展開・コンパイル）
             self.mcp_config = MCPConfig(self.config_path)
+            config = self.mcp_config.current
+            self.tracer = Tracer.from_config(config.agent.get("tracing", {}))
+            self.tracer.record("config.load", init_start, time.perf_counter_ns(), category="init")
             
-            # LLM設定の構築
-            llm_config_data = self.mcp_config.get_llm_config()
-            api_key = llm_config_data.get("apiKey", "")
-            
-            # 環境変数の読み込み処理
-            if api_key.startswith("ENV:"):
-                env_var_name = api_key[4:]  # "ENV:" を除去
-                api_key = os.getenv(env_var_name)
-                if not api_key:
-                    raise ValueError(f"環境変数 '{env_var_name}' が設定されていません")
-            elif not api_key:
-                # フォールバック: 直接環境変数から取得
-                api_key = os.getenv("OPENAI_API_KEY")
-                if not api_key:
-                    raise ValueError("OpenAI APIキーが設定されていません")
-            
-            # モデル別設定の取得
-            model_name = llm_config_data.get("model", "gpt-4o-mini")
-            model_settings = llm_config_data.get("modelSettings", {}).get(model_name, {})
-            
-            # トークン設定の決定
-            if model_settings.get("useMaxCompletionTokens", False):
-                max_tokens = model_settings.get("maxCompletionTokens", 500)
-                use_max_completion_tokens = True
-            else:
-                max_tokens = model_settings.get("maxTokens", llm_config_data.get("maxTokens", 500))
-                use_max_completion_tokens = False
+            # LLM・エージェント・期限とリトライの設定を構築
+            self._apply_config(config)
+            self.memory = ConversationMemory.from_config(config.agent.get("memory", {}))
             
-            # 温度設定の決定
-            if model_settings.get("useTemperature", True):
-                temperature = model_settings.get("temperature", llm_config_data.get("temperature", 0.1))
-                use_temperature = True
-            else:
-                temperature = 1.0  # デフォルト値
-                use_temperature = False
-            
-            self.llm_config = LLMConfig(
-                model=model_name,
-                temperature=temperature,
-                max_tokens=max_tokens,
-                api_key=api_key,
-                use_max_completion_tokens=use_max_completion_tokens,
-                use_temperature=use_temperature
-            )
+            client_config = config.clients.get("default", {})
+            server_names = [self.server_name] if self.server_name else list(client_config.get("servers", []))
+            if not server_names:
+                raise ValueError("接続するサーバーが設定されていません（clients.default.servers）")
+            self._create_server_connections(server_names, config)
             
-            # エージェント設定の構築
-            agent_config_data = self.mcp_config.get_agent_config()
-            self.agent_config = AgentConfig(
-                max_iterations=agent_config_data.get("maxIterations", 5),
-                debug_mode=agent_config_data.get("debugMode", True),
-                fallback_to_direct=agent_config_data.get("fallbackToDirect", True),
-                timeout=agent_config_data.get("timeout", 30)
+            # 互いに依存しない準備（LLMクライアント・キャッシュ、MCP接続とツール一覧、メトリクス）を並行に行う
+            await asyncio.gather(
+                self._initialize_llm(config.llm),
+                self._initialize_tools(config.agent.get("warmStart", {})),
+                self._start_metrics_server(config.agent.get("metrics", {}))
             )
             
-            # LLMクライアントの初期化
-            self.llm_client = OpenAI(api_key=self.llm_config.api_key)
-            
-            # サーバーURLの構築
-            server_url = self.mcp_config.build_server_url(self.server_name)
-            
-            # MCPクライアントの初期化
-            self.client = Client(server_url)
-            await self.client.__aenter__()
+            # ユーザーごとのセッションテーブル（アイドル時間とメモリ上限で古いセッションを破棄）
+            self.sessions = SessionManager.from_config(
+                config.agent.get("sessions", {}),
+                memory_factory=functools.partial(ConversationMemory.from_config, config.agent.get("memory", {}), stats_window=8),
+                tracker_factory=SessionCostTracker
+            )
+            self.sessions.start()
             
-            # ツール一覧の取得
-            self.tools = await self.client.list_tools()
+            # 設定ファイルの変更を監視し、次の呼び出しから新しい設定を使う（agent.configReload.enabled が true の時のみ）
+            self.mcp_config.add_listener(self._on_config_change)
+            reload_config = config.agent.get("configReload", {})
+            if reload_config.get("enabled", False):
+                self.mcp_config.start_watching(reload_config.get("intervalSeconds", 2.0))
             
             print(f"✅ エージェント初期化完了")
             print(f"📁 設定ファイル: {self.config_path}")
-            print(f"📡 サーバー: {server_url}")
+            if self.warm_started:
+                print("⚡ ウォームスタート: 前回のツール一覧で開始しました（サーバーへの接続と再検証は裏で実行中）")
+            for connection in self.servers.values():
+                status = "" if connection.connected or self.warm_started else "（未接続・裏で再接続中）"
+                print(f"📡 サーバー: {connection.name} ({connection.url}) - ツール {len(connection.tools)}個{status}")
             print(f"🤖 LLM: {self.llm_config.model}")
-            print(f"🔧 利用可能ツール: {[tool.name for tool in self.tools]}")
+            if len(self.model_configs) > 1:
+                print(f"🔀 モデルルーティング: 判定 {list(self.routing.decision_models)} / 言い換え {list(self.routing.phrasing_models)}")
+            print(f"🔧 利用可能ツール: {list(self.tool_registry)}")
+            if self.mcp_config.watching:
+                print(f"🔁 設定ファイルの変更を監視中（{reload_config.get('intervalSeconds', 2.0)}秒ごと）")
             
+            self.tracer.record("initialize", init_start, time.perf_counter_ns(), category="init")
             return True
             
         except Exception as e:
             print(f"❌ エージェント初期化エラー: {e}")
             return False
     
+    def _apply_config(self, config: CompiledConfig):
+        """コンパイル済みの設定からLLM・エージェント・期限とリトライの設定を構築して差し替える
+        
+        すべて組み立ててから await を挟まずに代入するため、処理中のクエリが新旧の混ざった
+        設定を見ることはない（次の呼び出しから新しい設定が使われる）。
+        """
+        llm_config_data = config.llm
+        # apiKey の ENV:/${VAR} は読み込み時に展開済み。未指定なら環境変数から取得
+        api_key = llm_config_data.get("apiKey", "") or os.getenv("OPENAI_API_KEY")
+        if not api_key:
+            raise ValueError("OpenAI APIキーが設定されていません")
+        
+        # 既定モデルとルーティング対象モデルの設定を構築
+        model_name = llm_config_data.get("model", "gpt-4o-mini")
+        llm_config = self._build_model_config(llm_config_data, model_name, api_key)
+        routing = RoutingPolicy.from_config(llm_config_data.get("routing", {}), model_name)
+        hedging = HedgingPolicy.from_config(llm_config_data.get("hedging", {}))
+        hedging.adopt_samples(self.hedging)
+        model_configs = {model_name: llm_config}
+        for routed_model in routing.all_models():
+            if routed_model not in model_configs:
+                model_configs[routed_model] = self._build_model_config(llm_config_data, routed_model, api_key)
+        
+        # エージェント設定の構築
+        agent_config_data = config.agent
+        agent_config = AgentConfig(
+            max_iterations=agent_config_data.get("maxIterations", 5),
+            debug_mode=self.debug_override if self.debug_override is not None else agent_config_data.get("debugMode", True),
+            fallback_to_direct=agent_config_data.get("fallbackToDirect", True),
+            timeout=agent_config_data.get("timeout", 30),
+            max_concurrent_queries=agent_config_data.get("maxConcurrentQueries", 8),
+            tool_calling_mode=agent_config_data.get("toolCallingMode", "text"),
+            pre_routing=agent_config_data.get("preRouting", False),
+            speculative_direct=agent_config_data.get("speculativeDirect", False)
+        )
+        
+        # 期限とリトライの設定（サーバー固有の値 → clients.default の値の順に適用）
+        client_config = config.clients.get("default", {})
+        llm_retry = RetryPolicy(
+            timeout=llm_config_data.get("timeout", agent_config.timeout),
+            max_retries=llm_config_data.get("maxRetries", client_config.get("maxRetries", 3))
+        )
+        server_retries = {
+            name: self._server_retry(config, name) for name in self.servers if name in config.servers
+        }
+        
+        if self.llm_client is not None and self.llm_config is not None and api_key != self.llm_config.api_key:
+            # 処理中の呼び出しは古いクライアントのまま完了させ、使い終わったら閉じる
+            old_client = self.llm_client
+            self.llm_client = self._create_llm_client(api_key, llm_config_data)
+            if old_client not in self._llm_client_users:
+                asyncio.ensure_future(self._close_llm_client(old_client))
+        self.llm_config = llm_config
+        self.model_configs = model_configs
+        self.routing = routing
+        self.hedging = hedging
+        self.agent_config = agent_config
+        self.llm_retry = llm_retry
+        self._breaker_config = client_config.get("circuitBreaker", {})
+        for breaker in self.breakers.values():
+            breaker.failure_threshold = self._breaker_config.get("failureThreshold", 5)
+            breaker.reset_timeout = self._breaker_config.get("resetTimeoutSeconds", 30)
+        for name, retry in server_retries.items():
+            self.servers[name].retry = retry
+    
+    def _on_config_change(self, old: CompiledConfig, new: CompiledConfig):
+        """設定ファイルの再読み込み時に呼ばれ、新しい設定を反映（例外を送出すると差し替えは取り消される）"""
+        changed = new.changed_sections(old)
+        self._apply_config(new)
+        if "agent.sessions" in changed and self.sessions is not None:
+            updated = SessionManager.from_config(new.agent.get("sessions", {}), self.sessions.memory_factory,
+                                                 self.sessions.tracker_factory)
+            self.sessions.idle_timeout = updated.idle_timeout
+            self.sessions.max_sessions = updated.max_sessions
+            self.sessions.max_memory_bytes = updated.max_memory_bytes
+        if {"tools", "agent.toolCallingMode", "agent.preRouting"} & set(changed):
+            # ツール設定（キーワード・テンプレートなど）が変わったらレジストリとプロンプトを作り直す
+            self._rebuild_tools_cache()
+            if self.snapshot_store is not None:
+                self._snapshot_fingerprint = self._tools_fingerprint(new)
+                self._snapshot_catalog = {}
+                asyncio.ensure_future(self._save_snapshot())
+        
+        # 接続・プール・キャッシュなど起動時に作るものは再起動するまで変わらない
+        restart_required = [
+            name for name in changed
+            if name == "servers" or name.startswith(RESTART_REQUIRED_SETTINGS)
+        ]
+        old_client, new_client = old.clients.get("default", {}), new.clients.get("default", {})
+        if any(old_client.get(key) != new_client.get(key) for key in ("servers", "pool")):
+            restart_required.append("clients.default.servers/pool")
+        print(f"🔁 設定を再読み込みしました（第{new.generation}版, 変更: {changed or 'なし'}）")
+        if restart_required:
+            print(f"⚠️ 次の設定は再起動後に反映されます: {restart_required}")
+    
+    def _breaker(self, name: str) -> CircuitBreaker:
+        """呼び出し先ごとのサーキットブレーカーを取得（なければ作成）"""
+        breaker = self.breakers.get(name)
+        if breaker is None:
+            breaker = self.breakers[name] = CircuitBreaker(
+                name,
+                failure_threshold=self._breaker_config.get("failureThreshold", 5),
+                reset_timeout=self._breaker_config.get("resetTimeoutSeconds", 30)
+            )
+        return breaker
+    
+    def _retry_logger(self, target: str, label: str):
+        """再試行時にメトリクスとデバッグ表示を更新するコールバックを作る"""
+        def on_retry(attempt: int, error: BaseException, delay: float):
+            self.metrics.retries.inc(target=target)
+            if self.agent_config and self.agent_config.debug_mode:
+                print(f"🔁 {label}を再試行します（{attempt}回目, {delay:.2f}秒後）: {type(error).__name__}: {error}")
+        return on_retry
+    
+    async def _call_mcp(self, server_name: str, label: str, make_call) -> Any:
+        """MCPサーバーへの呼び出しに期限・リトライ・サーキットブレーカー（サーバーごと）を適用"""
+        return await call_with_resilience(
+            make_call, self.servers[server_name].retry, self._breaker(f"mcp:{server_name}"),
+            self.retry_stats["mcp"], self._retry_logger("mcp", f"{server_name} の{label}")
+        )
+    
+    async def _initialize_llm(self, llm_config_data: Mapping[str, Any]):
+        """LLMクライアントとレスポンスキャッシュを準備（SQLiteを開く処理はスレッドで行う）"""
+        with self.tracer.span("llm.setup", category="init"):
+            self.llm_client = self._create_llm_client(self.llm_config.api_key, llm_config_data)
+            
+            # LLMレスポンスキャッシュ（llm.cache.enabled が true の時のみ）
+            self.response_cache = await asyncio.to_thread(LLMResponseCache.from_config, llm_config_data.get("cache", {}))
+    
+    def _create_llm_client(self, api_key: str, llm_config_data: Mapping[str, Any]) -> "AsyncOpenAI":
+        """非同期のLLMクライアントを作成（イベントループを塞がない）
+        
+        リトライは自前の層で行うため、SDK側のリトライは無効にする。
+        llm.maxConnections 指定時は、多数の同時クエリに備えてHTTP接続数の上限を広げる。
+        """
+        from openai import AsyncOpenAI
+        max_connections = llm_config_data.get("maxConnections")
+        if not max_connections:
+            return AsyncOpenAI(api_key=api_key, max_retries=0)
+        import httpx
+        from openai import DefaultAsyncHttpxClient
+        http_client = DefaultAsyncHttpxClient(
+            limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections)
+        )
+        return AsyncOpenAI(api_key=api_key, max_retries=0, http_client=http_client)
+    
+    def _acquire_llm_client(self) -> "AsyncOpenAI":
+        """呼び出し1回分、現在のLLMクライアントを借りる（_release_llm_client で返す）"""
+        client = self.llm_client
+        self._llm_client_users[client] = self._llm_client_users.get(client, 0) + 1
+        return client
+    
+    def _release_llm_client(self, client: "AsyncOpenAI"):
+        """借りたクライアントを返す（APIキーの変更で置き換え済みなら、最後の呼び出しの後に閉じる）"""
+        remaining = self._llm_client_users.get(client, 0) - 1
+        if remaining > 0:
+            self._llm_client_users[client] = remaining
+            return
+        self._llm_client_users.pop(client, None)
+        if client is not self.llm_client:
+            asyncio.ensure_future(self._close_llm_client(client))
+    
+    async def _close_llm_client(self, client: "AsyncOpenAI"):
+        try:
+            await client.close()
+        except Exception as e:
+            print(f"⚠️ LLMクライアントのクリーンアップエラー: {e}")
+    
+    async def _start_metrics_server(self, metrics_config: Mapping[str, Any]):
+        """メトリクスエンドポイントの起動（agent.metrics.enabled が true の時のみ）"""
+        if not metrics_config.get("enabled", False):
+            return
+        host = metrics_config.get("host", "127.0.0.1")
+        port = metrics_config.get("port", 9101)
+        self.metrics_server = await start_metrics_server(self.metrics.registry, host, port)
+        print(f"📈 メトリクス: http://{host}:{port}/metrics")
+    
+    async def _initialize_tools(self, warm_start_config: Mapping[str, Any]):
+        """ツール一覧を準備
+
+        有効なスナップショットがあれば、その一覧と構築済みのスキーマ・プロンプトですぐに開始し、
+        サーバーへの接続とライブの list_tools による再検証は裏で行う。
+        なければ全サーバーへ並行に接続して一覧を取得する。
+        """
+        self.snapshot_store = ToolSnapshotStore.from_config(warm_start_config)
+        snapshot = None
+        if self.snapshot_store is not None:
+            self._snapshot_fingerprint = self._tools_fingerprint(self.mcp_config.current)
+            snapshot = await asyncio.to_thread(self.snapshot_store.load, self._snapshot_fingerprint, list(self.servers))
+        
+        if snapshot is None:
+            await self._connect_servers()
+            await self.refresh_tools()
+            return
+        
+        with self.tracer.span("tools.snapshot", category="init"):
+            for name, connection in self.servers.items():
+                connection.tools = snapshot.tools_for(name)
+            self._snapshot_catalog = snapshot.catalog
+            self._rebuild_tools_cache(snapshot.prebuilt)
+        self.warm_started = True
+        self._mcp_ready = asyncio.create_task(self._revalidate_tools())
+        self._mcp_ready.add_done_callback(self._report_revalidation)
+    
+    def _tools_fingerprint(self, config: CompiledConfig) -> str:
+        """スナップショットが現在の設定で作られたかを判定するためのハッシュ"""
+        return config_fingerprint({
+            "servers": {name: connection.url for name, connection in self.servers.items()},
+            "tools": thaw(config.tools),
+            "toolCallingMode": self.agent_config.tool_calling_mode,
+            "prompts": [self._build_system_prompt(""), self._build_native_system_prompt()]
+        })
+    
+    async def _revalidate_tools(self):
+        """裏でサーバーへ接続し、スナップショットのツール一覧をライブの一覧で置き換える"""
+        with self.tracer.span("tools.revalidate", category="init"):
+            snapshot_catalog = self._snapshot_catalog
+            try:
+                await self._connect_servers()
+            except ConnectionError:
+                # スナップショットの一覧で動き続けるので、諦めずに間隔を延ばしながら再接続を続ける
+                self._start_reconnecting()
+                raise
+            await self.refresh_tools()
+        if self.agent_config.debug_mode:
+            changed = self._snapshot_catalog != snapshot_catalog
+            print(f"🔄 ツール一覧を再検証しました（{'変更あり・スナップショットを更新' if changed else '変更なし'}）")
+    
+    def _report_revalidation(self, task: asyncio.Task):
+        """裏での接続・再検証の失敗を表示（再接続は _reconnect_loop が続ける）"""
+        if not task.cancelled() and task.exception() is not None:
+            print(f"⚠️ ツール一覧の再検証エラー（裏で再接続を続けます）: {task.exception()}")
+    
+    @property
+    def mcp_status(self) -> str:
+        """MCPの状態（"ok"、ウォームスタートの接続・再検証中は "connecting"、どのサーバーにも未接続なら "unavailable"）"""
+        if self._mcp_ready is not None and not self._mcp_ready.done():
+            return "connecting"
+        if not any(connection.connected for connection in self.servers.values()):
+            return "unavailable"
+        return "ok"
+    
+    def get_server_status(self) -> Dict[str, Dict[str, Any]]:
+        """サーバーごとの接続状態"""
+        return {
+            name: {"connected": connection.connected, "last_error": connection.last_error, "tools": len(connection.tools)}
+            for name, connection in self.servers.items()
+        }
+    
+    async def _wait_for_servers(self):
+        """ウォームスタート時は裏での接続が終わるまで待つ（失敗していたら呼び出し先のサーバーへ再接続を試みる）"""
+        if self._mcp_ready is not None and not self._mcp_ready.done():
+            await asyncio.shield(self._mcp_ready)
+    
+    async def _save_snapshot(self):
+        """ツール一覧が保存済みの内容から変わっていればスナップショットを更新"""
+        if self.snapshot_store is None:
+            return
+        catalog = tool_catalog({name: connection.tools for name, connection in self.servers.items()})
+        if catalog == self._snapshot_catalog:
+            return
+        prebuilt = {
+            "toolsSchema": self._tools_schema,
+            "systemPrompt": self._system_prompt,
+            "openaiTools": self._openai_tools
+        }
+        try:
+            await asyncio.to_thread(self.snapshot_store.save, self._snapshot_fingerprint, catalog, prebuilt)
+            self._snapshot_catalog = catalog
+        except OSError as e:
+            print(f"⚠️ ツール一覧のスナップショット保存エラー: {e}")
+    
+    def _server_retry(self, config: CompiledConfig, server_name: str) -> RetryPolicy:
+        """サーバーへの呼び出しの期限とリトライ（サーバー固有の値 → clients.default の値の順に適用）"""
+        client_config = config.clients.get("default", {})
+        server = config.server(server_name)
+        return RetryPolicy(
+            timeout=server.timeout if server.timeout is not None else client_config.get("timeout", 30),
+            max_retries=server.retries if server.retries is not None else client_config.get("maxRetries", 3)
+        )
+    
+    def _create_server_connections(self, server_names: List[str], config: CompiledConfig):
+        """設定されたサーバーごとの接続情報とセッションプールを作成（接続はまだ行わない）"""
+        pool_config = config.clients.get("default", {}).get("pool", {})
+        for name in server_names:
+            server = config.server(name)
+            connection = MCPServerConnection(
+                name=name,
+                url=server.url,
+                retry=self._server_retry(config, name)
+            )
+            connection.pool = MCPClientPool(
+                name,
+                functools.partial(self._create_client, connection),
+                size=server.pool_size or pool_config.get("size", 4),
+                min_size=pool_config.get("minSize", 1),
+                health_check_interval=pool_config.get("healthCheckIntervalSeconds", 30)
+            )
+            self.servers[name] = connection
+    
+    async def _connect_servers(self):
+        """全サーバーへ並行に接続（接続できなかったサーバーは未接続のまま残し、裏で再接続を続ける）"""
+        connections = list(self.servers.values())
+        results = await asyncio.gather(
+            *(self._connect_server(connection) for connection in connections),
+            return_exceptions=True
+        )
+        for connection, result in zip(connections, results):
+            if isinstance(result, BaseException):
+                connection.mark_disconnected(result)
+                print(f"⚠️ サーバー '{connection.name}' に接続できませんでした: {result}")
+            else:
+                connection.mark_connected()
+        if not any(connection.connected for connection in connections):
+            raise ConnectionError("どのMCPサーバーにも接続できませんでした")
+        self._start_reconnecting()
+    
+    def _start_reconnecting(self):
+        """接続できていないサーバーがあれば、裏での再接続を開始"""
+        if not any(not connection.connected for connection in self.servers.values()):
+            return
+        if self._reconnector is None or self._reconnector.done():
+            self._reconnector = asyncio.create_task(self._reconnect_loop())
+    
+    async def _reconnect_loop(self):
+        """接続できていないサーバーへ、間隔を延ばしながら再接続を試みる（全サーバーにつながったら終了）"""
+        while True:
+            pending = [connection for connection in self.servers.values() if not connection.connected]
+            if not pending:
+                return
+            await asyncio.sleep(max(0.0, min(connection.retry_at for connection in pending) - time.monotonic()))
+            now = time.monotonic()
+            await asyncio.gather(*(self._reconnect(connection) for connection in pending if connection.retry_at <= now))
+    
+    async def _ensure_connected(self, connection: MCPServerConnection) -> bool:
+        """ツール呼び出しの前に接続を確認（未接続なら再接続を試みる。待機間隔中は試さずにFalse）"""
+        if connection.connected:
+            return True
+        if connection.connecting is None and time.monotonic() < connection.retry_at:
+            return False
+        return await self._reconnect(connection)
+    
+    async def _reconnect(self, connection: MCPServerConnection) -> bool:
+        """未接続のサーバーへ再接続し、ツール一覧を取得（同時に呼ばれても接続処理は1つだけ）"""
+        if connection.connected:
+            return True
+        if connection.connecting is None or connection.connecting.done():
+            connection.connecting = asyncio.create_task(self._connect_and_refresh(connection))
+        await asyncio.shield(connection.connecting)
+        return connection.connected
+    
+    async def _connect_and_refresh(self, connection: MCPServerConnection):
+        try:
+            await self._connect_server(connection)
+        except Exception as e:
+            connection.mark_disconnected(e)
+            if self.agent_config and self.agent_config.debug_mode:
+                print(f"⚠️ サーバー '{connection.name}' への再接続に失敗しました（{connection.retry_at - time.monotonic():.0f}秒後に再試行）: {e}")
+            return
+        finally:
+            connection.connecting = None
+        connection.mark_connected()
+        print(f"🔌 サーバー '{connection.name}' に接続しました")
+        try:
+            await self.refresh_tools([connection.name])
+        except Exception as e:
+            # 取得できなかった一覧は tools_dirty のまま残り、次のクエリで再取得する
+            print(f"⚠️ {connection.name} のツール一覧の取得エラー: {e}")
+    
+    def _create_client(self, connection: MCPServerConnection) -> "Client":
+        """プールに追加するMCPクライアントを作成"""
+        from fastmcp import Client
+        return Client(connection.url, message_handler=functools.partial(self._handle_mcp_message, connection.name))
+    
+    async def _connect_server(self, connection: MCPServerConnection):
+        """1台のサーバーに接続（プールの最小セッション数を確保）"""
+        with self.tracer.span("mcp.connect", category="init", server=connection.name):
+            await self._call_mcp(connection.name, "接続", connection.pool.start)
+    
+    async def _with_session(self, server_name: str, use) -> Any:
+        """プールからセッションを借りて use(client) を実行し、待ち時間をメトリクスに記録"""
+        pool = self.servers[server_name].pool
+        started_at = time.perf_counter()
+        async with pool.session() as client:
+            self.metrics.mcp_pool_wait.observe(time.perf_counter() - started_at, server=server_name)
+            # 同時に借りる呼び出しと競合しないよう、pool.in_use を読まずに自分の分だけ増減する
+            self.metrics.mcp_pool_in_use.inc(server=server_name)
+            try:
+                return await use(client)
+            finally:
+                self.metrics.mcp_pool_in_use.dec(server=server_name)
+    
+    async def _call_llm(self, label: str, make_call, model: str, before_attempt=None) -> Any:
+        """LLMへの呼び出しに期限・リトライ・サーキットブレーカー（モデルごと）を適用"""
+        return await call_with_resilience(
+            make_call, self.llm_retry, self._breaker(f"llm:{model}"),
+            self.retry_stats["llm"], self._retry_logger("llm", f"{label or 'LLM'}({model})"),
+            before_attempt=before_attempt
+        )
+    
+    def _rate_limit_each_attempt(self, request_params: Dict[str, Any], label: str = ""):
+        """再試行を含む各試行の前にレート制限の枠を確保する before_attempt と、最後に確保した (limiter, 見積もり) を返す
+        
+        再試行は同じリクエストを丸ごと送り直すので、1回ごとに上限へ計上する。
+        失敗した試行は相手に届いて処理された可能性があるため、確保した分はそのまま残す。
+        """
+        reservation: List[Any] = [None, 0]
+        async def acquire():
+            reservation[:] = await self._acquire_rate_limit(request_params, label)
+        return acquire, reservation
+    
+    def _build_model_config(self, llm_config_data: Mapping[str, Any], model_name: str, api_key: str) -> LLMConfig:
+        """llm.modelSettings からモデル別の設定を構築"""
+        model_settings = llm_config_data.get("modelSettings", {}).get(model_name, {})
+        
+        # トークン設定の決定
+        if model_settings.get("useMaxCompletionTokens", False):
+            max_tokens = model_settings.get("maxCompletionTokens", 500)
+            use_max_completion_tokens = True
+        else:
+            max_tokens = model_settings.get("maxTokens", llm_config_data.get("maxTokens", 500))
+            use_max_completion_tokens = False
+        
+        # 温度設定の決定
+        if model_settings.get("useTemperature", True):
+            temperature = model_settings.get("temperature", llm_config_data.get("temperature", 0.1))
+            use_temperature = True
+        else:
+            temperature = 1.0  # デフォルト値
+            use_temperature = False
+        
+        return LLMConfig(
+            model=model_name,
+            temperature=temperature,
+            max_tokens=max_tokens,
+            api_key=api_key,
+            use_max_completion_tokens=use_max_completion_tokens,
+            use_temperature=use_temperature,
+            supports_logprobs=model_settings.get("supportsLogprobs", False),
+            requests_per_minute=model_settings.get("requestsPerMinute", 0),
+            tokens_per_minute=model_settings.get("tokensPerMinute", 0)
+        )
+    
+    def _rate_limiter(self, model: str) -> Optional[RateLimiter]:
+        """モデルの共有レートリミッターを取得（上限が未設定ならNone）"""
+        llm_config = self.model_configs.get(model)
+        if llm_config is None:
+            return None
+        return get_rate_limiter(model, llm_config.requests_per_minute, llm_config.tokens_per_minute)
+    
+    def _estimate_request_tokens(self, request_params: Dict[str, Any]) -> int:
+        """レート制限用に1回の呼び出しで消費するトークン数を見積もる（入力 + 出力上限）"""
+        estimated = estimate_messages_tokens(request_params["messages"])
+        if request_params.get("tools"):
+            estimated += estimate_tokens(json.dumps(request_params["tools"], ensure_ascii=False))
+        return estimated + request_params.get("max_completion_tokens", request_params.get("max_tokens", 0))
+    
+    async def _acquire_rate_limit(self, request_params: Dict[str, Any], label: str = "") -> Tuple[Optional[RateLimiter], int]:
+        """上限に空きができるまで待ってから枠を確保（返り値の見積もりは usage で精算する）"""
+        model = request_params["model"]
+        limiter = self._rate_limiter(model)
+        if limiter is None:
+            return None, 0
+        estimated = self._estimate_request_tokens(request_params)
+        started_ns = time.perf_counter_ns()
+        waited = await limiter.acquire(estimated)
+        self.metrics.rate_limit_wait.observe(waited, model=model)
+        if waited > 0.001:
+            self.tracer.record("llm.rate_limit", started_ns, time.perf_counter_ns(), category="llm",
+                               label=label, model=model, estimated_tokens=estimated)
+            if self.agent_config.debug_mode:
+                print(f"⏳ {label or 'LLM'}({model}) はレート制限のため {waited:.2f}秒 待機しました")
+        return limiter, estimated
+    
     async def cleanup(self):
         """リソースのクリーンアップ"""
-        if self.client:
-            try:
-                await self.client.__aexit__(None, None, None)
-            except Exception as e:
-                print(f"⚠️ クリーンアップエラー: {e}")
+        if self.mcp_config is not None:
+            await self.mcp_config.stop_watching()
+        if self.sessions is not None:
+            await self.sessions.stop()
+        background = [self._mcp_ready, self._reconnector] + [connection.connecting for connection in self.servers.values()]
+        background = [task for task in background if task is not None and not task.done()]
+        for task in background:
+            task.cancel()
+        await asyncio.gather(*background, return_exceptions=True)
+        if self.metrics_server:
+            self.metrics_server.close()
+            await self.metrics_server.wait_closed()
+        if self.servers:
+            results = await asyncio.gather(
+                *(connection.pool.close() for connection in self.servers.values()),
+                return_exceptions=True
+            )
+            for name, result in zip(self.servers, results):
+                if isinstance(result, Exception):
+                    print(f"⚠️ クリーンアップエラー ({name}): {result}")
+        if self.llm_client:
+            # 置き換え済みでまだ使用中のクライアントも含めて閉じる
+            clients = [self.llm_client] + [client for client in self._llm_client_users if client is not self.llm_client]
+            self._llm_client_users.clear()
+            await asyncio.gather(*(self._close_llm_client(client) for client in clients))
+        if self.response_cache:
+            self.response_cache.close()
+        try:
+            for path in self.tracer.export():
+                print(f"🧵 トレースを保存しました: {path}")
+        except Exception as e:
+            print(f"⚠️ トレース保存エラー: {e}")
+    
+    async def _handle_mcp_message(self, server_name: str, message: Any):
+        """サーバーからの通知を処理（ツール一覧の変更を検知）"""
+        root = getattr(message, "root", None)
+        if getattr(root, "method", None) == "notifications/tools/list_changed":
+            # 受信ループ内でリクエストを送るとデッドロックするため、次のクエリで再取得する
+            self.servers[server_name].tools_dirty = True
+            if self.agent_config and self.agent_config.debug_mode:
+                print(f"🔔 {server_name} からツール一覧の変更通知を受信しました")
+    
+    async def refresh_tools(self, server_names: Optional[List[str]] = None):
+        """ツール一覧を再取得し、スキーマとシステムプロンプトを再構築（省略時は全サーバー）"""
+        async with self._tools_refresh_lock:
+            if server_names is None:
+                server_names = [name for name, connection in self.servers.items() if connection.connected]
+            connections = [self.servers[name] for name in server_names]
+            if not connections:
+                return
+            for connection in connections:
+                connection.tools_dirty = False
+            results = await asyncio.gather(
+                *(self._list_server_tools(connection) for connection in connections),
+                return_exceptions=True
+            )
+            errors = [result for result in results if isinstance(result, BaseException)]
+            if len(errors) == len(connections):
+                for connection in connections:
+                    connection.tools_dirty = True
+                raise errors[0]
+            for connection, result in zip(connections, results):
+                if isinstance(result, BaseException):
+                    # 取得できなかったサーバーは前回のツール一覧を使い、次のクエリで再取得する
+                    connection.tools_dirty = True
+                    print(f"⚠️ {connection.name} のツール一覧の取得エラー: {result}")
+            self._rebuild_tools_cache()
+        await self._save_snapshot()
+    
+    async def _list_server_tools(self, connection: MCPServerConnection):
+        """1台のサーバーのツール一覧を取得"""
+        with self.tracer.span("mcp.list_tools", category="mcp", server=connection.name):
+            connection.tools = await self._call_mcp(
+                connection.name, "ツール一覧取得",
+                lambda: self._with_session(connection.name, lambda client: client.list_tools())
+            )
+    
+    async def _ensure_tools_fresh(self):
+        """変更通知を受けたサーバーがあればツール一覧を更新（失敗時は既存のキャッシュで続行）"""
+        dirty = [name for name, connection in self.servers.items() if connection.tools_dirty and connection.connected]
+        if not dirty:
+            return
+        try:
+            await self.refresh_tools(dirty)
+        except Exception as e:
+            print(f"⚠️ ツール一覧の再取得エラー: {e}")
+    
+    def _rebuild_tools_cache(self, prebuilt: Optional[Dict[str, Any]] = None):
+        """ツールレジストリ、スキーマ、システムプロンプトを再構築（prebuilt があれば構築済みの値を使う）"""
+        self.tools = [tool for connection in self.servers.values() for tool in connection.tools]
+        self.tool_registry = self._build_tool_registry()
+        if self.agent_config.pre_routing:
+            tool_configs = {name: spec.config for name, spec in self.tool_registry.items()}
+            self.router = KeywordRouter(tool_configs, self.tool_registry)
+        else:
+            self.router = None
+        if prebuilt:
+            self._tools_schema = prebuilt["toolsSchema"]
+            self._openai_tools = prebuilt["openaiTools"]
+            self._system_prompt = prebuilt["systemPrompt"]
+            return
+        self._tools_schema = self._create_tools_schema()
+        self._openai_tools = [spec.to_openai_tool() for spec in self.tool_registry.values()]
+        if self.agent_config.tool_calling_mode == "native":
+            self._system_prompt = self._build_native_system_prompt()
+        else:
+            self._system_prompt = self._build_system_prompt(self._tools_schema)
+    
+    def _build_tool_registry(self) -> Dict[str, ToolSpec]:
+        """全サーバーのツール一覧から名前をキーにしたレジストリを構築
+
+        複数のサーバーが同じ名前のツールを提供する場合は "サーバー名__ツール名" で区別する。
+        """
+        name_counts: Dict[str, int] = {}
+        for connection in self.servers.values():
+            for tool in connection.tools:
+                name_counts[tool.name] = name_counts.get(tool.name, 0) + 1
+        
+        registry = {}
+        for connection in self.servers.values():
+            for tool in connection.tools:
+                schema = getattr(tool, 'inputSchema', None) or {}
+                name = f"{connection.name}__{tool.name}" if name_counts[tool.name] > 1 else tool.name
+                
+                # 設定ファイルからツール固有の情報を取得（名前空間付きの設定を優先）
+                config = self.mcp_config.current
+                tool_config = dict(config.tool(name) or config.tool(tool.name))
+                
+                registry[name] = ToolSpec(
+                    name=name,
+                    description=tool_config.get("description", tool.description),
+                    input_schema=schema,
+                    properties=schema.get('properties', {}),
+                    required=tuple(schema.get('required', [])),
+                    config=tool_config,
+                    tool=tool,
+                    server=connection.name,
+                    remote_name=tool.name
+                )
+        return registry
     
     def _create_tools_schema(self) -> str:
         """利用可能なツールのスキーマ情報を生成"""
         tools_info = []
-        for tool in self.tools:
-            schema = getattr(tool, 'inputSchema', {})
-            properties = schema.get('properties', {}) if schema else {}
-            required = schema.get('required', []) if schema else {}
-            
-            # 設定ファイルからツール固有の情報を取得
-            tool_config = self.mcp_config.get_tool_config(tool.name)
-            description = tool_config.get("description", tool.description)
-            
-            tool_info = f"- {tool.name}: {description}"
-            if properties:
+        for spec in self.tool_registry.values():
+            tool_info = f"- {spec.name}: {spec.description}"
+            if spec.properties:
                 param_details = []
-                for param_name, param_info in properties.items():
+                for param_name, param_info in spec.properties.items():
                     param_type = param_info.get('type', 'string')
-                    is_required = param_name in required
+                    is_required = param_name in spec.required
                     param_details.append(f"{param_name}({param_type}{'必須' if is_required else '任意'})")
                 tool_info += f" [パラメータ: {', '.join(param_details)}]"
             tools_info.append(tool_info)
         
         return "\n".join(tools_info)
     
-    async def _ask_llm_for_decision(self, user_input: str) -> Tuple[ToolDecision, str, Dict[str, Any]]:
-        """LLMにツール選択とパラメータ生成を依頼"""
-        try:
-            tools_schema = self._create_tools_schema()
-            
-            system_prompt = f"""あなたはツール選択の専門家です。ユーザーの入力に基づいて、最適なツールを選択し、必要なパラメータを生成してください。
+    def _build_system_prompt(self, tools_schema: str) -> str:
+        """ツール選択用のシステムプロンプトを生成"""
+        return f"""あなたはツール選択の専門家です。ユーザーの入力に基づいて、最適なツールを選択し、必要なパラメータを生成してください。
 
 利用可能なツール:
 {tools_schema}
@@ -337,102 +1141,653 @@ class ConfigurableMCPAgent:
 - 初回入力: "5 と 3 を掛けて" → 出力: "TOOL: multiply\n{{"a": 5, "b": 3}}"
 - 初回入力: "東京の天気は？" → 出力: "TOOL: get_weather\n{{"city": "東京"}}"
 - 初回入力: "こんにちは" → 出力: "DIRECT: こんにちは！何かお手伝いできることはありますか？"
-- ツール結果後: "結果: get_weather(city=名古屋) = 雨、気温25度、湿度80%" → 出力: "DIRECT: 名古屋の天気は雨で、気温は25度、湿度は80%です。"
-- ツール結果後: "結果: multiply(a=3, b=6) = 18" → 出力: "DIRECT: 3と6を掛けると18になります。"
+- ツール結果後: "元の質問: 名古屋の天気は？\n結果: get_weather(city=名古屋) = 雨、気温25度、湿度80%" → 出力: "DIRECT: 名古屋の天気は雨で、気温は25度、湿度は80%です。"
+- ツール結果後: "元の質問: 3 と 6 を掛けて\n結果: multiply(a=3, b=6) = 18" → 出力: "DIRECT: 3と6を掛けると18になります。"
 
 重要: パラメータは必ずJSON形式で出力し、必須パラメータは必ず含めてください。"""
-
-            # リクエストパラメータ
-            request_params = {
-                "model": self.llm_config.model,
-                "messages": [
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": user_input}
-                ]
-            }
-            
-            # モデル別の温度設定
-            if self.llm_config.use_temperature:
-                request_params["temperature"] = self.llm_config.temperature
-            
-            # モデル別のトークン設定
-            if self.llm_config.use_max_completion_tokens:
-                request_params["max_completion_tokens"] = self.llm_config.max_tokens
-            else:
-                request_params["max_tokens"] = self.llm_config.max_tokens
-            
-            response = self.llm_client.chat.completions.create(**request_params)
-            
-            # コスト追跡を追加
+    
+    def _build_native_system_prompt(self) -> str:
+        """ネイティブツール呼び出し用の短いシステムプロンプトを生成（ツール定義は tools= で渡す）"""
+        return """あなたはツールを使ってユーザーの質問に答えるアシスタントです。
+必要な場合は提供されたツールを呼び出し、必須パラメータは必ず指定してください。
+ツールが不要な場合や、ツール実行結果（「元の質問: ...」と「結果: ...」）を受け取った場合は、ツールを呼ばずに自然な日本語で具体的に回答してください。"""
+    
+    def _build_request_params(self, messages: List[Dict[str, str]], model: Optional[str] = None) -> Dict[str, Any]:
+        """モデル別設定を反映したリクエストパラメータを生成（model 省略時は既定モデル）"""
+        llm_config = self.model_configs.get(model, self.llm_config) if model else self.llm_config
+        request_params = {
+            "model": llm_config.model,
+            "messages": messages
+        }
+        
+        # モデル別の温度設定
+        if llm_config.use_temperature:
+            request_params["temperature"] = llm_config.temperature
+        
+        # モデル別のトークン設定
+        if llm_config.use_max_completion_tokens:
+            request_params["max_completion_tokens"] = llm_config.max_tokens
+        else:
+            request_params["max_tokens"] = llm_config.max_tokens
+        
+        return request_params
+    
+    def _retarget_params(self, request_params: Dict[str, Any], model: str) -> Dict[str, Any]:
+        """リクエストパラメータを別モデル向けに作り直す（モデル固有の設定は差し替え）"""
+        model_specific = ("model", "temperature", "max_tokens", "max_completion_tokens", "logprobs", "top_logprobs")
+        retargeted = self._build_request_params(request_params["messages"], model)
+        retargeted.update({key: value for key, value in request_params.items() if key not in model_specific})
+        if request_params.get("logprobs") and self.model_configs[model].supports_logprobs:
+            retargeted["logprobs"] = True
+        return retargeted
+    
+    def _phrasing_model(self) -> str:
+        """言い換え・直接回答・要約に使うモデル（チェーンの先頭 = 最も安いもの）"""
+        return self.routing.phrasing_models[0]
+    
+    async def _create_completion(self, request_params: Dict[str, Any], label: str = "") -> Any:
+        """LLMを呼び出す（失敗時は llm.routing.fallbacks の代替モデルで再試行）"""
+        tried = set()
+        while True:
+            model = request_params["model"]
+            tried.add(model)
             try:
-                cost_calc = UsageCostCalculator(response)
-                self.cost_tracker.add_usage(cost_calc)
+                return await self._create_completion_once(request_params, label)
+            except Exception as e:
+                fallback_model = self.routing.fallbacks.get(model) if self.routing else None
+                if not fallback_model or fallback_model in tried:
+                    raise
+                self.routing_stats.fallbacks += 1
                 if self.agent_config.debug_mode:
-                    summary = cost_calc.get_summary()
-                    print(f"💰 コスト: ${summary['total_cost']:.6f} (入力: {summary['prompt_tokens']}t, 出力: {summary['completion_tokens']}t)")
+                    print(f"⚠️ {model} の呼び出しに失敗したため {fallback_model} で再試行します: {e}")
+                request_params = self._retarget_params(request_params, fallback_model)
+    
+    async def _create_completion_once(self, request_params: Dict[str, Any], label: str = "") -> Any:
+        """LLMを非同期に呼び出し、コストを記録（キャッシュ有効時はキャッシュを優先）"""
+        if self.response_cache is not None:
+            cached = await self.response_cache.get(request_params)
+            if cached is not None:
+                from openai.types.chat import ChatCompletion
+                response = ChatCompletion.model_validate_json(cached)
+                self._record_cache_hit(response, label)
+                return response
+            self._for_each_tracker(lambda tracker: tracker.add_cache_miss())
+        
+        acquire, reservation = self._rate_limit_each_attempt(request_params, label)
+        started_at = time.perf_counter()
+        with self.tracer.span("llm.completion", category="llm", label=label, model=request_params.get("model")):
+            try:
+                response = await self._call_llm(
+                    label, lambda: self._call_llm_hedged(request_params, label), request_params["model"],
+                    before_attempt=acquire
+                )
+            except Exception as e:
+                limiter, estimated = reservation
+                if limiter is not None and not is_retryable_error(e):
+                    # リクエスト自体が拒否された（不正なパラメータなど）場合だけ最後の試行の分を返却
+                    limiter.reconcile(estimated, 0)
+                self.metrics.errors.inc(kind="llm")
+                raise
+        limiter, estimated = reservation
+        if limiter is not None:
+            usage = getattr(response, "usage", None)
+            limiter.reconcile(estimated, usage.total_tokens if usage is not None else estimated)
+        self.metrics.llm_latency.observe(time.perf_counter() - started_at, model=request_params.get("model", ""))
+        self._record_usage(response, label)
+        
+        if self.response_cache is not None:
+            try:
+                await self.response_cache.set(request_params, response.model_dump_json())
             except Exception as e:
                 if self.agent_config.debug_mode:
-                    print(f"⚠️  コスト計算エラー: {e}")
+                    print(f"⚠️  キャッシュ保存エラー: {e}")
+        
+        return response
+    
+    async def _call_llm_hedged(self, request_params: Dict[str, Any], label: str = "") -> Any:
+        """LLM APIを呼び出す（ヘッジ有効時は遅い呼び出しに重複リクエストを送る。ストリーミングは対象外）"""
+        model = request_params["model"]
+        async def create():
+            client = self._acquire_llm_client()
+            try:
+                return await client.chat.completions.create(**request_params)
+            finally:
+                self._release_llm_client(client)
+        
+        outcome = await self.hedging.run(model, create)
+        if outcome.hedged:
+            self._record_hedge(outcome, request_params, label)
+        return outcome.result
+    
+    def _record_hedge(self, outcome: HedgeOutcome, request_params: Dict[str, Any], label: str = ""):
+        """採用されなかった側のトークンとコストを追加分として記録"""
+        model = request_params["model"]
+        loser = outcome.loser
+        if loser is not None and loser.done() and not loser.cancelled() and loser.exception() is None:
+            # 両方完了していた場合は実際の使用量がそのまま追加コストになる
+            cost_calc = UsageCostCalculator(loser.result())
+            self._record_usage(loser.result(), f"{label}ヘッジ(不採用)")
+            extra_tokens, extra_cost = cost_calc.total_tokens, cost_calc.total_cost
+        else:
+            # 取り消した側は送信済みの入力トークン分を見積もりで計上する
+            extra_tokens = estimate_messages_tokens(request_params["messages"])
+            extra_cost = extra_tokens * MODEL_RATES.get(model, {"input": 0.15})["input"] / 1000
+        
+        self._for_each_tracker(lambda tracker: tracker.add_hedge(outcome.hedge_won, extra_tokens, extra_cost))
+        limiter = self._rate_limiter(model)
+        if limiter is not None:
+            # 重複リクエストは確保を経ずに送っているので、後から上限に計上する
+            limiter.charge(extra_tokens)
+        self.metrics.llm_hedges.inc(model=model, winner="hedge" if outcome.hedge_won else "primary")
+        if self.agent_config.debug_mode:
+            winner = "重複リクエスト" if outcome.hedge_won else "元のリクエスト"
+            print(f"🪞 {label}ヘッジ発動: {winner}を採用 (追加: {extra_tokens}t, ${extra_cost:.6f})")
+    
+    def _for_each_tracker(self, update):
+        """エージェント全体・ユーザーのセッション・実行中クエリのトラッカーを更新"""
+        update(self.cost_tracker)
+        for tracker in (_session_cost_tracker.get(), _query_cost_tracker.get()):
+            if tracker is not None:
+                update(tracker)
+    
+    def _record_usage(self, response: Any, label: str = ""):
+        """レスポンスの使用量とコストを記録"""
+        try:
+            cost_calc = UsageCostCalculator(response)
+            self._for_each_tracker(lambda tracker: tracker.add_usage(cost_calc))
+            self.metrics.llm_requests.inc(model=cost_calc.model, cached="false")
+            self.metrics.llm_tokens.inc(cost_calc.prompt_tokens, model=cost_calc.model, type="prompt")
+            self.metrics.llm_tokens.inc(cost_calc.completion_tokens, model=cost_calc.model, type="completion")
+            self.metrics.llm_cost.inc(cost_calc.total_cost, model=cost_calc.model)
+            if self.agent_config.debug_mode:
+                summary = cost_calc.get_summary()
+                print(f"💰 {label}コスト: ${summary['total_cost']:.6f} (入力: {summary['prompt_tokens']}t, 出力: {summary['completion_tokens']}t)")
+        except Exception as e:
+            if self.agent_config.debug_mode:
+                print(f"⚠️  {label}コスト計算エラー: {e}")
+    
+    def _record_cache_hit(self, response: Any, label: str = ""):
+        """キャッシュヒットと節約できたコストを記録"""
+        try:
+            cost_calc = UsageCostCalculator(response)
+            self._for_each_tracker(lambda tracker: tracker.add_cache_hit(cost_calc))
+            self.metrics.llm_requests.inc(model=cost_calc.model, cached="true")
+            if self.agent_config.debug_mode:
+                print(f"💾 {label}キャッシュヒット: ${cost_calc.total_cost:.6f} 節約")
+        except Exception as e:
+            if self.agent_config.debug_mode:
+                print(f"⚠️  {label}キャッシュコスト計算エラー: {e}")
+    
+    async def _ask_llm_for_decision(self, observation: str, user_input: Optional[str] = None,
+                                    memory: Optional[ConversationMemory] = None) -> Tuple[ToolDecision, str, Dict[str, Any]]:
+        """LLMにツール選択とパラメータ生成を依頼（安いモデルから試し、必要なら上位モデルへ格上げ）"""
+        user_input = user_input or observation
+        chain = self._model_chain(observation, user_input)
+        
+        result: Tuple[ToolDecision, str, Dict[str, Any]] = (ToolDecision.ERROR, "モデルが設定されていません", {})
+        for index, model in enumerate(chain):
+            result, confidence = await self._ask_model_for_decision(model, observation, user_input, memory)
+            reason = self._escalation_reason(result, confidence)
+            if reason is None or index == len(chain) - 1:
+                return result
+            self._record_escalation(model, chain[index + 1], reason)
+        return result
+    
+    def _model_chain(self, observation: str, user_input: str) -> Tuple[str, ...]:
+        """初回の判定はツール選択用、ツール結果を受けた後は言い換え用のチェーンを使う"""
+        if observation == user_input:
+            return self.routing.decision_models
+        return self.routing.phrasing_models
+    
+    def _record_escalation(self, model: str, next_model: str, reason: str):
+        """上位モデルへの格上げを記録"""
+        self.routing_stats.record_escalation(reason)
+        if self.agent_config.debug_mode:
+            print(f"⬆️ {model} → {next_model} に格上げします（理由: {reason}）")
+    
+    async def _ask_model_for_decision(self, model: str, observation: str, user_input: str,
+                                      memory: Optional[ConversationMemory] = None) -> Tuple[Tuple[ToolDecision, str, Dict[str, Any]], Optional[float]]:
+        """指定モデルで判定し、(判定結果, 確信度) を返す"""
+        try:
+            request_params = self._build_request_params(
+                self._decision_messages(observation, user_input, memory), model
+            )
+            
+            # ネイティブモードではツール定義を tools= で渡す
+            if self._use_native_tools():
+                request_params["tools"] = self._openai_tools
+                request_params["tool_choice"] = "auto"
             
-            response_text = response.choices[0].message.content.strip()
+            # 確信度で格上げする場合は、対応モデルでのみ logprobs を要求する
+            if self.routing.min_confidence > 0 and self.model_configs[model].supports_logprobs:
+                request_params["logprobs"] = True
+            
+            response = await self._create_completion(request_params)
+            choice = response.choices[0]
+            message = choice.message
             
             # レスポンスを解析
-            if response_text.startswith("TOOL:"):
-                lines = response_text.split('\n')
-                tool_name = lines[0].replace("TOOL:", "").strip()
-                
-                if len(lines) > 1:
-                    try:
-                        parameters = json.loads(lines[1])
-                        return ToolDecision.TOOL, tool_name, parameters
-                    except json.JSONDecodeError:
-                        return ToolDecision.ERROR, "JSONパースエラー", {}
+            with self.tracer.span("parse", category="agent"):
+                if self._use_native_tools():
+                    result = self._parse_native_response(message)
                 else:
-                    return ToolDecision.ERROR, "パラメータが不足", {}
-                    
-            elif response_text.startswith("DIRECT:"):
-                direct_answer = response_text.replace("DIRECT:", "").strip()
-                return ToolDecision.DIRECT, direct_answer, {}
-            else:
-                return ToolDecision.ERROR, "無効なレスポンス形式", {}
+                    result = self._parse_text_response(message.content or "")
+            return result, self._response_confidence(choice)
                 
         except Exception as e:
-            return ToolDecision.ERROR, f"LLM呼び出しエラー: {e}", {}
+            return (ToolDecision.ERROR, f"LLM呼び出しエラー: {e}", {}), None
+    
+    def _response_confidence(self, choice: Any, head_tokens: int = 16) -> Optional[float]:
+        """先頭トークンの平均対数確率から確信度（0〜1）を求める（logprobs がなければNone）"""
+        logprobs = getattr(choice, "logprobs", None)
+        content = getattr(logprobs, "content", None) if logprobs is not None else None
+        if not content:
+            return None
+        head = [token.logprob for token in content[:head_tokens]]
+        return math.exp(sum(head) / len(head))
+    
+    def _escalation_reason(self, result: Tuple[ToolDecision, str, Dict[str, Any]],
+                           confidence: Optional[float]) -> Optional[str]:
+        """上位モデルへ格上げすべき理由を返す（不要ならNone）"""
+        decision, tool_or_answer, parameters = result
+        if decision == ToolDecision.ERROR:
+            return "parse_error"
+        if decision == ToolDecision.TOOL:
+            spec = self.tool_registry.get(tool_or_answer)
+            if spec is None:
+                return "unknown_tool"
+            if spec.missing_parameters(parameters):
+                return "missing_parameters"
+        if confidence is not None and confidence < self.routing.min_confidence:
+            return "low_confidence"
+        return None
+    
+    def _decision_messages(self, observation: str, user_input: str,
+                           memory: Optional[ConversationMemory] = None) -> List[Dict[str, str]]:
+        """判定用のメッセージを生成（会話履歴 → 今回の観察の順）"""
+        # ツール結果で観察が置き換わっても、元の質問を見失わないよう併記する
+        content = observation if observation == user_input else f"元の質問: {user_input}\n{observation}"
+        messages = [{"role": "system", "content": self._system_prompt}]
+        if memory is not None:
+            # テキストモードでは過去の回答も DIRECT: 形式で見せ、応答形式を崩さない
+            messages += memory.build_messages("" if self._use_native_tools() else "DIRECT: ")
+        messages.append({"role": "user", "content": content})
+        return messages
+    
+    def _use_native_tools(self) -> bool:
+        """ネイティブのツール呼び出しを使うか"""
+        return self.agent_config.tool_calling_mode == "native" and bool(self._openai_tools)
+    
+    def _parse_text_response(self, response_text: str) -> Tuple[ToolDecision, str, Dict[str, Any]]:
+        """「TOOL: / DIRECT:」形式のテキスト応答を解析"""
+        response_text = response_text.strip()
+        
+        if response_text.startswith("TOOL:"):
+            lines = response_text.split('\n')
+            tool_name = lines[0].replace("TOOL:", "").strip()
+            
+            if len(lines) > 1:
+                try:
+                    parameters = json.loads(lines[1])
+                    return ToolDecision.TOOL, tool_name, parameters
+                except json.JSONDecodeError:
+                    return ToolDecision.ERROR, "JSONパースエラー", {}
+            else:
+                return ToolDecision.ERROR, "パラメータが不足", {}
+                
+        elif response_text.startswith("DIRECT:"):
+            direct_answer = response_text.replace("DIRECT:", "").strip()
+            return ToolDecision.DIRECT, direct_answer, {}
+        else:
+            return ToolDecision.ERROR, "無効なレスポンス形式", {}
+    
+    def _parse_native_response(self, message: Any) -> Tuple[ToolDecision, str, Dict[str, Any]]:
+        """構造化された tool_calls を含む応答を解析"""
+        tool_calls = getattr(message, "tool_calls", None)
+        if tool_calls:
+            # 1反復につき1ツールを実行する（MCP Loopの構造に合わせる）
+            function = tool_calls[0].function
+            try:
+                parameters = json.loads(function.arguments or "{}")
+            except json.JSONDecodeError:
+                return ToolDecision.ERROR, "JSONパースエラー", {}
+            if not isinstance(parameters, dict):
+                return ToolDecision.ERROR, "パラメータ形式が不正", {}
+            return ToolDecision.TOOL, function.name, parameters
+        
+        content = (message.content or "").strip()
+        if content.startswith("DIRECT:"):
+            content = content.replace("DIRECT:", "", 1).strip()
+        if not content:
+            return ToolDecision.ERROR, "空のレスポンス", {}
+        return ToolDecision.DIRECT, content, {}
+    
+    def _pre_route(self, user_input: str) -> Optional[RouteDecision]:
+        """事前ルーターで判定（無効時・確信がない時はNone）"""
+        if self.router is None:
+            return None
+        route = self.router.route(user_input)
+        self.router_stats.record(route)
+        return route
     
     async def _execute_tool(self, tool_name: str, parameters: Dict[str, Any]) -> Tuple[bool, str, Any]:
+        """ツールを実行し、呼び出し回数とレイテンシをメトリクスに記録"""
+        started_at = time.perf_counter()
+        success, message, result = await self._execute_tool_once(tool_name, parameters)
+        
+        # LLMが存在しないツール名を返した場合はラベルの種類が増えないようまとめる
+        tool_label = tool_name if tool_name in self.tool_registry else "unknown"
+        self.metrics.tool_calls.inc(tool=tool_label, status="success" if success else "error")
+        self.metrics.tool_latency.observe(time.perf_counter() - started_at, tool=tool_label)
+        if not success:
+            self.metrics.errors.inc(kind="tool")
+        return success, message, result
+    
+    async def _execute_tool_once(self, tool_name: str, parameters: Dict[str, Any]) -> Tuple[bool, str, Any]:
         """ツールを実行"""
         try:
             # ツールの存在確認
-            selected_tool = None
-            for tool in self.tools:
-                if tool.name == tool_name:
-                    selected_tool = tool
-                    break
-            
-            if not selected_tool:
+            spec = self.tool_registry.get(tool_name)
+            if spec is None:
                 return False, f"ツール '{tool_name}' が見つかりません", None
             
-            # ツール実行
-            result = await self.client.call_tool(tool_name, parameters)
+            # 必須パラメータの検証
+            missing_params = spec.missing_parameters(parameters)
+            if missing_params:
+                return False, f"必須パラメータが不足しています: {missing_params}", None
             
-            # 結果の処理
-            if hasattr(result, 'data'):
-                actual_result = result.data
+            # ツール実行（キャッシュ可能なツールは結果をメモ化）
+            cache_ttl = self._tool_cache_ttl(spec)
+            if cache_ttl > 0:
+                actual_result = await self.tool_cache.get_or_call(
+                    tool_name, parameters, cache_ttl,
+                    lambda: self._call_tool(tool_name, parameters)
+                )
             else:
-                actual_result = result
+                actual_result = await self._call_tool(tool_name, parameters)
             
             return True, "成功", actual_result
             
         except Exception as e:
             return False, f"ツール実行エラー: {e}", None
     
+    async def _call_tool(self, tool_name: str, parameters: Dict[str, Any]) -> Any:
+        """ツールを提供するMCPサーバーへ呼び出しを振り分け、結果の値を取り出す"""
+        await self._wait_for_servers()
+        spec = self.tool_registry[tool_name]
+        connection = self.servers.get(spec.server)
+        if connection is None or not await self._ensure_connected(connection):
+            raise ConnectionError(f"サーバー '{spec.server}' に接続できていません")
+        with self.tracer.span("mcp.call_tool", category="mcp", tool=tool_name, server=spec.server):
+            result = await self._call_mcp(
+                spec.server, f"{spec.remote_name} 呼び出し",
+                lambda: self._with_session(spec.server, lambda client: client.call_tool(spec.remote_name, parameters))
+            )
+        
+        # 結果の処理
+        if hasattr(result, 'data'):
+            return result.data
+        return result
+    
+    def _tool_cache_ttl(self, spec: ToolSpec) -> float:
+        """ツール結果のキャッシュTTL（秒）。キャッシュしない場合は0"""
+        if not spec.config.get("cacheable", False):
+            return 0
+        return float(spec.config.get("cacheTtlSeconds", 60))
+    
     def _format_tool_result(self, tool_name: str, parameters: Dict[str, Any], result: Any) -> str:
-        """ツール結果の表示形式を生成"""
-        param_str = ", ".join([f"{k}={v}" for k, v in parameters.items()])
+        """ツール結果の表示形式を生成（スキーマのパラメータ順で表示）"""
+        spec = self.tool_registry.get(tool_name)
+        ordered_names = [name for name in spec.properties if name in parameters] if spec else []
+        ordered_names += [name for name in parameters if name not in ordered_names]
+        param_str = ", ".join([f"{k}={parameters[k]}" for k in ordered_names])
         return f"結果: {tool_name}({param_str}) = {result}"
     
-    async def process_query(self, user_input: str) -> str:
-        """クエリを処理（MCP Loop実装）"""
+    def _pre_route_for_iteration(self, user_input: str, iteration: int) -> Optional[RouteDecision]:
+        """初回反復のみ事前ルーターを試す"""
+        route = self._pre_route(user_input) if iteration == 1 else None
+        if route is not None and self.agent_config.debug_mode:
+            print("\n--- Thought (事前ルーター) ---")
+            print(f"一致キーワード: {route.matched_keywords}")
+        return route
+    
+    def _print_decision(self, decision: ToolDecision, tool_or_answer: str, parameters: Dict[str, Any]):
+        """判定結果をデバッグ表示"""
+        if self.agent_config.debug_mode:
+            print(f"Decision: {decision.value}")
+            print(f"Tool/Answer: {tool_or_answer}")
+            print(f"Parameters: {parameters}")
+    
+    async def _run_tool_action(self, tool_name: str, parameters: Dict[str, Any]) -> Tuple[str, Optional[str]]:
+        """ツールを実行し、(次の反復の観察, テンプレートで確定した最終回答) を返す"""
+        with self.tracer.span("action", category="phase", tool=tool_name):
+            success, message, result = await self._execute_tool(tool_name, parameters)
+        
+        with self.tracer.span("feedback", category="phase", tool=tool_name):
+            return self._tool_feedback(tool_name, parameters, success, message, result)
+    
+    def _tool_feedback(self, tool_name: str, parameters: Dict[str, Any], success: bool,
+                       message: str, result: Any) -> Tuple[str, Optional[str]]:
+        """ツールの実行結果を次の反復の観察（または最終回答）に変換"""
+        if success:
+            # 終端ツールは結果をローカルで整形し、言い換えのLLM呼び出しを省く
+            final_answer = self._render_terminal_result(tool_name, parameters, result)
+            if final_answer is not None:
+                self.template_answers += 1
+                if self.agent_config.debug_mode:
+                    print(f"Action Result (テンプレート): {final_answer}")
+                return final_answer, final_answer
+            
+            action_output = self._format_tool_result(tool_name, parameters, result)
+            if self.agent_config.debug_mode:
+                print(f"Action Result: {action_output}")
+        else:
+            action_output = f"エラー: {message}"
+            if self.agent_config.debug_mode:
+                print(f"Action Error: {action_output}")
+        
+        return action_output, None
+    
+    def _render_terminal_result(self, tool_name: str, parameters: Dict[str, Any], result: Any) -> Optional[str]:
+        """mcp.json で terminal: true のツールは resultTemplate で最終回答を生成（対象外ならNone）
+
+        テンプレートがあるだけでは終端にしない。1回の呼び出しで質問に答え切れるツールだけが明示的に指定し、
+        それ以外は結果を観察として次の反復へ渡す（「掛けて、その結果を割って」のような多段のクエリのため）。
+        """
+        spec = self.tool_registry.get(tool_name)
+        if spec is None:
+            return None
+        
+        if not spec.config.get("terminal", False):
+            return None
+        
+        template = spec.config.get("resultTemplate")
+        
+        if template is None:
+            return self._default_result_display(spec, parameters, result)
+        
+        values = {**parameters, "result": result, "tool": tool_name, "description": spec.description}
+        try:
+            return template.format_map(values)
+        except (KeyError, IndexError, ValueError, AttributeError) as e:
+            # テンプレートに合わない結果はLLMに言い換えさせる
+            if self.agent_config.debug_mode:
+                print(f"⚠️ 結果テンプレートの適用エラー: {e}")
+            return None
+    
+    def _default_result_display(self, spec: ToolSpec, parameters: Dict[str, Any], result: Any) -> str:
+        """テンプレート未指定の終端ツール用の汎用表示（04_mcpClientLlm2.py の表示ルールを踏襲）"""
+        main_params = [f"{name}={parameters[name]}" for name in spec.properties if name in parameters]
+        if main_params:
+            return f"{spec.name}({', '.join(main_params)}): {result}"
+        return f"{spec.description or spec.name}: {result}"
+    
+    def _fallback_messages(self, user_input: str, memory: Optional[ConversationMemory] = None) -> List[Dict[str, str]]:
+        """フォールバック（直接回答）用のメッセージを生成"""
+        messages = [{"role": "system", "content": "ユーザーの質問に直接回答してください。"}]
+        if memory is not None:
+            messages += memory.build_messages()
+        messages.append({"role": "user", "content": user_input})
+        return messages
+    
+    def _start_speculative_direct(self, user_input: str,
+                                  memory: Optional[ConversationMemory] = None) -> Tuple[asyncio.Task, float, List[Dict[str, str]]]:
+        """直接回答リクエストを投機的に開始"""
+        messages = self._fallback_messages(user_input, memory)
+        task = asyncio.create_task(self._timed_completion(messages))
+        self.speculation_stats.launched += 1
+        return task, time.perf_counter(), messages
+    
+    def _cancel_speculative(self, speculative: Tuple[asyncio.Task, float, List[Dict[str, str]]]):
+        """不要になった投機的リクエストを取り消し、無駄になったトークンとコストを記録"""
+        task, _, messages = speculative
+        stats = self.speculation_stats
+        
+        if not task.done():
+            task.cancel()
+            # 送信済みの入力トークンは課金され得るため、見積もりで計上する
+            estimated_tokens = estimate_messages_tokens(messages)
+            rates = MODEL_RATES.get(self._phrasing_model(), {"input": 0.15})
+            stats.cancelled += 1
+            stats.estimated_cancelled_tokens += estimated_tokens
+            stats.estimated_cancelled_cost += estimated_tokens * rates["input"] / 1000
+            return
+        
+        if task.cancelled() or task.exception() is not None:
+            return
+        
+        # 判定より先に完了していた場合、そのコストは丸ごと無駄になった
+        try:
+            response, _ = task.result()
+            cost_calc = UsageCostCalculator(response)
+            stats.wasted_completed += 1
+            stats.wasted_tokens += cost_calc.total_tokens
+            stats.wasted_cost += cost_calc.total_cost
+        except Exception:
+            pass
+    
+    async def _take_speculative(self, speculative: Tuple[asyncio.Task, float, List[Dict[str, str]]]) -> Optional[Any]:
+        """投機的リクエストの結果を受け取る（失敗していればNone）"""
+        task, started_at, _ = speculative
+        decided_at = time.perf_counter()
+        try:
+            response, finished_at = await task
+        except Exception as e:
+            if self.agent_config.debug_mode:
+                print(f"⚠️ 投機的リクエストが失敗しました: {e}")
+            return None
+        
+        # 逐次実行なら判定後に丸ごとかかったはずの時間から、実際に追加で待った時間を引く
+        extra_wait = max(0.0, finished_at - decided_at)
+        self.speculation_stats.used += 1
+        self.speculation_stats.latency_saved_seconds += (finished_at - started_at) - extra_wait
+        return response
+    
+    async def _timed_completion(self, messages: List[Dict[str, str]]) -> Tuple[Any, float]:
+        """直接回答を要求し、レスポンスと完了時刻を返す"""
+        response = await self._create_completion(
+            self._build_request_params(messages, self._phrasing_model()), label="投機的直接回答"
+        )
+        return response, time.perf_counter()
+    
+    async def process_query(self, user_input: str, memory: Optional[ConversationMemory] = None,
+                            session_id: Optional[str] = None) -> str:
+        """クエリを処理（MCP Loop実装）。memory 省略時はエージェントの会話メモリを使う"""
+        if session_id is not None:
+            return (await self.run_query(user_input, session_id=session_id)).answer
+        result = await self.run_query(user_input, self.memory if memory is None else memory)
+        return result.answer
+    
+    async def run_query(self, user_input: str, memory: Optional[ConversationMemory] = None,
+                        session_id: Optional[str] = None) -> QueryResult:
+        """クエリを処理し、回答と反復回数・レイテンシ・コストを返す（memory 指定時は会話履歴を使い、この往復を記録）
+        
+        session_id 指定時はそのセッションの会話履歴を使い、コストをセッションにも集計する。
+        """
+        if session_id is not None:
+            async with self.sessions.use(session_id) as session:
+                token = _session_cost_tracker.set(session.cost_tracker)
+                try:
+                    return await self.run_query(user_input, session.memory)
+                finally:
+                    _session_cost_tracker.reset(token)
+        
+        query_tracker = SessionCostTracker()
+        token = _query_cost_tracker.set(query_tracker)
+        start_time = time.perf_counter()
+        self.metrics.queries.inc(mode="sync")
+        self.metrics.queries_in_flight.inc()
+        outcome = LoopOutcome()
+        try:
+            with self.tracer.span("query", category="query") as query_span:
+                answer, iterations = await self._run_loop(user_input, memory, outcome)
+                query_span.set(iterations=iterations, llm_requests=query_tracker.request_count)
+        finally:
+            _query_cost_tracker.reset(token)
+            self.metrics.queries_in_flight.dec()
+        
+        self.metrics.query_latency.observe(time.perf_counter() - start_time, mode="sync")
+        self.metrics.query_iterations.observe(iterations)
+        
+        if memory is not None and not outcome.failed:
+            await self._remember_turn(memory, user_input, answer, query_tracker)
+        
+        return QueryResult(
+            query=user_input,
+            answer=answer,
+            iterations=iterations,
+            latency_ms=(time.perf_counter() - start_time) * 1000,
+            prompt_tokens=query_tracker.total_prompt_tokens,
+            completion_tokens=query_tracker.total_completion_tokens,
+            cost=query_tracker.total_cost,
+            llm_requests=query_tracker.request_count,
+            cache_hits=query_tracker.cache_hits
+        )
+    
+    async def _remember_turn(self, memory: ConversationMemory, user_input: str, answer: str,
+                             query_tracker: SessionCostTracker):
+        """往復を会話メモリに記録し、上限を超えたら古い往復を要約に畳み込む"""
+        memory.record_turn_tokens(query_tracker.total_prompt_tokens)
+        # エラー応答は履歴に残さない
+        if answer.startswith("回答: "):
+            memory.add_turn(user_input, answer[len("回答: "):].strip())
+        if memory.needs_compaction():
+            await self._compact_memory(memory)
+        if self.agent_config.debug_mode:
+            summary = memory.get_summary()
+            print(f"🧠 会話メモリ: 今回の入力 {query_tracker.total_prompt_tokens}t / 履歴 {summary['history_tokens']}t ({summary['turns']}往復) / 要約 {summary['summary_tokens']}t")
+    
+    async def _compact_memory(self, memory: ConversationMemory):
+        """古い往復をLLMで要約に畳み込む（失敗時は切り詰めた簡易要約を使う）"""
+        turns = memory.pop_turns_for_compaction()
+        if not turns:
+            return
+        
+        conversation = "\n".join(f"ユーザー: {turn.user}\nアシスタント: {turn.assistant}" for turn in turns)
+        messages = [
+            {"role": "system", "content": (
+                "これまでの要約と新しい会話を1つの要約にまとめてください。"
+                f"今後の会話に必要な事実（数値・固有名詞・ユーザーの意図）を残し、{memory.summary_max_tokens}トークン以内の日本語で、要約本文のみを出力してください。"
+            )},
+            {"role": "user", "content": f"これまでの要約: {memory.summary or 'なし'}\n\n新しい会話:\n{conversation}"}
+        ]
+        summary = ""
+        with self.tracer.span("memory.compact", category="memory", turns=len(turns)):
+            try:
+                response = await self._create_completion(
+                    self._build_request_params(messages, self._phrasing_model()), label="会話要約"
+                )
+                summary = response.choices[0].message.content or ""
+            except Exception as e:
+                if self.agent_config.debug_mode:
+                    print(f"⚠️ 会話要約エラー: {e}")
+        
+        memory.apply_summary(summary if summary.strip() else memory.local_summary(turns))
+    
+    async def _run_loop(self, user_input: str, memory: Optional[ConversationMemory] = None,
+                        outcome: Optional[LoopOutcome] = None) -> Tuple[str, int]:
+        """MCP Loop本体（回答と反復回数を返す。エラーで終わった場合は outcome.failed を立てる）"""
+        outcome = LoopOutcome() if outcome is None else outcome
         if self.agent_config.debug_mode:
             print(f"\n🔄 MCP Loop開始: {user_input}")
             print("=" * 50)
@@ -440,107 +1795,394 @@ class ConfigurableMCPAgent:
         observation = user_input
         max_iterations = self.agent_config.max_iterations
         iteration = 0
+        speculative: Optional[Tuple[asyncio.Task, float, List[Dict[str, str]]]] = None
         
-        while iteration < max_iterations:
-            iteration += 1
+        try:
+            # ツール一覧の変更通知があれば、ループ開始前に反映
+            await self._ensure_tools_fresh()
             
-            if self.agent_config.debug_mode:
-                print(f"\n--- Iteration {iteration} ---")
-                print(f"Observation: {observation}")
+            while iteration < max_iterations:
+                iteration += 1
             
-            # --- Thought (LLM使用) ---
-            if self.agent_config.debug_mode:
-                print("\n--- Thought (LLM) ---")
+                if self.agent_config.debug_mode:
+                    print(f"\n--- Iteration {iteration} ---")
+                    print(f"Observation: {observation}")
             
-            decision, tool_or_answer, parameters = await self._ask_llm_for_decision(observation)
+                # --- Thought（初回は事前ルーターを試し、確信がなければLLM使用） ---
+                with self.tracer.span("thought", category="phase", iteration=iteration) as thought_span:
+                    route = self._pre_route_for_iteration(user_input, iteration)
+                
+                    if route is not None:
+                        decision, tool_or_answer, parameters = ToolDecision.TOOL, route.tool_name, route.parameters
+                        thought_span.set(source="router")
+                    else:
+                        if self.agent_config.debug_mode:
+                            print("\n--- Thought (LLM) ---")
+                    
+                        # 初回は判定と並行して直接回答を投機的に要求（判定が失敗した時のフォールバックを先取り）
+                        if iteration == 1 and self.agent_config.speculative_direct and self.agent_config.fallback_to_direct:
+                            speculative = self._start_speculative_direct(user_input, memory)
+                    
+                        thought_span.set(source="llm")
+                        decision_start = time.perf_counter()
+                        decision, tool_or_answer, parameters = await self._ask_llm_for_decision(observation, user_input, memory)
+                        if iteration == 1 and self.router is not None:
+                            self.router_stats.observe_decision_latency(time.perf_counter() - decision_start)
+                    
+                        # 判定が有効なら投機的リクエストは不要
+                        if speculative is not None and decision != ToolDecision.ERROR:
+                            self._cancel_speculative(speculative)
+                            speculative = None
             
-            if self.agent_config.debug_mode:
-                print(f"Decision: {decision.value}")
-                print(f"Tool/Answer: {tool_or_answer}")
-                print(f"Parameters: {parameters}")
+                self._print_decision(decision, tool_or_answer, parameters)
             
-            # --- Action ---
-            if self.agent_config.debug_mode:
-                print("\n--- Action ---")
+                # --- Action ---
+                if self.agent_config.debug_mode:
+                    print("\n--- Action ---")
             
-            if decision == ToolDecision.TOOL:
-                # ツール実行
-                success, message, result = await self._execute_tool(tool_or_answer, parameters)
+                if decision == ToolDecision.TOOL:
+                    # ツール実行し、次の反復のために観察を更新
+                    observation, final_answer = await self._run_tool_action(tool_or_answer, parameters)
+                    if final_answer is not None:
+                        return f"回答: {final_answer}", iteration
                 
-                if success:
-                    action_output = self._format_tool_result(tool_or_answer, parameters, result)
+                elif decision == ToolDecision.DIRECT:
+                    # 直接回答
+                    action_output = f"回答: {tool_or_answer}"
                     if self.agent_config.debug_mode:
                         print(f"Action Result: {action_output}")
-                else:
-                    action_output = f"エラー: {message}"
-                    if self.agent_config.debug_mode:
-                        print(f"Action Error: {action_output}")
-                
-                # 次の反復のために観察を更新
-                observation = action_output
-                
-            elif decision == ToolDecision.DIRECT:
-                # 直接回答
-                action_output = f"回答: {tool_or_answer}"
-                if self.agent_config.debug_mode:
-                    print(f"Action Result: {action_output}")
                 
-                # 最終回答として返す
-                return action_output
+                    # 最終回答として返す
+                    return action_output, iteration
                 
-            else:  # ToolDecision.ERROR
-                # エラー処理
-                if self.agent_config.fallback_to_direct:
-                    action_output = f"エラー: {tool_or_answer}。直接回答を試行します。"
-                    if self.agent_config.debug_mode:
-                        print(f"Action Error: {action_output}")
+                else:  # ToolDecision.ERROR
+                    # エラー処理
+                    self.metrics.errors.inc(kind="decision")
+                    if self.agent_config.fallback_to_direct:
+                        self.metrics.fallbacks.inc()
+                        action_output = f"エラー: {tool_or_answer}。直接回答を試行します。"
+                        if self.agent_config.debug_mode:
+                            print(f"Action Error: {action_output}")
                     
-                    # フォールバック処理
-                    try:
-                        # フォールバック用のリクエストパラメータ
-                        fallback_params = {
-                            "model": self.llm_config.model,
-                            "messages": [
-                                {"role": "system", "content": "ユーザーの質問に直接回答してください。"},
-                                {"role": "user", "content": user_input}
-                            ]
-                        }
-                        
-                        # モデル別の温度設定
-                        if self.llm_config.use_temperature:
-                            fallback_params["temperature"] = self.llm_config.temperature
-                        
-                        # モデル別のトークン設定
-                        if self.llm_config.use_max_completion_tokens:
-                            fallback_params["max_completion_tokens"] = self.llm_config.max_tokens
-                        else:
-                            fallback_params["max_tokens"] = self.llm_config.max_tokens
-                        
-                        fallback_response = self.llm_client.chat.completions.create(**fallback_params)
-                        
-                        # フォールバック処理のコスト追跡
+                        # フォールバック処理（投機的リクエストがあればその結果を使う）
                         try:
-                            cost_calc = UsageCostCalculator(fallback_response)
-                            self.cost_tracker.add_usage(cost_calc)
-                            if self.agent_config.debug_mode:
-                                summary = cost_calc.get_summary()
-                                print(f"💰 フォールバックコスト: ${summary['total_cost']:.6f} (入力: {summary['prompt_tokens']}t, 出力: {summary['completion_tokens']}t)")
-                        except Exception as e:
-                            if self.agent_config.debug_mode:
-                                print(f"⚠️  フォールバックコスト計算エラー: {e}")
+                            with self.tracer.span("fallback", category="phase", iteration=iteration):
+                                fallback_response = None
+                                if speculative is not None:
+                                    fallback_response = await self._take_speculative(speculative)
+                                    speculative = None
+                                if fallback_response is None:
+                                    fallback_response = await self._create_completion(
+                                        self._build_request_params(self._fallback_messages(user_input, memory), self._phrasing_model()),
+                                        label="フォールバック"
+                                    )
                         
-                        fallback_answer = fallback_response.choices[0].message.content.strip()
-                        return f"回答: {fallback_answer}"
-                    except Exception as e:
-                        return f"申し訳ありませんが、適切な回答を生成できませんでした。エラー: {e}"
+                            fallback_answer = fallback_response.choices[0].message.content.strip()
+                            return f"回答: {fallback_answer}", iteration
+                        except Exception as e:
+                            outcome.failed = True
+                            return f"申し訳ありませんが、適切な回答を生成できませんでした。エラー: {e}", iteration
+                    else:
+                        outcome.failed = True
+                        return f"エラー: {tool_or_answer}", iteration
+            
+            # 最大反復回数に達した場合
+            if self.agent_config.debug_mode:
+                print(f"\n⚠️ 最大反復回数({max_iterations})に達しました")
+            
+            outcome.failed = True
+            return "申し訳ありませんが、処理が完了しませんでした。時間を置いて再度お試しください。", iteration
+        finally:
+            # 判定の失敗・例外・クエリの取り消しで抜けた場合も、投機的リクエストを放置しない
+            if speculative is not None:
+                self._cancel_speculative(speculative)
+
+    async def process_query_stream(self, user_input: str, memory: Optional[ConversationMemory] = None,
+                                   query_tracker: Optional[SessionCostTracker] = None,
+                                   session_id: Optional[str] = None) -> AsyncIterator[str]:
+        """クエリを処理し、最終回答をトークン単位で順次返す（ストリーミング版）
+        
+        判定呼び出しを stream=True で行い、先頭のチャンクから DIRECT: / TOOL: を判別する。
+        DIRECT の場合は回答本文を受信しながらそのまま返し、TOOL の場合は全体を受信してから
+        ツールを実行して次の反復へ進む。memory 省略時はエージェントの会話メモリを使う。
+        query_tracker を渡すと、このクエリのトークン数とコストをそこに集計する。
+        session_id 指定時はそのセッションの会話履歴を使い、コストをセッションにも集計する。
+        """
+        if session_id is not None:
+            async with self.sessions.use(session_id) as session:
+                token = _session_cost_tracker.set(session.cost_tracker)
+                try:
+                    async for text in self.process_query_stream(user_input, session.memory, query_tracker):
+                        yield text
+                finally:
+                    _session_cost_tracker.reset(token)
+            return
+        
+        memory = self.memory if memory is None else memory
+        if self.agent_config.debug_mode:
+            print(f"\n🔄 MCP Loop開始（ストリーミング）: {user_input}")
+            print("=" * 50)
+        
+        query_tracker = SessionCostTracker() if query_tracker is None else query_tracker
+        token = _query_cost_tracker.set(query_tracker)
+        start_time = time.perf_counter()
+        first_token_time: Optional[float] = None
+        answer_parts: List[str] = []
+        self.metrics.queries.inc(mode="stream")
+        self.metrics.queries_in_flight.inc()
+        outcome = LoopOutcome()
+        
+        try:
+            with self.tracer.span("query", category="query", stream=True) as query_span:
+                async for text in self._stream_loop(user_input, memory, outcome):
+                    if first_token_time is None:
+                        first_token_time = time.perf_counter()
+                        query_span.set(ttft_ms=(first_token_time - start_time) * 1000)
+                    answer_parts.append(text)
+                    yield text
+        finally:
+            _query_cost_tracker.reset(token)
+            self.metrics.queries_in_flight.dec()
+            self.metrics.query_latency.observe(time.perf_counter() - start_time, mode="stream")
+            if self.agent_config.debug_mode:
+                total = time.perf_counter() - start_time
+                ttft = f"{first_token_time - start_time:.3f}秒" if first_token_time else "N/A"
+                print(f"\n⏱️ 最初のトークンまで: {ttft} / 全体: {total:.3f}秒 / コスト: ${query_tracker.total_cost:.6f}")
+        
+        # 最後まで受け取られ、エラーで終わっていない回答だけを会話メモリに記録する
+        if memory is not None and not outcome.failed:
+            await self._remember_turn(memory, user_input, "".join(answer_parts), query_tracker)
+    
+    async def _stream_loop(self, user_input: str, memory: Optional[ConversationMemory] = None,
+                           outcome: Optional[LoopOutcome] = None) -> AsyncIterator[str]:
+        """ストリーミング版のMCP Loop本体（回答のテキストを順次返す。エラーで終わった場合は outcome.failed を立てる）"""
+        outcome = LoopOutcome() if outcome is None else outcome
+        await self._ensure_tools_fresh()
+        observation = user_input
+        
+        for iteration in range(1, self.agent_config.max_iterations + 1):
+            if self.agent_config.debug_mode:
+                print(f"\n--- Iteration {iteration} ---")
+                print(f"Observation: {observation}")
+            
+            # --- Thought ---
+            with self.tracer.span("thought", category="phase", iteration=iteration, stream=True) as thought_span:
+                route = self._pre_route_for_iteration(user_input, iteration)
+                if route is not None:
+                    decision, tool_or_answer, parameters = ToolDecision.TOOL, route.tool_name, route.parameters
+                    thought_span.set(source="router")
                 else:
-                    return f"エラー: {tool_or_answer}"
+                    if self.agent_config.debug_mode:
+                        print("\n--- Thought (LLM, stream) ---")
+                    thought_span.set(source="llm")
+                    
+                    # 安いモデルから試し、回答を返し始める前に判定が不適切と分かれば上位モデルへ格上げ
+                    chain = self._model_chain(observation, user_input)
+                    for index, model in enumerate(chain):
+                        decision, tool_or_answer, parameters = ToolDecision.ERROR, "", {}
+                        async for kind, value in self._stream_decision(observation, user_input, memory, model):
+                            if kind == "token":
+                                yield value
+                            else:
+                                decision, tool_or_answer, parameters = value
+                        
+                        reason = None
+                        if decision != ToolDecision.DIRECT:
+                            reason = self._escalation_reason((decision, tool_or_answer, parameters), None)
+                        if reason is None or index == len(chain) - 1:
+                            break
+                        self._record_escalation(model, chain[index + 1], reason)
+            
+            self._print_decision(decision, tool_or_answer, parameters)
+            
+            # --- Action ---
+            if decision == ToolDecision.TOOL:
+                observation, final_answer = await self._run_tool_action(tool_or_answer, parameters)
+                if final_answer is not None:
+                    yield f"回答: {final_answer}"
+                    return
+                continue
+            
+            if decision == ToolDecision.DIRECT:
+                # 回答本文はストリーム中に返却済み
+                return
+            
+            # ToolDecision.ERROR
+            self.metrics.errors.inc(kind="decision")
+            if not self.agent_config.fallback_to_direct:
+                outcome.failed = True
+                yield f"エラー: {tool_or_answer}"
+                return
+            self.metrics.fallbacks.inc()
+            
+            if self.agent_config.debug_mode:
+                print(f"Action Error: エラー: {tool_or_answer}。直接回答を試行します。")
+            try:
+                yield "回答: "
+                with self.tracer.span("fallback", category="phase", iteration=iteration, stream=True):
+                    async for text in self._stream_text(
+                        self._build_request_params(self._fallback_messages(user_input, memory), self._phrasing_model()),
+                        label="フォールバック"
+                    ):
+                        yield text
+            except Exception as e:
+                # 「回答: 」を返した後の失敗なので、この往復は会話メモリに残さない
+                outcome.failed = True
+                yield f"申し訳ありませんが、適切な回答を生成できませんでした。エラー: {e}"
+            return
         
-        # 最大反復回数に達した場合
         if self.agent_config.debug_mode:
-            print(f"\n⚠️ 最大反復回数({max_iterations})に達しました")
+            print(f"\n⚠️ 最大反復回数({self.agent_config.max_iterations})に達しました")
+        outcome.failed = True
+        yield "申し訳ありませんが、処理が完了しませんでした。時間を置いて再度お試しください。"
+    
+    async def _stream_decision(self, observation: str, user_input: Optional[str] = None,
+                               memory: Optional[ConversationMemory] = None,
+                               model: Optional[str] = None) -> AsyncIterator[Tuple[str, Any]]:
+        """判定呼び出しをストリーミングで行う
+        
+        ("token", 文字列) で回答本文を、最後に ("decision", (判定, ツール名/回答, パラメータ)) を返す。
+        """
+        request_params = self._build_request_params(
+            self._decision_messages(observation, user_input or observation, memory), model
+        )
+        native = self._use_native_tools()
+        if native:
+            request_params["tools"] = self._openai_tools
+            request_params["tool_choice"] = "auto"
+        
+        # キャッシュ済みなら通常の応答として扱う（ストリーム応答はキャッシュに保存しない）
+        if self.response_cache is not None:
+            cached = await self.response_cache.get(request_params)
+            if cached is not None:
+                from openai.types.chat import ChatCompletion
+                response = ChatCompletion.model_validate_json(cached)
+                self._record_cache_hit(response)
+                message = response.choices[0].message
+                result = self._parse_native_response(message) if native else self._parse_text_response(message.content or "")
+                if result[0] == ToolDecision.DIRECT:
+                    yield "token", f"回答: {result[1]}"
+                yield "decision", result
+                return
+            self._for_each_tracker(lambda tracker: tracker.add_cache_miss())
         
-        return "申し訳ありませんが、処理が完了しませんでした。時間を置いて再度お試しください。"
+        buffer = ""
+        mode: Optional[str] = None  # None: 判定中, "direct" / "tool" / "invalid"
+        tool_name = ""
+        tool_arguments = ""
+        answer_parts: List[str] = []
+        
+        try:
+            async for chunk in self._stream_completion(request_params):
+                if not chunk.choices:
+                    continue
+                delta = chunk.choices[0].delta
+                
+                # ネイティブモードのツール呼び出しは断片を連結する（1反復1ツール）
+                tool_calls = getattr(delta, "tool_calls", None)
+                if native and tool_calls:
+                    mode = "tool"
+                    call = tool_calls[0]
+                    if getattr(call, "index", 0) == 0 and call.function is not None:
+                        tool_name += call.function.name or ""
+                        tool_arguments += call.function.arguments or ""
+                    continue
+                
+                text = delta.content or ""
+                if not text:
+                    continue
+                
+                if mode == "direct":
+                    answer_parts.append(text)
+                    yield "token", text
+                    continue
+                
+                buffer += text
+                if mode is None:
+                    mode = self._detect_stream_mode(buffer, native)
+                    if mode == "direct":
+                        head = buffer.lstrip()
+                        if head.startswith("DIRECT:"):
+                            head = head[len("DIRECT:"):].lstrip()
+                        yield "token", "回答: "
+                        if head:
+                            answer_parts.append(head)
+                            yield "token", head
+        except Exception as e:
+            if mode == "direct":
+                # 回答の途中で切れた場合は受信済みの部分を回答とする
+                yield "decision", (ToolDecision.DIRECT, "".join(answer_parts).strip(), {})
+            else:
+                yield "decision", (ToolDecision.ERROR, f"LLM呼び出しエラー: {e}", {})
+            return
+        
+        if mode == "direct":
+            yield "decision", (ToolDecision.DIRECT, "".join(answer_parts).strip(), {})
+        elif native and tool_name:
+            try:
+                parameters = json.loads(tool_arguments or "{}")
+            except json.JSONDecodeError:
+                yield "decision", (ToolDecision.ERROR, "JSONパースエラー", {})
+                return
+            yield "decision", (ToolDecision.TOOL, tool_name, parameters)
+        else:
+            result = self._parse_text_response(buffer)
+            if result[0] == ToolDecision.DIRECT:
+                # 判定前に応答が終わった短い DIRECT 回答
+                yield "token", f"回答: {result[1]}"
+            yield "decision", result
+    
+    def _detect_stream_mode(self, buffer: str, native: bool) -> Optional[str]:
+        """受信済みの先頭部分から応答の種類を判別（まだ判別できなければNone）"""
+        head = buffer.lstrip()
+        for prefix, mode in (("DIRECT:", "direct"), ("TOOL:", "tool")):
+            if head.startswith(prefix):
+                return mode
+            if prefix.startswith(head):
+                return None
+        # ネイティブモードのテキスト応答はそのまま回答として扱う
+        return "direct" if native else "invalid"
+    
+    async def _stream_completion(self, request_params: Dict[str, Any], label: str = "") -> AsyncIterator[Any]:
+        """LLMをストリーミングで呼び出し、最後のチャンクの usage でコストを記録"""
+        acquire, reservation = self._rate_limit_each_attempt(request_params, label)
+        stream = None
+        reconciled = False
+        started_at = time.perf_counter()
+        # ストリームは受信し終わるまで接続を使うので、最後まで同じクライアントを借りておく
+        client = self._acquire_llm_client()
+        with self.tracer.span("llm.stream", category="llm", label=label, model=request_params.get("model")):
+            try:
+                # 期限・リトライは接続（最初の応答）まで。受信開始後は再送すると回答が重複するため行わない
+                stream = await self._call_llm(label, lambda: client.chat.completions.create(
+                    **request_params,
+                    stream=True,
+                    stream_options={"include_usage": True}
+                ), request_params["model"], before_attempt=acquire)
+                limiter, estimated = reservation
+                async for chunk in stream:
+                    if getattr(chunk, "usage", None) is not None:
+                        self._record_usage(chunk, label)
+                        if limiter is not None and not reconciled:
+                            limiter.reconcile(estimated, chunk.usage.total_tokens)
+                            reconciled = True
+                    yield chunk
+            except Exception as e:
+                # リクエスト自体が拒否された場合だけ返却（タイムアウトや受信途中の切断は見積もりのまま残す）
+                limiter, estimated = reservation
+                if limiter is not None and stream is None and not is_retryable_error(e):
+                    limiter.reconcile(estimated, 0)
+                self.metrics.errors.inc(kind="llm")
+                raise
+            finally:
+                self._release_llm_client(client)
+        self.metrics.llm_latency.observe(time.perf_counter() - started_at, model=request_params.get("model", ""))
+    
+    async def _stream_text(self, request_params: Dict[str, Any], label: str = "") -> AsyncIterator[str]:
+        """LLMの応答本文をストリーミングで返す"""
+        async for chunk in self._stream_completion(request_params, label):
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
 
 async def main():
     """メイン関数"""
@@ -548,7 +2190,7 @@ async def main():
     print("=" * 50)
     
     # エージェントの初期化
-    agent = ConfigurableMCPAgent("mcp.json", "learning-server")
+    agent = ConfigurableMCPAgent("mcp.json")
     
     try:
         # エージェント初期化
@@ -562,7 +2204,7 @@ async def main():
         # メインループ
         while True:
             try:
-                user_input = input("\nUser query: ").strip()
+                user_input = (await asyncio.to_thread(input, "\nUser query: ")).strip()
                 
                 if user_input.lower() in ['quit', 'exit', '終了']:
                     # セッション終了時のコスト表示
@@ -570,23 +2212,17 @@ async def main():
                     print("📊 セッション終了")
                     print("="*50)
                     print(f"📁 設定ファイル: {agent.config_path}")
-                    # サーバーURLを取得
-                    server_url = "N/A"
-                    if agent.mcp_config:
-                        try:
-                            server_config = agent.mcp_config.get_server_config(agent.server_name)
-                            host = server_config.get("host", "localhost")
-                            port = server_config.get("port", 8001)
-                            path = server_config.get("path", "/mcp")
-                            server_url = f"http://{host}:{port}{path}"
-                        except:
-                            server_url = "N/A"
-                    print(f"📡 サーバー: {server_url}")
+                    # 接続中のサーバーを表示
+                    if agent.servers:
+                        for connection in agent.servers.values():
+                            print(f"📡 サーバー: {connection.name} ({connection.url})")
+                    else:
+                        print("📡 サーバー: N/A")
                     print(f"🤖 LLM: {agent.llm_config.model if agent.llm_config else 'N/A'}")
-                    print(f"🔧 利用可能ツール: {[tool.name for tool in agent.tools] if agent.tools else 'N/A'}")
+                    print(f"🔧 利用可能ツール: {list(agent.tool_registry) if agent.tool_registry else 'N/A'}")
                     
                     # コスト情報を表示
-                    if agent.cost_tracker.request_count > 0:
+                    if agent.cost_tracker.request_count > 0 or agent.cost_tracker.cache_hits > 0:
                         summary = agent.cost_tracker.get_session_summary()
                         print("\n💰 コスト情報")
                         print("-" * 30)
@@ -597,9 +2233,121 @@ async def main():
                         print(f"総トークン数: {summary['total_tokens']:,}")
                         print(f"総コスト: ${summary['total_cost']:.6f}")
                         print(f"平均コスト/リクエスト: ${summary['average_cost_per_request']:.6f}")
+                        if agent.response_cache is not None:
+                            print(f"キャッシュ: ヒット {summary['cache_hits']} / ミス {summary['cache_misses']} (節約: ${summary['cache_saved_cost']:.6f})")
+                        
+                        if summary["hedged_requests"]:
+                            print(f"ヘッジ: {summary['hedged_requests']}回 (重複リクエストが先着: {summary['hedge_wins']}回) / 追加トークン(見積含む): {summary['hedge_extra_tokens']:,} / 追加コスト(見積含む): ${summary['hedge_extra_cost']:.6f}")
+                        
+                        # モデル別のコストとレイテンシ
+                        if len(summary["usage_by_model"]) > 1 or len(agent.model_configs) > 1:
+                            print("\n🔀 モデル別")
+                            print("-" * 30)
+                            for model, usage in summary["usage_by_model"].items():
+                                latency = agent.metrics.llm_latency.get_summary(model=model)
+                                latency_text = f" / p50 {latency['p50']:.3f}秒 / p95 {latency['p95']:.3f}秒" if latency["count"] else ""
+                                print(f"{model}: {usage['requests']}回 / 入力 {usage['prompt_tokens']:,}t / 出力 {usage['completion_tokens']:,}t / ${usage['cost']:.6f}{latency_text}")
+                            routing_stats = agent.routing_stats
+                            print(f"格上げ: {routing_stats.escalations}回 {routing_stats.escalations_by_reason} / 代替モデルでの再試行: {routing_stats.fallbacks}回")
                     else:
                         print("\n💰 コスト情報: リクエストなし")
                     
+                    # ツール結果キャッシュの集計を表示
+                    tool_cache_summary = agent.tool_cache.get_summary()
+                    if tool_cache_summary["hits"] or tool_cache_summary["misses"]:
+                        print("\n🗂️ ツール結果キャッシュ")
+                        print("-" * 30)
+                        print(f"ヒット: {tool_cache_summary['hits']} / ミス: {tool_cache_summary['misses']} / 同時呼び出しの共有: {tool_cache_summary['coalesced']}")
+                        print(f"ヒット率: {tool_cache_summary['hit_rate']:.1%}")
+                    
+                    if agent.template_answers:
+                        print(f"\n📝 結果テンプレートで省略したLLM呼び出し: {agent.template_answers}回")
+                    
+                    # 投機的実行の集計を表示
+                    if agent.speculation_stats.launched:
+                        speculation_summary = agent.speculation_stats.get_summary()
+                        print("\n🔮 投機的直接回答")
+                        print("-" * 30)
+                        print(f"開始: {speculation_summary['launched']} / 採用: {speculation_summary['used']} / 取消: {speculation_summary['cancelled']} / 完了後に破棄: {speculation_summary['wasted_completed']}")
+                        print(f"追加トークン(見積含む): {speculation_summary['extra_tokens']:,}")
+                        print(f"追加コスト(見積含む): ${speculation_summary['extra_cost']:.6f}")
+                        print(f"短縮できた時間: {speculation_summary['latency_saved_seconds']:.3f}秒 (平均 {speculation_summary['average_latency_saved_seconds']:.3f}秒/回)")
+                    
+                    # 会話メモリの集計を表示（ターンごとの入力トークンが横ばいかを確認する）
+                    if agent.memory is not None and agent.memory.turn_input_tokens:
+                        memory_summary = agent.memory.get_summary()
+                        print("\n🧠 会話メモリ")
+                        print("-" * 30)
+                        print(f"保持中の往復: {memory_summary['turns']} (履歴 {memory_summary['history_tokens']}t / 要約 {memory_summary['summary_tokens']}t)")
+                        print(f"要約への畳み込み: {memory_summary['compactions']}回")
+                        print(f"ターンごとの入力トークン: {memory_summary['turn_input_tokens']}")
+                        print(f"平均: {memory_summary['average_turn_input_tokens']:.1f}t / 最大: {memory_summary['max_turn_input_tokens']}t")
+                    
+                    # レイテンシの分位点を表示
+                    query_latencies = [
+                        (mode, agent.metrics.query_latency.get_summary(mode=mode)) for mode in ("sync", "stream")
+                    ]
+                    if any(latency["count"] for _, latency in query_latencies):
+                        print("\n📈 レイテンシ分位点（直近）")
+                        print("-" * 30)
+                        for mode, latency in query_latencies:
+                            if latency["count"]:
+                                print(f"クエリ({mode}): p50 {latency['p50']:.3f}秒 / p95 {latency['p95']:.3f}秒 / p99 {latency['p99']:.3f}秒 ({latency['count']}件)")
+                        if agent.llm_config:
+                            llm_latency = agent.metrics.llm_latency.get_summary(model=agent.llm_config.model)
+                            if llm_latency["count"]:
+                                print(f"LLM: p50 {llm_latency['p50']:.3f}秒 / p95 {llm_latency['p95']:.3f}秒 / p99 {llm_latency['p99']:.3f}秒 ({llm_latency['count']}件)")
+                    
+                    # リトライとサーキットブレーカーの状態を表示
+                    if any(stats.retries or stats.failures for stats in agent.retry_stats.values()):
+                        print("\n🔁 リトライ / サーキットブレーカー")
+                        print("-" * 30)
+                        for target, stats in agent.retry_stats.items():
+                            print(f"{target}: 呼び出し {stats.calls} / 再試行 {stats.retries} / タイムアウト {stats.timeouts} / 失敗 {stats.failures}")
+                        for name, breaker in agent.breakers.items():
+                            breaker_summary = breaker.get_summary()
+                            print(f"{name}: {breaker_summary['state']} (遮断 {breaker_summary['opened']}回 / 拒否 {breaker_summary['rejected']}回)")
+                    
+                    # MCPセッションプールの状態を表示
+                    if any(connection.pool.stats.checkouts for connection in agent.servers.values()):
+                        print("\n🏊 MCPセッションプール")
+                        print("-" * 30)
+                        for name, connection in agent.servers.items():
+                            pool_summary = connection.pool.get_summary()
+                            print(f"{name}: {pool_summary['open']}/{pool_summary['size']}接続, 貸し出し {pool_summary['checkouts']}回, "
+                                  f"待機 {pool_summary['waits']}回 (平均 {pool_summary['average_wait_seconds']:.3f}秒 / 最大 {pool_summary['max_wait_seconds']:.3f}秒), "
+                                  f"再接続 {pool_summary['discarded']}回")
+                    
+                    # レート制限の待ち時間を表示
+                    limiters = [(model, agent._rate_limiter(model)) for model in agent.model_configs]
+                    limiters = [(model, limiter) for model, limiter in limiters if limiter is not None]
+                    if limiters:
+                        print("\n⏳ レート制限")
+                        print("-" * 30)
+                        for model, limiter in limiters:
+                            limit_summary = limiter.get_summary()
+                            print(f"{model}: {limit_summary['requests_per_minute'] or '-'} RPM / {limit_summary['tokens_per_minute'] or '-'} TPM, "
+                                  f"待機 {limit_summary['waited']}/{limit_summary['acquired']}回 "
+                                  f"(合計 {limit_summary['wait_seconds']:.2f}秒 / 最大 {limit_summary['max_wait_seconds']:.2f}秒)")
+                    
+                    # フェーズごとのレイテンシを表示
+                    if agent.tracer.enabled and agent.tracer.spans:
+                        print("\n🧵 フェーズ別レイテンシ")
+                        print("-" * 30)
+                        for name, phase in agent.tracer.get_summary().items():
+                            print(f"{name}: {phase['count']}回 / 平均 {phase['average_ms']:.1f}ms / 最大 {phase['max_ms']:.1f}ms / 合計 {phase['total_ms']:.1f}ms")
+                    
+                    # 事前ルーターの集計を表示
+                    if agent.router is not None:
+                        router_summary = agent.router_stats.get_summary()
+                        print("\n🧭 事前ルーター")
+                        print("-" * 30)
+                        print(f"判定クエリ数: {router_summary['queries']}")
+                        print(f"ヒット数: {router_summary['hits']} (ヒット率: {router_summary['hit_rate']:.1%})")
+                        print(f"ツール別ヒット: {router_summary['hits_by_tool']}")
+                        print(f"LLM判定の平均時間: {router_summary['average_decision_seconds']:.3f}秒")
+                        print(f"節約できた推定時間: {router_summary['estimated_saved_seconds']:.3f}秒")
+                    
                     print("="*50)
                     print("👋 終了します。")
                     break
@@ -607,9 +2355,11 @@ async def main():
                 if not user_input:
                     continue
                 
-                # クエリ処理
-                result = await agent.process_query(user_input)
-                print(f"\n{result}")
+                # クエリ処理（回答はトークン単位で順次表示）
+                print()
+                async for text in agent.process_query_stream(user_input):
+                    print(text, end="", flush=True)
+                print()
                 
             except KeyboardInterrupt:
                 print("\n\n👋 終了します。")
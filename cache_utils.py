@@ -0,0 +1,217 @@
+#
+# キャッシュユーティリティ（メモリLRU + SQLite の2層キャッシュ）
+#
+
+# cache_utils.py
+import asyncio
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+def make_cache_key(data: Any) -> str:
+    """リクエスト内容を正規化したJSONからキーを生成"""
+    canonical = json.dumps(data, sort_keys=True, ensure_ascii=False, separators=(",", ":"), default=str)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+class LRUCache:
+    """TTL付きのメモリLRUキャッシュ"""
+
+    def __init__(self, max_entries: int = 256, ttl_seconds: Optional[float] = None):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+
+    def get(self, key: str) -> Optional[Any]:
+        """値を取得（期限切れは削除してNone）"""
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        value, expires_at = entry
+        if expires_at is not None and expires_at <= time.monotonic():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    def set(self, key: str, value: Any, ttl_seconds: Optional[float] = None):
+        """値を保存（上限を超えたら最も古いものから削除）"""
+        ttl = self.ttl_seconds if ttl_seconds is None else ttl_seconds
+        expires_at = time.monotonic() + ttl if ttl else None
+        self._entries[key] = (value, expires_at)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+class SQLiteCache:
+    """TTLと件数上限付きのSQLiteキャッシュ（プロセス再起動をまたいで保持）"""
+
+    def __init__(self, path: str, ttl_seconds: Optional[float] = None, max_entries: int = 10000):
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS cache ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL, "
+            "expires_at REAL, accessed_at REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS cache_accessed_at ON cache (accessed_at)")
+        self._conn.commit()
+        self._writes_since_prune = 0
+
+    def get(self, key: str) -> Optional[str]:
+        """値を取得（期限切れは削除してNone）"""
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value, expires_at FROM cache WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            value, expires_at = row
+            if expires_at is not None and expires_at <= now:
+                self._conn.execute("DELETE FROM cache WHERE key = ?", (key,))
+                self._conn.commit()
+                return None
+            self._conn.execute("UPDATE cache SET accessed_at = ? WHERE key = ?", (now, key))
+            self._conn.commit()
+            return value
+
+    def set(self, key: str, value: str):
+        """値を保存（一定間隔で期限切れと上限超過分を削除）"""
+        now = time.time()
+        expires_at = now + self.ttl_seconds if self.ttl_seconds else None
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO cache (key, value, expires_at, accessed_at) VALUES (?, ?, ?, ?)",
+                (key, value, expires_at, now)
+            )
+            self._writes_since_prune += 1
+            if self._writes_since_prune >= 100:
+                self._prune(now)
+            self._conn.commit()
+
+    def _prune(self, now: float):
+        """期限切れと、上限を超えた古いエントリを削除"""
+        self._writes_since_prune = 0
+        self._conn.execute("DELETE FROM cache WHERE expires_at IS NOT NULL AND expires_at <= ?", (now,))
+        self._conn.execute(
+            "DELETE FROM cache WHERE key IN ("
+            "SELECT key FROM cache ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)",
+            (self.max_entries,)
+        )
+
+    def close(self):
+        """接続を閉じる"""
+        with self._lock:
+            self._conn.close()
+
+class LLMResponseCache:
+    """LLMレスポンスの2層キャッシュ（メモリLRU → SQLite）
+
+    キーはリクエストパラメータ全体（モデル、メッセージ、温度、ツール定義など）のハッシュ。
+    値はレスポンスをJSON文字列にしたもの。
+    """
+
+    def __init__(self, memory_max_entries: int = 256, ttl_seconds: Optional[float] = 3600,
+                 sqlite_path: Optional[str] = None, disk_max_entries: int = 10000):
+        self.memory = LRUCache(memory_max_entries, ttl_seconds)
+        self.disk = SQLiteCache(sqlite_path, ttl_seconds, disk_max_entries) if sqlite_path else None
+
+    @classmethod
+    def from_config(cls, cache_config: Dict[str, Any]) -> Optional["LLMResponseCache"]:
+        """mcp.json の llm.cache 設定から生成（無効ならNone）"""
+        if not cache_config.get("enabled", False):
+            return None
+        return cls(
+            memory_max_entries=cache_config.get("memoryMaxEntries", 256),
+            ttl_seconds=cache_config.get("ttlSeconds", 3600),
+            sqlite_path=cache_config.get("sqlitePath"),
+            disk_max_entries=cache_config.get("diskMaxEntries", 10000)
+        )
+
+    async def get(self, request_params: Dict[str, Any]) -> Optional[str]:
+        """キャッシュ済みレスポンスを取得（SQLiteヒット時はメモリにも載せる）"""
+        key = make_cache_key(request_params)
+        value = self.memory.get(key)
+        if value is not None:
+            return value
+        if self.disk is None:
+            return None
+        value = await asyncio.to_thread(self.disk.get, key)
+        if value is not None:
+            self.memory.set(key, value)
+        return value
+
+    async def set(self, request_params: Dict[str, Any], value: str):
+        """レスポンスを両方の層に保存"""
+        key = make_cache_key(request_params)
+        self.memory.set(key, value)
+        if self.disk is not None:
+            await asyncio.to_thread(self.disk.set, key, value)
+
+    def close(self):
+        """SQLite接続を閉じる"""
+        if self.disk is not None:
+            self.disk.close()
+
+class ToolResultCache:
+    """ツール実行結果のメモ化キャッシュ
+
+    キーはツール名と正規化した引数。TTLはツールごとに指定する。
+    同じキーへの同時ミスは1回の呼び出しを共有する（失敗した結果はキャッシュしない）。
+    """
+
+    def __init__(self, max_entries: int = 1024):
+        self._results = LRUCache(max_entries)
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+
+    async def get_or_call(self, tool_name: str, arguments: Dict[str, Any], ttl_seconds: float, call) -> Any:
+        """キャッシュがあれば返し、なければ call() を実行して保存"""
+        key = make_cache_key({"tool": tool_name, "arguments": arguments})
+
+        entry = self._results.get(key)
+        if entry is not None:
+            self.hits += 1
+            return entry[0]
+
+        future = self._inflight.get(key)
+        if future is None:
+            self.misses += 1
+            future = asyncio.ensure_future(self._call_and_store(key, ttl_seconds, call))
+            self._inflight[key] = future
+            future.add_done_callback(lambda _: self._inflight.pop(key, None))
+        else:
+            self.coalesced += 1
+
+        # 待っている側がキャンセルされても、共有中の呼び出しは止めない
+        return await asyncio.shield(future)
+
+    async def _call_and_store(self, key: str, ttl_seconds: float, call) -> Any:
+        """呼び出しが成功した場合のみ結果を保存"""
+        value = await call()
+        # Noneも結果として保存できるようタプルで包む
+        self._results.set(key, (value,), ttl_seconds)
+        return value
+
+    def get_summary(self) -> Dict[str, Any]:
+        """集計結果のサマリーを返す"""
+        lookups = self.hits + self.misses + self.coalesced
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "hit_rate": (self.hits + self.coalesced) / lookups if lookups else 0.0,
+            "entries": len(self._results)
+        }
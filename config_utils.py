@@ -0,0 +1,540 @@
+#
+# mcp.json の読み込み・検証・コンパイルとホットリロード
+#   読み込み時に ${VAR} / ENV:VAR を展開し、スキーマで型を確認してから変更不可のオブジェクトにする。
+#   ファイルの更新時刻を定期的に確認し、変更があれば読み直して丸ごと差し替える。
+#
+
+# config_utils.py
+import asyncio
+import json
+import os
+import re
+import time
+from dataclasses import dataclass, field
+from pathlib import Path
+from types import MappingProxyType
+from typing import Any, Callable, Dict, List, Mapping, Optional, Tuple
+
+NUMBER = (int, float)
+
+# ${VAR} または ${VAR:-既定値}
+_ENV_PATTERN = re.compile(r"\$\{([A-Za-z_][A-Za-z0-9_]*)(?::-([^}]*))?\}")
+
+class ConfigError(ValueError):
+    """設定ファイルの検証エラー（問題箇所をまとめて報告する）"""
+
+    def __init__(self, path: str, errors: List[str]):
+        self.path = path
+        self.errors = errors
+        super().__init__(f"設定ファイルが不正です: {path}\n" + "\n".join(f"  - {error}" for error in errors))
+
+@dataclass(frozen=True)
+class Field:
+    """スキーマの値1つ分の型と制約"""
+    types: Any
+    choices: Tuple[Any, ...] = ()
+    minimum: Optional[float] = None
+    maximum: Optional[float] = None
+
+def _list_of(item: Any) -> List[Any]:
+    return [item]
+
+# mcp.json のスキーマ（既知のキーだけ型を確認し、未知のキーはそのまま通す）
+# dict はネストした設定、"*" は任意の名前をキーにした設定の集合、[x] は x のリスト
+SCHEMA: Dict[str, Any] = {
+    "mcpServers": {
+        "*": {
+            "command": Field(str),
+            "args": _list_of(Field(str)),
+            "env": {"*": Field(str)},
+            "cwd": Field(str),
+            "timeout": Field(NUMBER, minimum=0),
+            "retries": Field(int, minimum=0),
+            "transport": Field(str, choices=("http", "stdio", "sse")),
+            "host": Field(str),
+            "port": Field(int, minimum=1, maximum=65535),
+            "path": Field(str),
+            "poolSize": Field(int, minimum=1),
+        }
+    },
+    "clients": {
+        "*": {
+            "servers": _list_of(Field(str)),
+            "timeout": Field(NUMBER, minimum=0),
+            "maxRetries": Field(int, minimum=0),
+            "circuitBreaker": {
+                "failureThreshold": Field(int, minimum=1),
+                "resetTimeoutSeconds": Field(NUMBER, minimum=0),
+            },
+            "pool": {
+                "size": Field(int, minimum=1),
+                "minSize": Field(int, minimum=1),
+                "healthCheckIntervalSeconds": Field(NUMBER, minimum=0),
+            },
+            "debug": Field(bool),
+        }
+    },
+    "llm": {
+        "provider": Field(str),
+        "model": Field(str),
+        "temperature": Field(NUMBER, minimum=0),
+        "maxTokens": Field(int, minimum=1),
+        "apiKey": Field(str),
+        "timeout": Field(NUMBER, minimum=0),
+        "maxRetries": Field(int, minimum=0),
+        "maxConnections": Field(int, minimum=1),
+        "cache": {
+            "enabled": Field(bool),
+            "memoryMaxEntries": Field(int, minimum=0),
+            "ttlSeconds": Field(NUMBER, minimum=0),
+            "sqlitePath": Field(str),
+            "diskMaxEntries": Field(int, minimum=0),
+        },
+        "routing": {
+            "enabled": Field(bool),
+            "decisionModels": _list_of(Field(str)),
+            "phrasingModels": _list_of(Field(str)),
+            "fallbacks": {"*": Field(str)},
+            "minConfidence": Field(NUMBER, minimum=0, maximum=1),
+        },
+        "hedging": {
+            "enabled": Field(bool),
+            "percentile": Field(NUMBER, minimum=0, maximum=1),
+            "minSamples": Field(int, minimum=1),
+            "minDelaySeconds": Field(NUMBER, minimum=0),
+            "windowSize": Field(int, minimum=1),
+        },
+        "modelSettings": {
+            "*": {
+                "useMaxCompletionTokens": Field(bool),
+                "maxCompletionTokens": Field(int, minimum=1),
+                "maxTokens": Field(int, minimum=1),
+                "useTemperature": Field(bool),
+                "temperature": Field(NUMBER, minimum=0),
+                "supportsLogprobs": Field(bool),
+                "requestsPerMinute": Field(int, minimum=0),
+                "tokensPerMinute": Field(int, minimum=0),
+            }
+        },
+    },
+    "agent": {
+        "maxIterations": Field(int, minimum=1),
+        "debugMode": Field(bool),
+        "fallbackToDirect": Field(bool),
+        "timeout": Field(NUMBER, minimum=0),
+        "maxConcurrentQueries": Field(int, minimum=1),
+        "toolCallingMode": Field(str, choices=("text", "native")),
+        "preRouting": Field(bool),
+        "speculativeDirect": Field(bool),
+        "memory": {
+            "enabled": Field(bool),
+            "maxHistoryTokens": Field(int, minimum=1),
+            "summaryMaxTokens": Field(int, minimum=1),
+            "keepRecentTurns": Field(int, minimum=0),
+        },
+        "tracing": {
+            "enabled": Field(bool),
+            "chromeTracePath": Field(str),
+            "jsonlPath": Field(str),
+            "maxSpans": Field(int, minimum=1),
+        },
+        "metrics": {
+            "enabled": Field(bool),
+            "host": Field(str),
+            "port": Field(int, minimum=1, maximum=65535),
+        },
+        "warmStart": {
+            "enabled": Field(bool),
+            "snapshotPath": Field(str),
+            "maxAgeSeconds": Field(NUMBER, minimum=0),
+        },
+        "configReload": {
+            "enabled": Field(bool),
+            "intervalSeconds": Field(NUMBER, minimum=0.1),
+        },
+        "server": {
+            "host": Field(str),
+            "port": Field(int, minimum=1, maximum=65535),
+            "maxConcurrentQueries": Field(int, minimum=1),
+            "maxQueuedQueries": Field(int, minimum=0),
+            "debug": Field(bool),
+        },
+        "sessions": {
+            "idleTimeoutSeconds": Field(NUMBER, minimum=0),
+            "maxSessions": Field(int, minimum=1),
+            "maxMemoryMb": Field(NUMBER, minimum=1),
+            "sweepIntervalSeconds": Field(NUMBER, minimum=0.1),
+        },
+    },
+    "tools": {
+        "*": {
+            "description": Field(str),
+            "keywords": _list_of(Field(str)),
+            "weakKeywords": _list_of(Field(str)),
+            "maxNumbers": Field(int, minimum=0),
+            "defaultCity": Field(str),
+            "cities": _list_of(Field(str)),
+            "noParameters": Field(bool),
+            "resultTemplate": Field(str),
+            "terminal": Field(bool),
+            "cacheable": Field(bool),
+            "cacheTtlSeconds": Field(NUMBER, minimum=0),
+        }
+    },
+}
+
+def _type_name(types: Any) -> str:
+    if types is NUMBER:
+        return "数値"
+    return {str: "文字列", int: "整数", bool: "真偽値"}.get(types, getattr(types, "__name__", str(types)))
+
+def _check_field(value: Any, spec: Field, path: str, errors: List[str]):
+    # bool は int のサブクラスなので、数値の項目に true/false が入っていたら弾く
+    if not isinstance(value, spec.types) or (isinstance(value, bool) and spec.types is not bool):
+        errors.append(f"{path}: {_type_name(spec.types)}が必要です（{type(value).__name__}: {value!r}）")
+        return
+    if spec.choices and value not in spec.choices:
+        errors.append(f"{path}: {list(spec.choices)} のいずれかが必要です（{value!r}）")
+    if spec.minimum is not None and value < spec.minimum:
+        errors.append(f"{path}: {spec.minimum} 以上が必要です（{value!r}）")
+    if spec.maximum is not None and value > spec.maximum:
+        errors.append(f"{path}: {spec.maximum} 以下が必要です（{value!r}）")
+
+def _validate(value: Any, schema: Any, path: str, errors: List[str]):
+    if isinstance(schema, Field):
+        _check_field(value, schema, path, errors)
+    elif isinstance(schema, list):
+        if not isinstance(value, list):
+            errors.append(f"{path}: リストが必要です（{type(value).__name__}）")
+            return
+        for index, item in enumerate(value):
+            _validate(item, schema[0], f"{path}[{index}]", errors)
+    elif isinstance(schema, dict):
+        if not isinstance(value, dict):
+            errors.append(f"{path or '(ルート)'}: オブジェクトが必要です（{type(value).__name__}）")
+            return
+        for key, item in value.items():
+            item_schema = schema.get("*", schema.get(key))
+            if item_schema is not None:
+                _validate(item, item_schema, f"{path}.{key}" if path else key, errors)
+
+def validate_config(config: Dict[str, Any]) -> List[str]:
+    """スキーマと項目間の整合性を確認し、問題の一覧を返す（問題がなければ空）"""
+    errors: List[str] = []
+    _validate(config, SCHEMA, "", errors)
+    if errors:
+        return errors
+
+    servers = config.get("mcpServers", {})
+    for client_name, client in config.get("clients", {}).items():
+        for server_name in client.get("servers", []):
+            if server_name not in servers:
+                errors.append(f"clients.{client_name}.servers: サーバー '{server_name}' が mcpServers にありません")
+        pool = client.get("pool", {})
+        if pool.get("minSize", 1) > pool.get("size", 4):
+            errors.append(f"clients.{client_name}.pool: minSize は size 以下にしてください")
+    return errors
+
+def interpolate(value: Any, path: str = "", errors: Optional[List[str]] = None,
+                environ: Optional[Mapping[str, str]] = None) -> Any:
+    """文字列中の ${VAR} / ${VAR:-既定値} と、値全体が "ENV:VAR" の文字列を環境変数で置き換える"""
+    environ = os.environ if environ is None else environ
+    errors = [] if errors is None else errors
+    if isinstance(value, dict):
+        return {key: interpolate(item, f"{path}.{key}" if path else key, errors, environ) for key, item in value.items()}
+    if isinstance(value, list):
+        return [interpolate(item, f"{path}[{index}]", errors, environ) for index, item in enumerate(value)]
+    if not isinstance(value, str):
+        return value
+
+    if value.startswith("ENV:"):
+        name = value[4:]
+        if name not in environ:
+            errors.append(f"{path}: 環境変数 '{name}' が設定されていません")
+            return ""
+        return environ[name]
+
+    def replace(match: re.Match) -> str:
+        name, default = match.group(1), match.group(2)
+        if name in environ:
+            return environ[name]
+        if default is not None:
+            return default
+        errors.append(f"{path}: 環境変数 '{name}' が設定されていません")
+        return ""
+    return _ENV_PATTERN.sub(replace, value)
+
+def _is_env_reference(value: Any) -> bool:
+    return isinstance(value, str) and (value.startswith("ENV:") or _ENV_PATTERN.search(value) is not None)
+
+def _parse_scalar(text: str, types: Any) -> Any:
+    """環境変数の文字列を数値・真偽値に変換（変換できなければそのまま返し、検証でエラーにする）"""
+    text = text.strip()
+    if types is bool:
+        return {"true": True, "1": True, "yes": True, "on": True,
+                "false": False, "0": False, "no": False, "off": False}.get(text.lower(), text)
+    try:
+        if types is int or (types is NUMBER and re.fullmatch(r"[+-]?\d+", text)):
+            return int(text)
+        if types is NUMBER:
+            return float(text)
+    except ValueError:
+        pass
+    return text
+
+def coerce_interpolated(value: Any, raw: Any, schema: Any = SCHEMA) -> Any:
+    """環境変数から展開した値のうち、スキーマが数値・真偽値を求める項目を型変換する
+
+    JSONに直接書かれた文字列はそのまま（"8001" のような書き間違いは検証でエラーにする）。
+    """
+    if isinstance(schema, Field):
+        if schema.types is not str and isinstance(value, str) and _is_env_reference(raw):
+            return _parse_scalar(value, schema.types)
+        return value
+    if isinstance(schema, list) and isinstance(value, list) and isinstance(raw, list):
+        return [coerce_interpolated(item, raw_item, schema[0]) for item, raw_item in zip(value, raw)]
+    if isinstance(schema, dict) and isinstance(value, dict) and isinstance(raw, dict):
+        coerced = {}
+        for key, item in value.items():
+            item_schema = schema.get("*", schema.get(key))
+            coerced[key] = item if item_schema is None else coerce_interpolated(item, raw.get(key), item_schema)
+        return coerced
+    return value
+
+def freeze(value: Any) -> Any:
+    """dict を読み取り専用の Mapping に、list を tuple に変換（入れ子も含めて）"""
+    if isinstance(value, dict):
+        return MappingProxyType({key: freeze(item) for key, item in value.items()})
+    if isinstance(value, list):
+        return tuple(freeze(item) for item in value)
+    return value
+
+def thaw(value: Any) -> Any:
+    """freeze の逆変換（JSONに書き出す時など）"""
+    if isinstance(value, Mapping):
+        return {key: thaw(item) for key, item in value.items()}
+    if isinstance(value, tuple):
+        return [thaw(item) for item in value]
+    return value
+
+_EMPTY: Mapping[str, Any] = MappingProxyType({})
+
+@dataclass(frozen=True)
+class ServerSettings:
+    """コンパイル済みのサーバー設定（URLは組み立て済み）"""
+    name: str
+    url: str
+    timeout: Optional[float] = None
+    retries: Optional[int] = None
+    pool_size: Optional[int] = None
+    settings: Mapping[str, Any] = field(default_factory=lambda: _EMPTY)
+
+@dataclass(frozen=True)
+class CompiledConfig:
+    """検証・環境変数展開済みで変更できない設定
+
+    各セクションは読み取り専用の Mapping なので、そのまま from_config(...) に渡せる。
+    """
+    path: str
+    generation: int  # 読み込み回数（再読み込みのたびに増える）
+    loaded_at: float
+    servers: Mapping[str, ServerSettings]
+    clients: Mapping[str, Mapping[str, Any]]
+    llm: Mapping[str, Any]
+    agent: Mapping[str, Any]
+    tools: Mapping[str, Mapping[str, Any]]
+
+    def server(self, name: str) -> ServerSettings:
+        if name not in self.servers:
+            raise KeyError(f"サーバー '{name}' が見つかりません")
+        return self.servers[name]
+
+    def client(self, name: str = "default") -> Mapping[str, Any]:
+        if name not in self.clients:
+            raise KeyError(f"クライアント '{name}' が見つかりません")
+        return self.clients[name]
+
+    def tool(self, name: str) -> Mapping[str, Any]:
+        return self.tools.get(name, _EMPTY)
+
+    def changed_sections(self, other: "CompiledConfig") -> List[str]:
+        """other と内容が異なる設定を "llm.modelSettings" のような名前で返す（2階層目まで）"""
+        changed = []
+        for section in ("servers", "clients", "llm", "agent", "tools"):
+            mine, theirs = getattr(self, section), getattr(other, section)
+            if mine == theirs:
+                continue
+            if section in ("servers", "clients", "tools"):
+                changed.append(section)
+                continue
+            for key in sorted(set(mine) | set(theirs)):
+                if mine.get(key) != theirs.get(key):
+                    changed.append(f"{section}.{key}")
+        return changed
+
+def compile_config(raw: Dict[str, Any], path: str = "mcp.json", generation: int = 1,
+                   environ: Optional[Mapping[str, str]] = None) -> CompiledConfig:
+    """読み込んだJSONの環境変数を展開してから検証し、コンパイル（問題があれば ConfigError）
+
+    ポートやタイムアウトなど数値・真偽値の項目にも ${VAR} / ENV:VAR を使えるよう、展開した値で検証する。
+    エラーの位置は元のJSONのキーで示す。
+    """
+    errors: List[str] = []
+    resolved = interpolate(raw, errors=errors, environ=environ)
+    if errors:
+        raise ConfigError(path, errors)
+    resolved = coerce_interpolated(resolved, raw)
+    errors = validate_config(resolved)
+    if errors:
+        raise ConfigError(path, errors)
+
+    servers = {}
+    for name, server in resolved.get("mcpServers", {}).items():
+        host = server.get("host", "localhost")
+        port = server.get("port", 8001)
+        server_path = server.get("path", "/mcp")
+        servers[name] = ServerSettings(
+            name=name,
+            url=f"http://{host}:{port}{server_path}",
+            timeout=server.get("timeout"),
+            retries=server.get("retries"),
+            pool_size=server.get("poolSize"),
+            settings=freeze(server)
+        )
+    return CompiledConfig(
+        path=path,
+        generation=generation,
+        loaded_at=time.time(),
+        servers=MappingProxyType(servers),
+        clients=freeze(resolved.get("clients", {})),
+        llm=freeze(resolved.get("llm", {})),
+        agent=freeze(resolved.get("agent", {})),
+        tools=freeze(resolved.get("tools", {}))
+    )
+
+def load_config(path: str, generation: int = 1) -> CompiledConfig:
+    """設定ファイルを読み込んでコンパイル"""
+    config_path = Path(path)
+    if not config_path.exists():
+        raise FileNotFoundError(f"設定ファイルが見つかりません: {config_path}")
+    try:
+        with open(config_path, 'r', encoding='utf-8') as f:
+            raw = json.load(f)
+    except json.JSONDecodeError as e:
+        raise ValueError(f"設定ファイルのJSON形式が無効です: {e}")
+    return compile_config(raw, str(config_path), generation)
+
+class MCPConfig:
+    """MCP設定管理クラス
+
+    current が常に最新のコンパイル済み設定を指す。再読み込みでは新しい CompiledConfig を作って
+    参照を差し替えるだけなので、読み込み途中の設定が見えることはなく、処理中のクエリは
+    手元に取った設定のまま最後まで進む。
+    """
+
+    def __init__(self, config_path: str = "mcp.json"):
+        self.config_path = Path(config_path)
+        self.current = load_config(str(self.config_path))
+        self._stamp = self._file_stamp()
+        self._listeners: List[Callable[[CompiledConfig, CompiledConfig], None]] = []
+        self._watch_task: Optional[asyncio.Task] = None
+        self.reloads = 0
+        self.reload_errors = 0
+        print(f"✅ 設定ファイル読み込み完了: {self.config_path}")
+
+    def _file_stamp(self) -> Optional[Tuple[int, int]]:
+        try:
+            stat = os.stat(self.config_path)
+        except OSError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
+
+    def add_listener(self, listener: Callable[[CompiledConfig, CompiledConfig], None]):
+        """差し替え時に listener(古い設定, 新しい設定) を呼ぶ（例外を送出したら差し替えを取り消す）"""
+        self._listeners.append(listener)
+
+    def get_server_config(self, server_name: str) -> Mapping[str, Any]:
+        """サーバー設定を取得"""
+        return self.current.server(server_name).settings
+
+    def get_client_config(self, client_name: str = "default") -> Mapping[str, Any]:
+        """クライアント設定を取得"""
+        return self.current.client(client_name)
+
+    def get_llm_config(self) -> Mapping[str, Any]:
+        """LLM設定を取得"""
+        return self.current.llm
+
+    def get_agent_config(self) -> Mapping[str, Any]:
+        """エージェント設定を取得"""
+        return self.current.agent
+
+    def get_tool_config(self, tool_name: str) -> Mapping[str, Any]:
+        """ツール設定を取得"""
+        return self.current.tool(tool_name)
+
+    def build_server_url(self, server_name: str) -> str:
+        """サーバーURLを取得（読み込み時に組み立て済み）"""
+        return self.current.server(server_name).url
+
+    async def reload_if_changed(self) -> bool:
+        """ファイルが更新されていれば読み直して差し替える（差し替えたら True）
+
+        読み込みと検証はスレッドで行い、差し替えはイベントループ上で一度に行う。
+        不正な設定の場合は警告を出して現在の設定を使い続ける。
+        """
+        stamp = self._file_stamp()
+        if stamp is None or stamp == self._stamp:
+            return False
+        # 同じ内容で何度も警告しないよう、失敗した場合もこの時点の状態を覚えておく
+        self._stamp = stamp
+        try:
+            new = await asyncio.to_thread(load_config, str(self.config_path), self.current.generation + 1)
+        except Exception as e:
+            self.reload_errors += 1
+            print(f"⚠️ 設定の再読み込みに失敗しました（現在の設定を使い続けます）: {e}")
+            return False
+        return self.swap(new)
+
+    def swap(self, new: CompiledConfig) -> bool:
+        """設定を差し替えてリスナーに通知（リスナーが失敗したら元に戻す）"""
+        old = self.current
+        self.current = new
+        try:
+            for listener in self._listeners:
+                listener(old, new)
+        except Exception as e:
+            self.current = old
+            for listener in self._listeners:
+                try:
+                    listener(new, old)
+                except Exception:
+                    pass
+            self.reload_errors += 1
+            print(f"⚠️ 新しい設定を適用できませんでした（現在の設定を使い続けます）: {e}")
+            return False
+        self.reloads += 1
+        return True
+
+    @property
+    def watching(self) -> bool:
+        return self._watch_task is not None and not self._watch_task.done()
+
+    def start_watching(self, interval: float = 2.0):
+        """interval 秒ごとにファイルの更新を確認するタスクを開始"""
+        if self._watch_task is None or self._watch_task.done():
+            self._watch_task = asyncio.create_task(self._watch(interval))
+
+    async def _watch(self, interval: float):
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.reload_if_changed()
+            except Exception as e:
+                print(f"⚠️ 設定ファイルの監視エラー: {e}")
+
+    async def stop_watching(self):
+        if self._watch_task is not None and not self._watch_task.done():
+            self._watch_task.cancel()
+            await asyncio.gather(self._watch_task, return_exceptions=True)
+        self._watch_task = None
@@ -76,3 +76,13 @@ class UsageCostCalculator:
         print(f"Completion tokens: {self.completion_tokens}  | Rate: ${self.output_rate_per_token:.6f}/token | Cost: ${self.output_cost:.6f}")
         print(f"Total tokens: {self.total_tokens}")
         print(f"Total cost:  ${self.total_cost:.6f}")
+
+# 送信前のトークン数見積もり（tiktokenを使わない簡易版）
+def estimate_tokens(text: str) -> int:
+    """ASCIIは約4文字で1トークン、日本語などの非ASCIIは1文字1トークンとして見積もる"""
+    ascii_chars = sum(1 for ch in text if ord(ch) < 128)
+    return ascii_chars // 4 + (len(text) - ascii_chars) + 1
+
+def estimate_messages_tokens(messages) -> int:
+    """チャットメッセージ全体のトークン数を見積もる（1メッセージあたりのオーバーヘッド込み）"""
+    return sum(estimate_tokens(str(message.get("content") or "")) + 4 for message in messages) + 2
@@ -0,0 +1,181 @@
+#
+# 起動時間（import 時間）のベンチマーク
+#   python -X importtime でエントリーポイントを毎回新しいプロセスで import し、
+#   import にかかった時間と重い依存モジュールを表示する。予算（ミリ秒）を超えたら終了コード1。
+#
+#   使い方:
+#     python importtime_bench.py                       # 全エントリーポイント
+#     python importtime_bench.py 05_mcpClient4 -r 10   # 指定したものを10回ずつ
+#     python importtime_bench.py -o importtime.jsonl   # 結果をJSONLに追記（推移の記録用）
+#
+
+# importtime_bench.py
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+import time
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+# エントリーポイントごとの import 時間の予算（ミリ秒）
+# 重い依存（openai / fastmcp / LangChain など）は使う直前に読み込むため、import 自体は軽いはず。
+# 05_* のクライアントは asyncio（約60ms）が大半で、実測のおよそ2倍を予算にしている。
+# サーバーは起動時に FastAPI / FastMCP が必要なので予算を大きめにしている。
+BUDGETS_MS: Dict[str, float] = {
+    "02_ReActOnLangChain": 50,
+    "02_ReActOnLangChainMultiTool": 50,
+    "02_ReActOnLangChainMultiTool_2": 50,
+    "04_mcpClientLlm": 200,  # requests は MCPClient が常に使うため import 時に読み込む
+    "04_mcpServer": 1500,
+    "05_mcpClient3": 150,
+    "05_mcpClient4": 300,
+    "05_mcpBatch": 300,
+    "05_mcpAgentServer": 2500,
+    "05_mcpServer": 2500,
+}
+
+ROOT = Path(__file__).resolve().parent
+
+@dataclass
+class ImportRun:
+    """1回分の計測結果"""
+    import_ms: float  # -X importtime の累積時間
+    wall_ms: float  # インタープリタ起動を含むプロセス全体の時間
+    dependencies: List[Tuple[str, float]] = field(default_factory=list)  # 直接 import したモジュールと累積時間
+
+@dataclass
+class BenchResult:
+    """エントリーポイント1つ分の集計"""
+    module: str
+    runs: int
+    import_ms: float  # 中央値
+    wall_ms: float  # 中央値
+    budget_ms: Optional[float]
+    top_dependencies: List[Tuple[str, float]]
+    error: str = ""
+
+    @property
+    def over_budget(self) -> bool:
+        return bool(self.error) or (self.budget_ms is not None and self.import_ms > self.budget_ms)
+
+def parse_importtime(stderr: str, module: str) -> Optional[Tuple[float, List[Tuple[str, float]]]]:
+    """-X importtime の出力から、対象モジュールの累積時間（ms）と直接の依存を取り出す
+
+    出力は子モジュールが親より先に並ぶ（後順）ので、対象モジュールの行までに現れた
+    1段下の行が直接の依存になる。
+    """
+    children: List[Tuple[str, float]] = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "imported package" in line:
+            continue
+        try:
+            _, cumulative, name = line[len("import time:"):].split("|", 2)
+            cumulative_us = int(cumulative)
+        except ValueError:
+            continue
+        depth = (len(name) - len(name.lstrip())) // 2
+        name = name.strip()
+        if depth == 0:
+            if name == module:
+                return cumulative_us / 1000, children
+            children = []
+        elif depth == 1:
+            children.append((name, cumulative_us / 1000))
+    return None
+
+def measure(module: str) -> ImportRun:
+    """新しいプロセスで1回 import して計測"""
+    # importlib.import_module は -X importtime の計測対象外なので __import__ を使う
+    code = f"import sys; sys.path.insert(0, {str(ROOT)!r}); __import__({module!r})"
+    started_at = time.perf_counter()
+    completed = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        cwd=ROOT, capture_output=True, text=True
+    )
+    wall_ms = (time.perf_counter() - started_at) * 1000
+    if completed.returncode != 0:
+        last_line = completed.stderr.strip().splitlines()[-1] if completed.stderr.strip() else "不明なエラー"
+        raise RuntimeError(last_line)
+    parsed = parse_importtime(completed.stderr, module)
+    if parsed is None:
+        raise RuntimeError("importtime の出力に対象モジュールが見つかりません")
+    import_ms, dependencies = parsed
+    return ImportRun(import_ms=import_ms, wall_ms=wall_ms, dependencies=dependencies)
+
+def bench(module: str, runs: int, top: int, budget_ms: Optional[float]) -> BenchResult:
+    """runs 回計測して中央値を求める（1回目はファイルキャッシュが冷えている場合があるので含める）"""
+    try:
+        results = [measure(module) for _ in range(runs)]
+    except RuntimeError as e:
+        return BenchResult(module=module, runs=0, import_ms=0.0, wall_ms=0.0,
+                           budget_ms=budget_ms, top_dependencies=[], error=str(e))
+
+    # 依存ごとの時間も中央値で比べる
+    dependency_times: Dict[str, List[float]] = {}
+    for result in results:
+        for name, ms in result.dependencies:
+            dependency_times.setdefault(name, []).append(ms)
+    top_dependencies = sorted(
+        ((name, statistics.median(times)) for name, times in dependency_times.items()),
+        key=lambda item: item[1], reverse=True
+    )[:top]
+
+    return BenchResult(
+        module=module,
+        runs=runs,
+        import_ms=statistics.median(result.import_ms for result in results),
+        wall_ms=statistics.median(result.wall_ms for result in results),
+        budget_ms=budget_ms,
+        top_dependencies=top_dependencies
+    )
+
+def main():
+    parser = argparse.ArgumentParser(description="エントリーポイントの import 時間ベンチマーク")
+    parser.add_argument("modules", nargs="*", help="計測するモジュール（既定: 全エントリーポイント）")
+    parser.add_argument("-r", "--runs", type=int, default=5, help="1モジュールあたりの計測回数")
+    parser.add_argument("-t", "--top", type=int, default=5, help="表示する重い依存の数")
+    parser.add_argument("-b", "--budget-ms", type=float, default=None, help="予算を一律この値にする（ミリ秒）")
+    parser.add_argument("-o", "--output", default=None, help="結果を追記するJSONLファイル")
+    args = parser.parse_args()
+
+    modules = [name[:-3] if name.endswith(".py") else name for name in args.modules] or list(BUDGETS_MS)
+
+    print(f"🐍 {sys.executable} ({sys.version.split()[0]}), {args.runs}回ずつ計測")
+    print("=" * 60)
+    results = []
+    for module in modules:
+        budget_ms = args.budget_ms if args.budget_ms is not None else BUDGETS_MS.get(module)
+        result = bench(module, args.runs, args.top, budget_ms)
+        results.append(result)
+
+        if result.error:
+            print(f"❌ {module}: import エラー: {result.error}")
+            continue
+        mark = "❌" if result.over_budget else "✅"
+        budget = f" / 予算 {result.budget_ms:.0f}ms" if result.budget_ms is not None else ""
+        print(f"{mark} {module}: import {result.import_ms:.1f}ms{budget} (プロセス全体 {result.wall_ms:.1f}ms)")
+        for name, ms in result.top_dependencies:
+            print(f"     {ms:8.1f}ms  {name}")
+
+    if args.output:
+        recorded_at = time.strftime("%Y-%m-%dT%H:%M:%S")
+        with open(args.output, "a", encoding="utf-8") as f:
+            for result in results:
+                record = asdict(result)
+                record["recorded_at"] = recorded_at
+                record["python"] = sys.version.split()[0]
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+        print(f"📝 結果を追記しました: {args.output}")
+
+    over = [result.module for result in results if result.over_budget]
+    print("=" * 60)
+    if over:
+        print(f"❌ 予算超過またはエラー: {over}")
+        sys.exit(1)
+    print("✅ すべて予算内です")
+
+if __name__ == "__main__":
+    main()
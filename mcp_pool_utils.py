@@ -0,0 +1,237 @@
+#
+# MCPクライアントのセッションプール（サーバーごとに複数セッションを貸し出し・返却・ヘルスチェック）
+#
+
+# mcp_pool_utils.py
+import asyncio
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+from typing import Any, AsyncIterator, Callable, Dict
+
+from resilience_utils import is_retryable_error
+
+@dataclass
+class PoolStats:
+    """プールの貸し出し・待ち・作り直しの集計"""
+    checkouts: int = 0
+    waits: int = 0  # 空きがなく待たされた回数
+    wait_seconds: float = 0.0
+    max_wait_seconds: float = 0.0
+    created: int = 0
+    discarded: int = 0
+    health_checks: int = 0
+    health_failures: int = 0
+
+class _PooledSession:
+    """プール内の1セッション"""
+    __slots__ = ("client", "last_used")
+
+    def __init__(self, client: Any):
+        self.client = client
+        self.last_used = time.monotonic()
+
+class MCPClientPool:
+    """1台のMCPサーバーへのクライアントセッションのプール
+
+    factory() で作った FastMCP Client を __aenter__ で接続して使い回す。
+    起動時に min_size 個を接続し、同時実行が増えたら size 個まで追加で接続する。
+    すべて貸し出し中なら返却されるまで先着順で待つ。
+    health_check_interval 秒以上使われていないセッションは貸し出し前に ping で確認し、
+    応答しなければ破棄して接続し直す。
+    """
+
+    def __init__(self, name: str, factory: Callable[[], Any], size: int = 4, min_size: int = 1,
+                 health_check_interval: float = 30.0, health_check_timeout: float = 5.0):
+        self.name = name
+        self.factory = factory
+        self.size = max(1, size)
+        self.min_size = max(1, min(min_size, self.size))
+        self.health_check_interval = health_check_interval
+        self.health_check_timeout = health_check_timeout
+        self.stats = PoolStats()
+        self._idle: deque = deque()
+        self._total = 0  # 接続中・接続処理中のセッション数
+        self._waiters: deque = deque()
+        self._closed = False
+
+    @property
+    def in_use(self) -> int:
+        return self._total - len(self._idle)
+
+    async def start(self):
+        """min_size 個のセッションを並行に接続（1つでも失敗したら全て閉じて例外）"""
+        self._closed = False
+        self._total += self.min_size
+        results = await asyncio.gather(*(self._open() for _ in range(self.min_size)), return_exceptions=True)
+        errors = [result for result in results if isinstance(result, BaseException)]
+        self._total -= len(errors)
+        for result in results:
+            if isinstance(result, _PooledSession):
+                self._idle.append(result)
+        if errors:
+            await self.close()
+            raise errors[0]
+
+    async def _open(self) -> _PooledSession:
+        client = self.factory()
+        await client.__aenter__()
+        self.stats.created += 1
+        return _PooledSession(client)
+
+    async def checkout(self) -> _PooledSession:
+        """セッションを借りる（空きがなければ返却を待つ）"""
+        started_at = time.monotonic()
+        waited = False
+        while True:
+            if self._closed:
+                raise RuntimeError(f"{self.name} のセッションプールは閉じられています")
+
+            # 最後に返却されたものから使う（接続が温まっている可能性が高い）
+            while self._idle:
+                session = self._idle.pop()
+                try:
+                    healthy = await self._is_healthy(session)
+                except BaseException:
+                    # ping の途中で取り消された（呼び出しの期限切れ・クライアントの切断など）セッションは
+                    # 状態が不明なので、枠を空けてから閉じる（閉じるのは取り消しと無関係に続ける）
+                    self._forget(session)
+                    asyncio.ensure_future(self._close_client(session))
+                    raise
+                if healthy:
+                    return self._lend(session, started_at, waited)
+                await self._discard(session)
+
+            if self._total < self.size:
+                self._total += 1
+                try:
+                    session = await self._open()
+                except BaseException:
+                    self._total -= 1
+                    self._wake_one()
+                    raise
+                return self._lend(session, started_at, waited)
+
+            waited = True
+            waiter = asyncio.get_running_loop().create_future()
+            self._waiters.append(waiter)
+            try:
+                await waiter
+            except asyncio.CancelledError:
+                if waiter in self._waiters:
+                    self._waiters.remove(waiter)
+                elif waiter.done() and not waiter.cancelled():
+                    # 起こされた直後に取り消された場合は次の待ち手に譲る
+                    self._wake_one()
+                raise
+
+    def _lend(self, session: _PooledSession, started_at: float, waited: bool) -> _PooledSession:
+        self.stats.checkouts += 1
+        if waited:
+            elapsed = time.monotonic() - started_at
+            self.stats.waits += 1
+            self.stats.wait_seconds += elapsed
+            self.stats.max_wait_seconds = max(self.stats.max_wait_seconds, elapsed)
+        return session
+
+    def checkin(self, session: _PooledSession):
+        """セッションを返す"""
+        session.last_used = time.monotonic()
+        if self._closed:
+            self._total -= 1
+            asyncio.ensure_future(self._close_client(session))
+            return
+        self._idle.append(session)
+        self._wake_one()
+
+    async def _is_healthy(self, session: _PooledSession) -> bool:
+        """しばらく使われていないセッションは ping で生存確認"""
+        is_connected = getattr(session.client, "is_connected", None)
+        if is_connected is not None and not is_connected():
+            self.stats.health_failures += 1
+            return False
+        if time.monotonic() - session.last_used < self.health_check_interval:
+            return True
+        self.stats.health_checks += 1
+        try:
+            await asyncio.wait_for(session.client.ping(), timeout=self.health_check_timeout)
+            return True
+        except Exception:
+            self.stats.health_failures += 1
+            return False
+
+    async def _discard(self, session: _PooledSession):
+        """壊れた可能性のあるセッションを閉じて枠を空ける"""
+        self._forget(session)
+        await self._close_client(session)
+
+    def _forget(self, session: _PooledSession):
+        """セッションをプールの管理から外し、待っている呼び出しに枠を譲る"""
+        self._total -= 1
+        self.stats.discarded += 1
+        self._wake_one()
+
+    async def _close_client(self, session: _PooledSession):
+        try:
+            await asyncio.wait_for(session.client.__aexit__(None, None, None), timeout=self.health_check_timeout)
+        except Exception:
+            pass
+
+    def _wake_one(self):
+        """待っている呼び出しを1つ起こす"""
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+
+    @asynccontextmanager
+    async def session(self) -> AsyncIterator[Any]:
+        """async with でセッションを借りて返す
+
+        接続断・タイムアウト・取り消しで終わったセッションは状態が不明なので返さずに破棄する。
+        ツールのエラー応答など、サーバーが応答できている失敗では通常どおり返却する。
+        """
+        session = await self.checkout()
+        try:
+            yield session.client
+        except asyncio.CancelledError:
+            await asyncio.shield(self._discard(session))
+            raise
+        except Exception as e:
+            if is_retryable_error(e):
+                await self._discard(session)
+            else:
+                self.checkin(session)
+            raise
+        else:
+            self.checkin(session)
+
+    async def close(self):
+        """すべての待機中セッションを閉じる（貸し出し中のものは返却時に閉じる）"""
+        self._closed = True
+        idle = list(self._idle)
+        self._idle.clear()
+        self._total -= len(idle)
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+        await asyncio.gather(*(self._close_client(session) for session in idle))
+
+    def get_summary(self) -> Dict[str, Any]:
+        stats = self.stats
+        return {
+            "size": self.size,
+            "open": self._total,
+            "in_use": self.in_use,
+            "checkouts": stats.checkouts,
+            "waits": stats.waits,
+            "average_wait_seconds": stats.wait_seconds / stats.waits if stats.waits else 0.0,
+            "max_wait_seconds": stats.max_wait_seconds,
+            "created": stats.created,
+            "discarded": stats.discarded,
+            "health_checks": stats.health_checks,
+            "health_failures": stats.health_failures
+        }
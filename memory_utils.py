@@ -0,0 +1,137 @@
+#
+# 会話メモリ（トークン上限付きの履歴 + 古い会話のローリング要約）
+#
+
+# memory_utils.py
+import sys
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional
+
+from cost_utils import estimate_tokens
+
+@dataclass
+class ConversationTurn:
+    """1往復分の会話"""
+    __slots__ = ("user", "assistant", "tokens")
+    user: str
+    assistant: str
+    tokens: int
+
+class ConversationMemory:
+    """トークン上限付きの会話履歴
+
+    履歴が max_history_tokens を超えたら、古い往復を取り出して要約に畳み込む。
+    要約の生成（LLM呼び出し）は呼び出し側が行い、apply_summary() で反映する。
+    """
+    # セッションごとに1つ持つため、属性辞書を持たせずに小さくする
+    # （履歴は上限で数往復に収まるので、deque より小さい list で持つ）
+    __slots__ = ("max_history_tokens", "summary_max_tokens", "keep_recent_turns", "summary", "turns",
+                 "compactions", "turn_input_tokens", "stats_window")
+
+    def __init__(self, max_history_tokens: int = 1000, summary_max_tokens: int = 200,
+                 keep_recent_turns: int = 2, stats_window: int = 100):
+        self.max_history_tokens = max_history_tokens
+        self.summary_max_tokens = summary_max_tokens
+        self.keep_recent_turns = keep_recent_turns
+        self.summary = ""
+        self.turns: List[ConversationTurn] = []
+        self.compactions = 0
+        # ターンごとの入力トークン数（直近 stats_window 件）
+        self.turn_input_tokens: List[int] = []
+        self.stats_window = stats_window
+
+    @classmethod
+    def from_config(cls, memory_config: Dict[str, Any], stats_window: int = 100) -> Optional["ConversationMemory"]:
+        """mcp.json の agent.memory 設定から生成（無効ならNone）"""
+        if not memory_config.get("enabled", False):
+            return None
+        return cls(
+            max_history_tokens=memory_config.get("maxHistoryTokens", 1000),
+            summary_max_tokens=memory_config.get("summaryMaxTokens", 200),
+            keep_recent_turns=memory_config.get("keepRecentTurns", 2),
+            stats_window=stats_window
+        )
+
+    @property
+    def history_tokens(self) -> int:
+        """履歴（要約を除く）の見積もりトークン数"""
+        return sum(turn.tokens for turn in self.turns)
+
+    def build_messages(self, assistant_prefix: str = "") -> List[Dict[str, str]]:
+        """LLMに渡す履歴メッセージを生成（要約 → 直近の往復の順）"""
+        messages = []
+        if self.summary:
+            messages.append({"role": "system", "content": f"これまでの会話の要約: {self.summary}"})
+        for turn in self.turns:
+            messages.append({"role": "user", "content": turn.user})
+            messages.append({"role": "assistant", "content": f"{assistant_prefix}{turn.assistant}"})
+        return messages
+
+    def add_turn(self, user: str, assistant: str):
+        """往復を追加"""
+        tokens = estimate_tokens(user) + estimate_tokens(assistant) + 8
+        self.turns.append(ConversationTurn(user=user, assistant=assistant, tokens=tokens))
+
+    def record_turn_tokens(self, input_tokens: int):
+        """1ターンで消費した入力トークン数を記録"""
+        self.turn_input_tokens.append(input_tokens)
+        if len(self.turn_input_tokens) > self.stats_window:
+            del self.turn_input_tokens[0]
+
+    def needs_compaction(self) -> bool:
+        """履歴が上限を超えているか"""
+        return self.history_tokens > self.max_history_tokens and len(self.turns) > self.keep_recent_turns
+
+    def pop_turns_for_compaction(self) -> List[ConversationTurn]:
+        """上限に収まるまで古い往復を取り出す（直近 keep_recent_turns 件は残す）"""
+        popped = []
+        while self.history_tokens > self.max_history_tokens and len(self.turns) > self.keep_recent_turns:
+            popped.append(self.turns.pop(0))
+        return popped
+
+    def apply_summary(self, summary: str):
+        """新しい要約を反映（上限を超える分は切り詰める）"""
+        self.summary = truncate_to_tokens(summary.strip(), self.summary_max_tokens)
+        self.compactions += 1
+
+    def local_summary(self, turns: List[ConversationTurn]) -> str:
+        """LLMを使えない時の簡易要約（既存の要約と古い往復を連結して切り詰める）"""
+        lines = [self.summary] if self.summary else []
+        for turn in turns:
+            lines.append(f"ユーザー: {turn.user} / 回答: {turn.assistant}")
+        # 新しい内容を優先して残すため、末尾側から切り詰める
+        return truncate_to_tokens(" ".join(lines), self.summary_max_tokens, keep_tail=True)
+
+    def estimated_bytes(self) -> int:
+        """保持している履歴と要約のおおよそのメモリ使用量（バイト）"""
+        size = sys.getsizeof(self.summary)
+        for turn in self.turns:
+            size += sys.getsizeof(turn) + sys.getsizeof(turn.user) + sys.getsizeof(turn.assistant)
+        return size + 8 * len(self.turn_input_tokens)
+
+    def get_summary(self) -> Dict[str, Any]:
+        """メモリの状態とターンごとの入力トークン数を返す"""
+        tokens = list(self.turn_input_tokens)
+        return {
+            "turns": len(self.turns),
+            "history_tokens": self.history_tokens,
+            "summary_tokens": estimate_tokens(self.summary) if self.summary else 0,
+            "compactions": self.compactions,
+            "turn_input_tokens": tokens,
+            "average_turn_input_tokens": sum(tokens) / len(tokens) if tokens else 0.0,
+            "max_turn_input_tokens": max(tokens) if tokens else 0
+        }
+
+def truncate_to_tokens(text: str, max_tokens: int, keep_tail: bool = False) -> str:
+    """見積もりトークン数が上限に収まるよう文字単位で切り詰める"""
+    if estimate_tokens(text) <= max_tokens:
+        return text
+    low, high = 0, len(text)
+    while low < high:
+        middle = (low + high + 1) // 2
+        candidate = text[-middle:] if keep_tail else text[:middle]
+        if estimate_tokens(candidate) <= max_tokens:
+            low = middle
+        else:
+            high = middle - 1
+    return text[-low:] if keep_tail and low else text[:low]
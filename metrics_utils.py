@@ -0,0 +1,274 @@
+#
+# メトリクスレジストリ（Counter / Gauge / Histogram と Prometheus テキスト形式での出力）
+#
+
+# metrics_utils.py
+import asyncio
+import math
+from collections import deque
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+# Prometheus テキスト形式の Content-Type
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+DEFAULT_QUANTILES = (0.5, 0.95, 0.99)
+
+LabelValues = Tuple[str, ...]
+
+def _escape(value: str) -> str:
+    """ラベル値のエスケープ"""
+    return value.replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+def _format_labels(names: Iterable[str], values: Iterable[str], extra: Optional[Dict[str, str]] = None) -> str:
+    """{name="value",...} 形式の文字列を生成（ラベルがなければ空文字）"""
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs += [f'{name}="{_escape(value)}"' for name, value in extra.items()]
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+def _format_value(value: float) -> str:
+    """数値を Prometheus 形式で出力"""
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+class _Metric:
+    """ラベル付きメトリクスの共通部分"""
+    metric_type = ""
+
+    def __init__(self, name: str, help_text: str, label_names: Iterable[str] = ()):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = tuple(label_names)
+
+    def _key(self, labels: Dict[str, Any]) -> LabelValues:
+        """ラベルを定義順の値タプルに変換"""
+        if set(labels) != set(self.label_names):
+            raise ValueError(f"{self.name} のラベルが不正です: {sorted(labels)} (期待値: {list(self.label_names)})")
+        return tuple(str(labels[name]) for name in self.label_names)
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {self.metric_type}"]
+        lines += self._render_samples()
+        return lines
+
+    def _render_samples(self) -> List[str]:
+        raise NotImplementedError
+
+class Counter(_Metric):
+    """単調増加するカウンター"""
+    metric_type = "counter"
+
+    def __init__(self, name: str, help_text: str, label_names: Iterable[str] = ()):
+        super().__init__(name, help_text, label_names)
+        self._values: Dict[LabelValues, float] = {}
+
+    def inc(self, amount: float = 1.0, **labels: Any):
+        """カウンターを増やす"""
+        if amount < 0:
+            raise ValueError("Counter は減らせません")
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0.0) + amount
+
+    def get(self, **labels: Any) -> float:
+        return self._values.get(self._key(labels), 0.0)
+
+    def _render_samples(self) -> List[str]:
+        return [
+            f"{self.name}{_format_labels(self.label_names, key)} {_format_value(value)}"
+            for key, value in self._values.items()
+        ]
+
+class Gauge(_Metric):
+    """増減する現在値"""
+    metric_type = "gauge"
+
+    def __init__(self, name: str, help_text: str, label_names: Iterable[str] = ()):
+        super().__init__(name, help_text, label_names)
+        self._values: Dict[LabelValues, float] = {}
+
+    def set(self, value: float, **labels: Any):
+        self._values[self._key(labels)] = value
+
+    def inc(self, amount: float = 1.0, **labels: Any):
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0.0) + amount
+
+    def dec(self, amount: float = 1.0, **labels: Any):
+        self.inc(-amount, **labels)
+
+    def get(self, **labels: Any) -> float:
+        return self._values.get(self._key(labels), 0.0)
+
+    def _render_samples(self) -> List[str]:
+        return [
+            f"{self.name}{_format_labels(self.label_names, key)} {_format_value(value)}"
+            for key, value in self._values.items()
+        ]
+
+class _HistogramSeries:
+    """ラベル1組分のヒストグラム"""
+    __slots__ = ("bucket_counts", "count", "total", "recent")
+
+    def __init__(self, bucket_count: int, window: int):
+        self.bucket_counts = [0] * bucket_count
+        self.count = 0
+        self.total = 0.0
+        self.recent: deque = deque(maxlen=window)
+
+class Histogram(_Metric):
+    """バケット集計のヒストグラム
+
+    累積バケットに加えて直近 window 件の観測値を保持し、p50/p95/p99 などの
+    分位点を計算する（出力時は <name>_recent という summary として出す）。
+    """
+    metric_type = "histogram"
+
+    def __init__(self, name: str, help_text: str, label_names: Iterable[str] = (),
+                 buckets: Iterable[float] = DEFAULT_BUCKETS, window: int = 1024,
+                 quantiles: Iterable[float] = DEFAULT_QUANTILES):
+        super().__init__(name, help_text, label_names)
+        self.buckets = tuple(sorted(buckets))
+        self.window = window
+        self.quantiles = tuple(quantiles)
+        self._series: Dict[LabelValues, _HistogramSeries] = {}
+
+    def observe(self, value: float, **labels: Any):
+        """観測値を記録"""
+        key = self._key(labels)
+        series = self._series.get(key)
+        if series is None:
+            series = self._series[key] = _HistogramSeries(len(self.buckets), self.window)
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                series.bucket_counts[index] += 1
+                break
+        series.count += 1
+        series.total += value
+        series.recent.append(value)
+
+    def quantile(self, q: float, **labels: Any) -> Optional[float]:
+        """直近の観測値から分位点を計算（観測がなければNone）"""
+        series = self._series.get(self._key(labels))
+        if series is None or not series.recent:
+            return None
+        return _nearest_rank(sorted(series.recent), q)
+
+    def get_summary(self, **labels: Any) -> Dict[str, Any]:
+        """件数・平均・分位点を返す"""
+        series = self._series.get(self._key(labels))
+        if series is None or not series.count:
+            return {"count": 0, "average": 0.0}
+        values = sorted(series.recent)
+        summary = {"count": series.count, "average": series.total / series.count}
+        for q in self.quantiles:
+            summary[f"p{int(q * 100)}"] = _nearest_rank(values, q)
+        return summary
+
+    def render(self) -> List[str]:
+        lines = super().render()
+        if not self._series:
+            return lines
+        recent_name = f"{self.name}_recent"
+        lines += [
+            f"# HELP {recent_name} {self.help_text}（直近{self.window}件の分位点）",
+            f"# TYPE {recent_name} summary"
+        ]
+        for key, series in self._series.items():
+            values = sorted(series.recent)
+            for q in self.quantiles:
+                labels = _format_labels(self.label_names, key, {"quantile": _format_value(q)})
+                lines.append(f"{recent_name}{labels} {_format_value(_nearest_rank(values, q))}")
+            labels = _format_labels(self.label_names, key)
+            lines.append(f"{recent_name}_sum{labels} {_format_value(sum(values))}")
+            lines.append(f"{recent_name}_count{labels} {len(values)}")
+        return lines
+
+    def _render_samples(self) -> List[str]:
+        lines = []
+        for key, series in self._series.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets, series.bucket_counts):
+                cumulative += count
+                labels = _format_labels(self.label_names, key, {"le": _format_value(bound)})
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.label_names, key, {"le": "+Inf"})
+            lines.append(f"{self.name}_bucket{labels} {series.count}")
+            labels = _format_labels(self.label_names, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(series.total)}")
+            lines.append(f"{self.name}_count{labels} {series.count}")
+        return lines
+
+def _nearest_rank(sorted_values: List[float], q: float) -> float:
+    """ソート済みの値から nearest-rank 法で分位点を求める"""
+    rank = max(1, math.ceil(q * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+class MetricsRegistry:
+    """メトリクスの登録と Prometheus テキスト形式での出力"""
+
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+
+    def _register(self, metric_class, name: str, *args, **kwargs):
+        """同名のメトリクスがあればそれを返す（種類が違えばエラー）"""
+        metric = self._metrics.get(name)
+        if metric is None:
+            metric = self._metrics[name] = metric_class(name, *args, **kwargs)
+        elif not isinstance(metric, metric_class):
+            raise ValueError(f"メトリクス '{name}' は別の種類で登録済みです")
+        return metric
+
+    def counter(self, name: str, help_text: str, label_names: Iterable[str] = ()) -> Counter:
+        return self._register(Counter, name, help_text, label_names)
+
+    def gauge(self, name: str, help_text: str, label_names: Iterable[str] = ()) -> Gauge:
+        return self._register(Gauge, name, help_text, label_names)
+
+    def histogram(self, name: str, help_text: str, label_names: Iterable[str] = (),
+                  buckets: Iterable[float] = DEFAULT_BUCKETS, window: int = 1024) -> Histogram:
+        return self._register(Histogram, name, help_text, label_names, buckets=buckets, window=window)
+
+    def get(self, name: str) -> Optional[_Metric]:
+        return self._metrics.get(name)
+
+    def render(self) -> str:
+        """全メトリクスを Prometheus テキスト形式で出力"""
+        lines: List[str] = []
+        for metric in self._metrics.values():
+            lines += metric.render()
+        return "\n".join(lines) + "\n"
+
+async def start_metrics_server(registry: MetricsRegistry, host: str = "127.0.0.1", port: int = 9101) -> asyncio.AbstractServer:
+    """GET /metrics だけに応答する最小限のHTTPサーバーを起動"""
+
+    async def handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            request_line = await asyncio.wait_for(reader.readline(), timeout=5)
+            # ヘッダーは読み捨てる
+            while True:
+                line = await asyncio.wait_for(reader.readline(), timeout=5)
+                if not line or line in (b"\r\n", b"\n"):
+                    break
+
+            parts = request_line.decode("latin-1").split()
+            path = parts[1].split("?", 1)[0] if len(parts) >= 2 else ""
+            if len(parts) >= 2 and parts[0] == "GET" and path == "/metrics":
+                status, content_type, body = "200 OK", CONTENT_TYPE, registry.render().encode("utf-8")
+            else:
+                status, content_type, body = "404 Not Found", "text/plain; charset=utf-8", b"not found\n"
+
+            writer.write(
+                f"HTTP/1.1 {status}\r\nContent-Type: {content_type}\r\n"
+                f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode("latin-1") + body
+            )
+            await writer.drain()
+        except (asyncio.TimeoutError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    return await asyncio.start_server(handle, host, port)
@@ -0,0 +1,143 @@
+#
+# LLMのレート制限（RPM / TPM のトークンバケット。プロセス内の全エージェントで共有）
+#
+
+# rate_limit_utils.py
+import asyncio
+import time
+from typing import Any, Dict, Optional
+
+class TokenBucket:
+    """一定速度で補充されるトークンバケット（消費は負債として負の値も許す）"""
+
+    def __init__(self, capacity: float, refill_per_second: float):
+        self.capacity = capacity
+        self.refill_per_second = refill_per_second
+        self.tokens = capacity
+        self._updated_at = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self._updated_at) * self.refill_per_second)
+        self._updated_at = now
+
+    def time_until(self, amount: float) -> float:
+        """amount 分が使えるようになるまでの秒数（上限を超える量は上限まで待つ）"""
+        self._refill()
+        amount = min(amount, self.capacity)
+        if self.tokens >= amount:
+            return 0.0
+        return (amount - self.tokens) / self.refill_per_second
+
+    def consume(self, amount: float):
+        """消費（負の値なら返却）"""
+        self._refill()
+        self.tokens = min(self.capacity, self.tokens - amount)
+
+class RateLimiter:
+    """1分あたりのリクエスト数（RPM）とトークン数（TPM）の両方を守るリミッター
+
+    上限に達したら例外にせず、空くまで待ってから順番に通す（先着順）。
+    トークン数は呼び出し前に見積もりで確保し、応答の usage で実際の値に合わせる。
+    """
+
+    def __init__(self, name: str, requests_per_minute: int = 0, tokens_per_minute: int = 0):
+        self.name = name
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self._requests: Optional[TokenBucket] = None
+        self._tokens: Optional[TokenBucket] = None
+        self.set_limits(requests_per_minute, tokens_per_minute)
+        self._lock: Optional[asyncio.Lock] = None
+        self.acquired = 0
+        self.waited = 0
+        self.wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+
+    def set_limits(self, requests_per_minute: int, tokens_per_minute: int):
+        """上限を変更（設定の再読み込み時）。使用済みの分は新しい上限に引き継ぐ"""
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self._requests = self._resize(self._requests, requests_per_minute)
+        self._tokens = self._resize(self._tokens, tokens_per_minute)
+
+    @staticmethod
+    def _resize(bucket: Optional[TokenBucket], per_minute: int) -> Optional[TokenBucket]:
+        if not per_minute:
+            return None
+        resized = TokenBucket(per_minute, per_minute / 60)
+        if bucket is not None:
+            bucket._refill()
+            resized.tokens = min(resized.capacity, bucket.tokens)
+        return resized
+
+    async def acquire(self, estimated_tokens: int) -> float:
+        """リクエスト1回分と見積もりトークンを確保し、待った秒数を返す"""
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+
+        started_at = time.monotonic()
+        # ロックで順番待ちにし、後から来た呼び出しが割り込まないようにする
+        async with self._lock:
+            while True:
+                wait = 0.0
+                if self._requests is not None:
+                    wait = max(wait, self._requests.time_until(1))
+                if self._tokens is not None:
+                    wait = max(wait, self._tokens.time_until(estimated_tokens))
+                if wait <= 0:
+                    break
+                await asyncio.sleep(wait)
+
+            if self._requests is not None:
+                self._requests.consume(1)
+            if self._tokens is not None:
+                self._tokens.consume(estimated_tokens)
+
+        waited = time.monotonic() - started_at
+        self.acquired += 1
+        if waited > 0.001:
+            self.waited += 1
+            self.wait_seconds += waited
+            self.max_wait_seconds = max(self.max_wait_seconds, waited)
+        return waited
+
+    def reconcile(self, estimated_tokens: int, actual_tokens: int):
+        """見積もりと実際のトークン数の差を精算（失敗時は actual_tokens=0 で返却）"""
+        if self._tokens is not None:
+            self._tokens.consume(actual_tokens - estimated_tokens)
+
+    def charge(self, tokens: int, requests: int = 1):
+        """確保を経ずに送ったリクエスト（ヘッジの重複など）の分を差し引く"""
+        if self._requests is not None:
+            self._requests.consume(requests)
+        if self._tokens is not None:
+            self._tokens.consume(tokens)
+
+    def get_summary(self) -> Dict[str, Any]:
+        return {
+            "requests_per_minute": self.requests_per_minute,
+            "tokens_per_minute": self.tokens_per_minute,
+            "acquired": self.acquired,
+            "waited": self.waited,
+            "wait_seconds": self.wait_seconds,
+            "max_wait_seconds": self.max_wait_seconds
+        }
+
+# プロセス内で共有するリミッター（モデル名 → リミッター）
+_shared_limiters: Dict[str, RateLimiter] = {}
+
+def get_rate_limiter(name: str, requests_per_minute: int = 0, tokens_per_minute: int = 0) -> Optional[RateLimiter]:
+    """共有リミッターを取得（上限が未設定ならNone）
+
+    同じ名前で先に作られたリミッターがあればそれを返すため、同じプロセスの
+    すべてのエージェント・セッションが1つの上限を分け合う。上限が変わっていれば新しい値に合わせる。
+    """
+    if not requests_per_minute and not tokens_per_minute:
+        return None
+    limiter = _shared_limiters.get(name)
+    if limiter is None:
+        limiter = _shared_limiters[name] = RateLimiter(name, requests_per_minute, tokens_per_minute)
+    elif (limiter.requests_per_minute, limiter.tokens_per_minute) != (requests_per_minute, tokens_per_minute):
+        limiter.set_limits(requests_per_minute, tokens_per_minute)
+    return limiter
@@ -0,0 +1,292 @@
+#
+# 呼び出しの耐障害性ユーティリティ（期限・リトライ・サーキットブレーカー・ヘッジリクエスト）
+#
+
+# resilience_utils.py
+import asyncio
+import math
+import random
+import time
+from collections import deque
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+# 一時的な障害とみなす例外のクラス名（openai / httpx を import せずに判定する）
+RETRYABLE_ERROR_NAMES = {
+    "APIConnectionError", "APITimeoutError", "RateLimitError", "InternalServerError",
+    "ConnectError", "ReadTimeout", "WriteTimeout", "PoolTimeout", "RemoteProtocolError",
+}
+
+class CircuitOpenError(RuntimeError):
+    """サーキットブレーカーが開いているため呼び出しを行わなかった"""
+
+def is_retryable_error(error: BaseException) -> bool:
+    """タイムアウトや接続断など、再試行で回復し得る障害か"""
+    if isinstance(error, CircuitOpenError):
+        return False
+    if isinstance(error, (asyncio.TimeoutError, TimeoutError, ConnectionError)):
+        return True
+    return any(cls.__name__ in RETRYABLE_ERROR_NAMES for cls in type(error).__mro__)
+
+class CircuitBreaker:
+    """連続失敗で呼び出しを遮断するサーキットブレーカー
+
+    closed: 通常 → failure_threshold 回連続で失敗すると open
+    open: 即座に CircuitOpenError → reset_timeout 秒後に half_open
+    half_open: 試しに1回だけ通し、成功なら closed、失敗なら再び open
+    """
+
+    def __init__(self, name: str, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.consecutive_failures = 0
+        self.opened_count = 0
+        self.rejected_count = 0
+        self._opened_at: Optional[float] = None
+        self._trial_in_flight = False
+
+    @property
+    def state(self) -> str:
+        if self._opened_at is None:
+            return "closed"
+        if time.monotonic() - self._opened_at >= self.reset_timeout:
+            return "half_open"
+        return "open"
+
+    def before_call(self):
+        """呼び出し前の確認（遮断中なら CircuitOpenError）"""
+        state = self.state
+        if state == "closed":
+            return
+        if state == "half_open" and not self._trial_in_flight:
+            self._trial_in_flight = True
+            return
+        self.rejected_count += 1
+        raise CircuitOpenError(f"{self.name} のサーキットブレーカーが開いています")
+
+    def record_success(self):
+        self.consecutive_failures = 0
+        self._opened_at = None
+        self._trial_in_flight = False
+
+    def record_failure(self):
+        self.consecutive_failures += 1
+        if self._trial_in_flight or self.consecutive_failures >= self.failure_threshold:
+            if self._opened_at is None or self._trial_in_flight:
+                self.opened_count += 1
+            self._opened_at = time.monotonic()
+        self._trial_in_flight = False
+
+    def abandon(self):
+        """試行が取り消された・結果が健全性の判断に使えない場合、状態はそのままで half_open の試行枠を戻す"""
+        self._trial_in_flight = False
+
+    def get_summary(self) -> Dict[str, Any]:
+        return {
+            "state": self.state,
+            "consecutive_failures": self.consecutive_failures,
+            "opened": self.opened_count,
+            "rejected": self.rejected_count
+        }
+
+@dataclass
+class RetryPolicy:
+    """1回ごとの期限と、ジッター付き指数バックオフによるリトライ"""
+    timeout: Optional[float] = 30.0  # 1回の試行の期限（秒）。Noneなら無制限
+    max_retries: int = 3
+    base_delay: float = 0.2
+    max_delay: float = 5.0
+
+    def backoff(self, attempt: int) -> float:
+        """attempt 回目（0始まり）の失敗後に待つ秒数（full jitter）"""
+        return random.uniform(0, min(self.max_delay, self.base_delay * (2 ** attempt)))
+
+@dataclass
+class RetryStats:
+    """リトライとタイムアウトの集計"""
+    calls: int = 0
+    retries: int = 0
+    timeouts: int = 0
+    failures: int = 0
+
+async def call_with_resilience(make_call: Callable[[], Awaitable[Any]], policy: RetryPolicy,
+                               breaker: Optional[CircuitBreaker] = None,
+                               stats: Optional[RetryStats] = None,
+                               on_retry: Optional[Callable[[int, BaseException, float], None]] = None,
+                               before_attempt: Optional[Callable[[], Awaitable[None]]] = None) -> Any:
+    """期限・リトライ・サーキットブレーカーを適用して make_call() を実行
+
+    一時的な障害（タイムアウト・接続断・レート制限など）のみ再試行し、ブレーカーの失敗にも数える。
+    それ以外の例外（ツールのエラー応答など）は相手が応答できているので、そのまま送出する。
+    before_attempt は再試行を含む各試行の直前に、期限の外で実行する（レート制限の枠の確保など）。
+    """
+    if stats is not None:
+        stats.calls += 1
+    attempt = 0
+    while True:
+        if breaker is not None:
+            breaker.before_call()
+        if before_attempt is not None:
+            try:
+                await before_attempt()
+            except BaseException:
+                if breaker is not None:
+                    breaker.abandon()
+                raise
+        try:
+            if policy.timeout:
+                result = await asyncio.wait_for(make_call(), timeout=policy.timeout)
+            else:
+                result = await make_call()
+        except asyncio.CancelledError:
+            if breaker is not None:
+                breaker.abandon()
+            raise
+        except Exception as e:
+            retryable = is_retryable_error(e)
+            if stats is not None and isinstance(e, asyncio.TimeoutError):
+                stats.timeouts += 1
+            if breaker is not None:
+                if retryable:
+                    breaker.record_failure()
+                else:
+                    # 不正なリクエストなど相手の健全性と無関係なエラーは成功にも失敗にも数えない
+                    # （half_open の試行枠だけ戻し、次の呼び出しで改めて試す）
+                    breaker.abandon()
+            if not retryable or attempt >= policy.max_retries:
+                if stats is not None:
+                    stats.failures += 1
+                raise
+            delay = policy.backoff(attempt)
+            if stats is not None:
+                stats.retries += 1
+            if on_retry is not None:
+                on_retry(attempt + 1, e, delay)
+            attempt += 1
+            await asyncio.sleep(delay)
+            continue
+
+        if breaker is not None:
+            breaker.record_success()
+        return result
+
+class LatencyWindow:
+    """直近のレイテンシを保持し、分位点を求める"""
+
+    def __init__(self, size: int = 200):
+        self._samples: deque = deque(maxlen=size)
+
+    def observe(self, seconds: float):
+        self._samples.append(seconds)
+
+    def percentile(self, q: float) -> Optional[float]:
+        """nearest-rank 法で分位点を返す（観測がなければNone）"""
+        if not self._samples:
+            return None
+        values = sorted(self._samples)
+        return values[max(1, math.ceil(q * len(values))) - 1]
+
+    def __len__(self) -> int:
+        return len(self._samples)
+
+@dataclass
+class HedgeOutcome:
+    """ヘッジ付き呼び出しの結果"""
+    result: Any
+    hedged: bool = False  # 2本目のリクエストを送ったか
+    hedge_won: bool = False  # 2本目が先に完了したか
+    loser: Optional[asyncio.Future] = None  # 採用されなかった方（取り消し済み、または完了済み）
+
+def _consume_result(future: asyncio.Future):
+    """採用されなかった呼び出しの例外を回収（未回収の警告を出さない）"""
+    if not future.cancelled():
+        future.exception()
+
+class HedgingPolicy:
+    """遅い呼び出しに重複リクエストを送り、先に返った方を採用する
+
+    キー（モデル名など）ごとに直近のレイテンシを保持し、呼び出しが percentile 分位点の
+    時間を過ぎても返らなければ2本目を送る。観測数が min_samples に満たないうちはヘッジしない。
+    """
+
+    def __init__(self, enabled: bool = False, percentile: float = 0.95, min_samples: int = 20,
+                 min_delay_seconds: float = 0.5, window_size: int = 200):
+        self.enabled = enabled
+        self.percentile = percentile
+        self.min_samples = min_samples
+        self.min_delay_seconds = min_delay_seconds
+        self.window_size = window_size
+        self._windows: Dict[str, LatencyWindow] = {}
+
+    @classmethod
+    def from_config(cls, hedging_config: Dict[str, Any]) -> "HedgingPolicy":
+        """mcp.json の llm.hedging 設定から生成"""
+        return cls(
+            enabled=hedging_config.get("enabled", False),
+            percentile=hedging_config.get("percentile", 0.95),
+            min_samples=hedging_config.get("minSamples", 20),
+            min_delay_seconds=hedging_config.get("minDelaySeconds", 0.5),
+            window_size=hedging_config.get("windowSize", 200)
+        )
+
+    def adopt_samples(self, previous: "HedgingPolicy"):
+        """設定の再読み込み時に、以前のポリシーが集めたレイテンシの観測を引き継ぐ"""
+        self._windows = previous._windows
+
+    def observe(self, key: str, seconds: float):
+        """成功した呼び出しのレイテンシを記録"""
+        window = self._windows.get(key)
+        if window is None:
+            window = self._windows[key] = LatencyWindow(self.window_size)
+        window.observe(seconds)
+
+    def delay_for(self, key: str) -> Optional[float]:
+        """2本目を送るまでの待ち時間（ヘッジしない場合はNone）"""
+        if not self.enabled:
+            return None
+        window = self._windows.get(key)
+        if window is None or len(window) < self.min_samples:
+            return None
+        return max(self.min_delay_seconds, window.percentile(self.percentile))
+
+    async def run(self, key: str, make_call: Callable[[], Awaitable[Any]]) -> HedgeOutcome:
+        """make_call() を実行し、遅ければ重複リクエストを送って先に成功した方を返す"""
+        delay = self.delay_for(key)
+        primary = asyncio.ensure_future(self._timed(key, make_call))
+        if delay is None:
+            return HedgeOutcome(result=await primary)
+
+        hedge: Optional[asyncio.Future] = None
+        try:
+            done, _ = await asyncio.wait({primary}, timeout=delay)
+            if done:
+                return HedgeOutcome(result=primary.result())
+
+            hedge = asyncio.ensure_future(self._timed(key, make_call))
+            pending = {primary, hedge}
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for winner, loser in ((primary, hedge), (hedge, primary)):
+                    if winner in done and not winner.cancelled() and winner.exception() is None:
+                        if not loser.done():
+                            loser.cancel()
+                        loser.add_done_callback(_consume_result)
+                        return HedgeOutcome(result=winner.result(), hedged=True,
+                                            hedge_won=winner is hedge, loser=loser)
+
+            # 両方とも失敗した場合は1本目の例外を返す
+            hedge.add_done_callback(_consume_result)
+            return HedgeOutcome(result=primary.result())
+        except asyncio.CancelledError:
+            primary.cancel()
+            if hedge is not None:
+                hedge.cancel()
+            raise
+
+    async def _timed(self, key: str, make_call: Callable[[], Awaitable[Any]]) -> Any:
+        """呼び出しを実行し、成功時のレイテンシを記録"""
+        started_at = time.perf_counter()
+        result = await make_call()
+        self.observe(key, time.perf_counter() - started_at)
+        return result
@@ -0,0 +1,284 @@
+#
+# キーワード事前ルーター（明らかなクエリをLLMを呼ばずにツールへ振り分ける）
+#
+
+# router_utils.py
+import re
+import unicodedata
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+# 都市名抽出で使う既定の都市一覧（04_mcpClient.py の extract_city_name と同じ考え方）
+DEFAULT_CITIES = ["東京", "大阪", "名古屋", "福岡", "札幌", "横浜", "神戸", "京都", "仙台", "広島"]
+
+# 数字の直後のハイフンは「3-5」のような区切りや引き算なので、負号として読まない
+NUMBER_PATTERN = re.compile(r"(?<![\d.])-?\d+(?:\.\d+)?|\d+(?:\.\d+)?")
+
+# 算術演算子（2つの数値の間のハイフンも引き算または範囲とみなす）
+OPERATOR_PATTERN = re.compile(r"[+*/^=%]|\d\s*-\s*\d")
+
+# 数値ツールの判定を曖昧にする演算の言葉（ツール自身のキーワードに含まれる分は除いて判定する）
+OPERATION_WORDS = ["足", "加え", "引", "割", "乗", "平方", "ルート", "余り", "差", "和", "積", "商",
+                   "plus", "minus", "add", "subtract", "times", "power", "sqrt"]
+
+ASCII_WORD_CHAR = re.compile(r"[a-z0-9_]")
+
+def normalize_text(text: str) -> str:
+    """全角英数字を半角に揃え、小文字化する"""
+    return unicodedata.normalize("NFKC", text).lower()
+
+def extract_numbers(text: str) -> List[float]:
+    """テキストから数値を抽出（整数はintで返す）"""
+    numbers = []
+    for token in NUMBER_PATTERN.findall(normalize_text(text)):
+        value = float(token)
+        numbers.append(int(value) if value.is_integer() and "." not in token else value)
+    return numbers
+
+def find_city_names(text: str, cities: Iterable[str]) -> List[str]:
+    """テキストに現れる都市名を重複なしで出現順に返す（「東京都」の「京都」のような重なりは長い方・左側を優先）"""
+    names = sorted({city for city in cities if city}, key=len, reverse=True)
+    if not names:
+        return []
+    found: List[str] = []
+    for match in re.finditer("|".join(map(re.escape, names)), text):
+        if match.group() not in found:
+            found.append(match.group())
+    return found
+
+def is_ascii_keyword(keyword: str) -> bool:
+    return keyword.isascii() and ASCII_WORD_CHAR.search(keyword) is not None
+
+def on_word_boundary(text: str, start: int, end: int) -> bool:
+    """text[start:end] の前後が英数字でないか（「npm」や「3pm」の中の「pm」を弾く）"""
+    before = text[start - 1] if start > 0 else ""
+    after = text[end] if end < len(text) else ""
+    return not ASCII_WORD_CHAR.match(before) and not ASCII_WORD_CHAR.match(after)
+
+class AhoCorasick:
+    """複数キーワードを1パスで検索するAho-Corasickオートマトン"""
+
+    def __init__(self):
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._output: List[List[Tuple[str, Any]]] = [[]]
+        self._built = False
+
+    def add(self, keyword: str, payload: Any):
+        """キーワードと、ヒット時に返す値を登録"""
+        if not keyword:
+            return
+        state = 0
+        for char in keyword:
+            next_state = self._goto[state].get(char)
+            if next_state is None:
+                next_state = len(self._goto)
+                self._goto[state][char] = next_state
+                self._goto.append({})
+                self._fail.append(0)
+                self._output.append([])
+            state = next_state
+        self._output[state].append((keyword, payload))
+        self._built = False
+
+    def build(self):
+        """失敗遷移を構築"""
+        queue = deque()
+        for next_state in self._goto[0].values():
+            self._fail[next_state] = 0
+            queue.append(next_state)
+
+        while queue:
+            state = queue.popleft()
+            for char, next_state in self._goto[state].items():
+                queue.append(next_state)
+                fail_state = self._fail[state]
+                while fail_state and char not in self._goto[fail_state]:
+                    fail_state = self._fail[fail_state]
+                self._fail[next_state] = self._goto[fail_state].get(char, 0)
+                self._output[next_state] = self._output[next_state] + self._output[self._fail[next_state]]
+        self._built = True
+
+    def search(self, text: str) -> List[Tuple[str, Any]]:
+        """テキスト中に現れる (キーワード, 値) をすべて返す"""
+        return [(keyword, payload) for _, keyword, payload in self.finditer(text)]
+
+    def finditer(self, text: str) -> List[Tuple[int, str, Any]]:
+        """テキスト中に現れる (開始位置, キーワード, 値) をすべて返す"""
+        if not self._built:
+            self.build()
+
+        matches = []
+        state = 0
+        for index, char in enumerate(text):
+            while state and char not in self._goto[state]:
+                state = self._fail[state]
+            state = self._goto[state].get(char, 0)
+            for keyword, payload in self._output[state]:
+                matches.append((index + 1 - len(keyword), keyword, payload))
+        return matches
+
+@dataclass
+class KeywordMatch:
+    keyword: str
+    tool_name: str
+    weak: bool  # 単独ではルーティングしない汎用的なキーワード（weakKeywords）
+
+@dataclass
+class RouteDecision:
+    """事前ルーターの判定結果"""
+    tool_name: str
+    parameters: Dict[str, Any]
+    matched_keywords: List[str]
+
+class KeywordRouter:
+    """mcp.json の tools.*.keywords と引数抽出ルールから構築する事前ルーター
+
+    1つのツールだけにキーワードが一致し、必須パラメータをすべて抽出できた場合のみ
+    ルーティングする（少しでも曖昧ならNoneを返してLLMに任せる）。
+
+    - 「pm」のような英数字のキーワードは単語の境界でのみ一致させる
+    - weakKeywords（「日本」「計算」など）は他ツールとの競合判定には使うが、それだけではルーティングしない
+    - 数値ツールは、演算子や他の演算の言葉（足す・引く・割る・乗）を含むクエリをルーティングしない
+    - 都市名を引数に取るツールは、既知の都市が2つ以上現れたらルーティングしない
+    """
+
+    def __init__(self, tool_configs: Dict[str, Dict[str, Any]], tool_specs: Dict[str, Any]):
+        self.tool_configs = tool_configs
+        self.tool_specs = tool_specs
+        self._matcher = AhoCorasick()
+        self._tool_keywords: Dict[str, List[str]] = {}
+
+        for tool_name, config in tool_configs.items():
+            if tool_name not in tool_specs:
+                continue
+            keywords = [normalize_text(keyword) for keyword in config.get("keywords", [])]
+            weak_keywords = [normalize_text(keyword) for keyword in config.get("weakKeywords", [])]
+            self._tool_keywords[tool_name] = keywords + weak_keywords
+            for keyword in keywords:
+                self._matcher.add(keyword, KeywordMatch(keyword, tool_name, weak=False))
+            for keyword in weak_keywords:
+                self._matcher.add(keyword, KeywordMatch(keyword, tool_name, weak=True))
+        self._matcher.build()
+
+    def match(self, text: str) -> List[KeywordMatch]:
+        """テキストに一致するキーワード（英数字のキーワードは単語の境界で一致したものだけ）"""
+        normalized = normalize_text(text)
+        return [
+            match for start, keyword, match in self._matcher.finditer(normalized)
+            if not is_ascii_keyword(keyword) or on_word_boundary(normalized, start, start + len(keyword))
+        ]
+
+    def route(self, text: str) -> Optional[RouteDecision]:
+        """確信できる場合のみツールと引数を返す"""
+        matches = self.match(text)
+        matched_tools: Set[str] = {match.tool_name for match in matches}
+        if len(matched_tools) != 1:
+            return None
+        if all(match.weak for match in matches):
+            return None
+
+        tool_name = matched_tools.pop()
+        parameters = self._extract_parameters(tool_name, text)
+        if parameters is None:
+            return None
+
+        keywords = sorted({match.keyword for match in matches})
+        return RouteDecision(tool_name=tool_name, parameters=parameters, matched_keywords=keywords)
+
+    def _has_other_operation(self, tool_name: str, text: str) -> bool:
+        """演算子や、このツール以外の演算を表す言葉を含むか"""
+        normalized = normalize_text(text)
+        if OPERATOR_PATTERN.search(normalized):
+            return True
+        # 「割り算」の「割」のように、ツール自身のキーワードの一部は演算の言葉として数えない
+        for keyword in sorted(self._tool_keywords.get(tool_name, []), key=len, reverse=True):
+            normalized = normalized.replace(keyword, " ")
+        return any(word in normalized for word in OPERATION_WORDS)
+
+    def _extract_parameters(self, tool_name: str, text: str) -> Optional[Dict[str, Any]]:
+        """設定された抽出ルールで必須パラメータを埋める（埋められなければNone）"""
+        config = self.tool_configs[tool_name]
+        spec = self.tool_specs[tool_name]
+        properties = spec.properties
+        required = list(spec.required)
+
+        if config.get("noParameters"):
+            return {} if not required else None
+
+        if "maxNumbers" in config:
+            numeric_params = [
+                name for name, info in properties.items()
+                if info.get("type") in ("integer", "number")
+            ]
+            if self._has_other_operation(tool_name, text):
+                return None
+            numbers = extract_numbers(text)
+            # 数値の個数がパラメータ数とちょうど一致する場合だけ確信ありとみなす
+            if len(numbers) != config["maxNumbers"] or len(numbers) != len(numeric_params):
+                return None
+            if set(required) - set(numeric_params):
+                return None
+
+            parameters = {}
+            for name, value in zip(numeric_params, numbers):
+                if properties[name].get("type") == "integer":
+                    if not float(value).is_integer():
+                        return None
+                    value = int(value)
+                parameters[name] = value
+            return parameters
+
+        if "defaultCity" in config:
+            string_params = [
+                name for name, info in properties.items()
+                if info.get("type", "string") == "string"
+            ]
+            if len(string_params) != 1 or set(required) - set(string_params):
+                return None
+
+            cities = list(config.get("cities", DEFAULT_CITIES))
+            if config["defaultCity"] not in cities:
+                cities.append(config["defaultCity"])
+            # 未知の都市を既定値で埋めると誤答になるため、既知の都市が見つからなければLLMに任せる
+            # 複数の都市を尋ねるクエリは1回のツール呼び出しでは答えられない
+            found = find_city_names(text, cities)
+            if len(found) != 1:
+                return None
+            return {string_params[0]: found[0]}
+
+        return None
+
+@dataclass
+class RouterStats:
+    """事前ルーターのヒット率と節約時間の集計"""
+    queries: int = 0
+    hits: int = 0
+    decision_calls: int = 0
+    decision_seconds: float = 0.0
+    hits_by_tool: Dict[str, int] = field(default_factory=dict)
+
+    def record(self, decision: Optional[RouteDecision]):
+        """ルーティング結果を記録"""
+        self.queries += 1
+        if decision is not None:
+            self.hits += 1
+            self.hits_by_tool[decision.tool_name] = self.hits_by_tool.get(decision.tool_name, 0) + 1
+
+    def observe_decision_latency(self, seconds: float):
+        """LLMによる判定呼び出しの所要時間を記録（節約時間の見積もりに使う）"""
+        self.decision_calls += 1
+        self.decision_seconds += seconds
+
+    def get_summary(self) -> Dict[str, Any]:
+        """集計結果のサマリーを返す"""
+        average_decision = self.decision_seconds / self.decision_calls if self.decision_calls else 0.0
+        return {
+            "queries": self.queries,
+            "hits": self.hits,
+            "hit_rate": self.hits / self.queries if self.queries else 0.0,
+            "hits_by_tool": dict(self.hits_by_tool),
+            "average_decision_seconds": average_decision,
+            "estimated_saved_seconds": self.hits * average_decision
+        }
@@ -0,0 +1,216 @@
+#
+# ユーザーごとのセッション管理（会話履歴・コスト集計をセッション単位で持ち、アイドル時間とメモリ上限で破棄）
+#   設定・ツール一覧・MCP/LLMクライアント・キャッシュはエージェント全体で共有し、
+#   セッションには利用者ごとに異なる小さな状態だけを持たせる。
+#
+
+# session_utils.py
+import asyncio
+import sys
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+from typing import Any, AsyncIterator, Callable, Dict, Optional
+
+# 履歴を除いたセッション1つあたりのおおよそのメモリ使用量（バイト）
+# AgentSession・空の ConversationMemory・コスト集計オブジェクト・テーブルのエントリを合わせた tracemalloc での実測値
+SESSION_OVERHEAD_BYTES = 640
+
+class AgentSession:
+    """1ユーザー分の状態（会話履歴とコスト集計）
+
+    数万セッションを保持できるよう __slots__ で属性辞書を持たせず、ロックは使う時にだけ作る。
+    """
+    __slots__ = ("session_id", "memory", "cost_tracker", "created_at", "last_used", "queries",
+                 "size_bytes", "_lock", "_active")
+
+    def __init__(self, session_id: str, memory: Any = None, cost_tracker: Any = None):
+        self.session_id = session_id
+        self.memory = memory  # ConversationMemory（agent.memory.enabled が false ならNone）
+        self.cost_tracker = cost_tracker  # このセッションのトークン数とコスト
+        self.created_at = time.monotonic()
+        self.last_used = self.created_at
+        self.queries = 0
+        self.size_bytes = SESSION_OVERHEAD_BYTES
+        self._lock: Optional[asyncio.Lock] = None
+        self._active = 0  # 処理中（または順番待ち中）のクエリ数。0より大きい間は破棄しない
+
+    @property
+    def active(self) -> bool:
+        return self._active > 0
+
+    def estimated_bytes(self) -> int:
+        """このセッションのおおよそのメモリ使用量（バイト）"""
+        size = SESSION_OVERHEAD_BYTES + sys.getsizeof(self.session_id)
+        if self.memory is not None:
+            size += self.memory.estimated_bytes()
+        return size
+
+@dataclass
+class SessionStats:
+    """セッションの作成・破棄の集計"""
+    created: int = 0
+    evicted_idle: int = 0  # アイドル時間の超過で破棄
+    evicted_capacity: int = 0  # セッション数の上限で破棄
+    evicted_memory: int = 0  # メモリ上限で破棄
+    closed: int = 0  # 明示的に終了
+
+class SessionManager:
+    """セッションテーブル
+
+    最後に使われた順に並べて保持し、idle_timeout 秒使われていないセッション、
+    およびセッション数・推定メモリ使用量の上限を超えた分を古い順に破棄する。
+    処理中のセッションは破棄しない。同じセッションのクエリは到着順に1つずつ処理する。
+    """
+
+    def __init__(self, memory_factory: Callable[[], Any], tracker_factory: Callable[[], Any],
+                 idle_timeout: float = 1800.0, max_sessions: int = 50000,
+                 max_memory_bytes: int = 256 * 1024 * 1024, sweep_interval: float = 30.0):
+        self.memory_factory = memory_factory
+        self.tracker_factory = tracker_factory
+        self.idle_timeout = idle_timeout
+        self.max_sessions = max_sessions
+        self.max_memory_bytes = max_memory_bytes
+        self.sweep_interval = sweep_interval
+        self.stats = SessionStats()
+        self.total_bytes = 0
+        self._sessions: "OrderedDict[str, AgentSession]" = OrderedDict()
+        self._sweeper: Optional[asyncio.Task] = None
+
+    @classmethod
+    def from_config(cls, sessions_config: Dict[str, Any], memory_factory: Callable[[], Any],
+                    tracker_factory: Callable[[], Any]) -> "SessionManager":
+        """mcp.json の agent.sessions 設定から生成"""
+        return cls(
+            memory_factory,
+            tracker_factory,
+            idle_timeout=sessions_config.get("idleTimeoutSeconds", 1800),
+            max_sessions=sessions_config.get("maxSessions", 50000),
+            max_memory_bytes=int(sessions_config.get("maxMemoryMb", 256) * 1024 * 1024),
+            sweep_interval=sessions_config.get("sweepIntervalSeconds", 30)
+        )
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+    def __contains__(self, session_id: str) -> bool:
+        return session_id in self._sessions
+
+    def find(self, session_id: str) -> Optional[AgentSession]:
+        """セッションを取得（なければNone。作成も並べ替えもしない）"""
+        return self._sessions.get(session_id)
+
+    def get(self, session_id: str) -> AgentSession:
+        """セッションを取得（なければ作成し、上限を超えた分は古いものから破棄）"""
+        session = self._sessions.get(session_id)
+        if session is not None:
+            self._sessions.move_to_end(session_id)
+            return session
+
+        session = AgentSession(session_id, self.memory_factory(), self.tracker_factory())
+        session.size_bytes = session.estimated_bytes()
+        self._sessions[session_id] = session
+        self.total_bytes += session.size_bytes
+        self.stats.created += 1
+        if len(self._sessions) > self.max_sessions:
+            self.stats.evicted_capacity += self._evict_oldest(lambda: len(self._sessions) > self.max_sessions)
+        return session
+
+    @asynccontextmanager
+    async def use(self, session_id: str) -> AsyncIterator[AgentSession]:
+        """セッションを借りてクエリを処理（同じセッションは順番に処理し、終了後にメモリ使用量を更新）"""
+        session = self.get(session_id)
+        session._active += 1
+        try:
+            if session._lock is None:
+                session._lock = asyncio.Lock()
+            async with session._lock:
+                yield session
+                session.queries += 1
+        finally:
+            session._active -= 1
+            session.last_used = time.monotonic()
+            if not session._active:
+                # 順番待ちがなくなったらロックも手放して小さくする
+                session._lock = None
+            if self._sessions.get(session_id) is session:
+                self._sessions.move_to_end(session_id)
+                self._resize(session)
+
+    def _resize(self, session: AgentSession):
+        """セッションの推定メモリ使用量を更新し、全体の上限を超えたら古いアイドルセッションを破棄"""
+        size = session.estimated_bytes()
+        self.total_bytes += size - session.size_bytes
+        session.size_bytes = size
+        if self.total_bytes > self.max_memory_bytes:
+            self.stats.evicted_memory += self._evict_oldest(lambda: self.total_bytes > self.max_memory_bytes)
+
+    def _evict_oldest(self, should_evict: Callable[[], bool]) -> int:
+        """should_evict() が真の間、最も長く使われていないアイドルセッションから破棄"""
+        evicted = 0
+        for session_id in list(self._sessions):
+            if not should_evict():
+                break
+            if not self._sessions[session_id].active:
+                self._remove(session_id)
+                evicted += 1
+        return evicted
+
+    def _remove(self, session_id: str) -> Optional[AgentSession]:
+        session = self._sessions.pop(session_id, None)
+        if session is not None:
+            self.total_bytes -= session.size_bytes
+        return session
+
+    def close(self, session_id: str) -> bool:
+        """セッションを終了（処理中のクエリはそのまま完了する）"""
+        if self._remove(session_id) is None:
+            return False
+        self.stats.closed += 1
+        return True
+
+    def evict_idle(self, now: Optional[float] = None) -> int:
+        """idle_timeout 秒以上使われていないセッションを破棄"""
+        deadline = (time.monotonic() if now is None else now) - self.idle_timeout
+        evicted = 0
+        # 最後に使われた順に並んでいるので、期限内のセッションに当たったら終わり
+        for session_id, session in list(self._sessions.items()):
+            if session.last_used > deadline:
+                break
+            if not session.active:
+                self._remove(session_id)
+                evicted += 1
+        self.stats.evicted_idle += evicted
+        return evicted
+
+    def start(self):
+        """アイドルセッションを定期的に破棄するタスクを開始"""
+        if self._sweeper is None or self._sweeper.done():
+            self._sweeper = asyncio.create_task(self._sweep())
+
+    async def _sweep(self):
+        while True:
+            await asyncio.sleep(self.sweep_interval)
+            self.evict_idle()
+
+    async def stop(self):
+        if self._sweeper is not None and not self._sweeper.done():
+            self._sweeper.cancel()
+            await asyncio.gather(self._sweeper, return_exceptions=True)
+        self._sweeper = None
+
+    def get_summary(self) -> Dict[str, Any]:
+        stats = self.stats
+        return {
+            "sessions": len(self._sessions),
+            "active": sum(1 for session in self._sessions.values() if session.active),
+            "estimated_bytes": self.total_bytes,
+            "max_memory_bytes": self.max_memory_bytes,
+            "max_sessions": self.max_sessions,
+            "created": stats.created,
+            "evicted_idle": stats.evicted_idle,
+            "evicted_capacity": stats.evicted_capacity,
+            "evicted_memory": stats.evicted_memory,
+            "closed": stats.closed
+        }
@@ -0,0 +1,97 @@
+#
+# ツール一覧のスナップショット（前回取得したツールと構築済みスキーマを保存し、再起動を速くする）
+#
+
+# snapshot_utils.py
+import hashlib
+import json
+import os
+import time
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional
+
+SNAPSHOT_VERSION = 1
+
+@dataclass
+class SnapshotTool:
+    """スナップショットから復元したツール（MCPの Tool と同じ属性名で参照できる）"""
+    name: str
+    description: str = ""
+    inputSchema: Dict[str, Any] = field(default_factory=dict)
+
+def config_fingerprint(config: Any) -> str:
+    """設定内容のハッシュ（スナップショットが現在の設定で作られたかの判定に使う）"""
+    encoded = json.dumps(config, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(encoded.encode("utf-8")).hexdigest()
+
+def tool_catalog(servers_tools: Dict[str, List[Any]]) -> Dict[str, List[Dict[str, Any]]]:
+    """サーバーごとのツール一覧を保存・比較できる形に変換"""
+    return {
+        server: [
+            {
+                "name": tool.name,
+                "description": getattr(tool, "description", None) or "",
+                "inputSchema": getattr(tool, "inputSchema", None) or {}
+            }
+            for tool in tools
+        ]
+        for server, tools in servers_tools.items()
+    }
+
+@dataclass
+class ToolSnapshot:
+    """読み込んだスナップショット"""
+    catalog: Dict[str, List[Dict[str, Any]]]
+    prebuilt: Dict[str, Any]  # 構築済みのツールスキーマ・システムプロンプトなど
+    created_at: float
+
+    def tools_for(self, server: str) -> List[SnapshotTool]:
+        return [SnapshotTool(**tool) for tool in self.catalog.get(server, [])]
+
+class ToolSnapshotStore:
+    """ツール一覧のスナップショットをJSONファイルに保存・読み込み"""
+
+    def __init__(self, path: str = ".mcp_tools_snapshot.json", max_age_seconds: Optional[float] = 86400):
+        self.path = path
+        self.max_age_seconds = max_age_seconds
+
+    @classmethod
+    def from_config(cls, warm_start_config: Dict[str, Any]) -> Optional["ToolSnapshotStore"]:
+        """mcp.json の agent.warmStart 設定から生成（無効ならNone）"""
+        if not warm_start_config.get("enabled", False):
+            return None
+        return cls(
+            path=warm_start_config.get("snapshotPath", ".mcp_tools_snapshot.json"),
+            max_age_seconds=warm_start_config.get("maxAgeSeconds", 86400)
+        )
+
+    def load(self, fingerprint: str, servers: List[str]) -> Optional[ToolSnapshot]:
+        """設定が同じで期限内、かつ全サーバー分が揃っているスナップショットを返す（なければNone）"""
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if data.get("version") != SNAPSHOT_VERSION or data.get("fingerprint") != fingerprint:
+            return None
+        created_at = data.get("createdAt", 0)
+        if self.max_age_seconds and time.time() - created_at > self.max_age_seconds:
+            return None
+        catalog = data.get("catalog", {})
+        if any(server not in catalog for server in servers):
+            return None
+        return ToolSnapshot(catalog=catalog, prebuilt=data.get("prebuilt", {}), created_at=created_at)
+
+    def save(self, fingerprint: str, catalog: Dict[str, List[Dict[str, Any]]], prebuilt: Dict[str, Any]):
+        """一時ファイルに書いてから置き換える（書き込み途中のファイルを読まないように）"""
+        data = {
+            "version": SNAPSHOT_VERSION,
+            "fingerprint": fingerprint,
+            "createdAt": time.time(),
+            "catalog": catalog,
+            "prebuilt": prebuilt
+        }
+        temp_path = f"{self.path}.tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False)
+        os.replace(temp_path, self.path)
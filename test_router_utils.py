@@ -0,0 +1,77 @@
+#
+# router_utils.py の事前ルーターのテスト（python -m pytest -q test_router_utils.py）
+#   mcp.json の tools 設定と 05_mcpServer.py のツールスキーマで、
+#   確信できるクエリだけがルーティングされ、紛らわしいクエリはLLMに任されることを確認する。
+#
+
+# test_router_utils.py
+import json
+from types import SimpleNamespace
+
+import pytest
+
+from router_utils import KeywordRouter, extract_numbers, find_city_names
+
+# 05_mcpServer.py のツールと同じスキーマ
+TOOL_SPECS = {
+    "multiply": SimpleNamespace(properties={"a": {"type": "integer"}, "b": {"type": "integer"}}, required=("a", "b")),
+    "divide": SimpleNamespace(properties={"a": {"type": "number"}, "b": {"type": "number"}}, required=("a", "b")),
+    "get_weather": SimpleNamespace(properties={"city": {"type": "string"}}, required=("city",)),
+    "get_japan_pm": SimpleNamespace(properties={}, required=()),
+}
+
+@pytest.fixture(scope="module")
+def router() -> KeywordRouter:
+    with open("mcp.json", "r", encoding="utf-8") as f:
+        tool_configs = json.load(f)["tools"]
+    return KeywordRouter(tool_configs, TOOL_SPECS)
+
+@pytest.mark.parametrize("query, tool_name, parameters", [
+    ("3 と 6 を掛けて", "multiply", {"a": 3, "b": 6}),
+    ("-3 と 5 を掛けて", "multiply", {"a": -3, "b": 5}),
+    ("10を2で割って", "divide", {"a": 10, "b": 2}),
+    ("10 を 4 で割り算して", "divide", {"a": 10, "b": 4}),
+    ("大阪の天気は？", "get_weather", {"city": "大阪"}),
+    ("東京都の天気を教えて", "get_weather", {"city": "東京"}),
+    ("日本の首相は誰？", "get_japan_pm", {}),
+    ("今の PM は誰？", "get_japan_pm", {}),
+])
+def test_routes_clear_queries(router, query, tool_name, parameters):
+    route = router.route(query)
+    assert route is not None
+    assert (route.tool_name, route.parameters) == (tool_name, parameters)
+
+@pytest.mark.parametrize("query", [
+    # 掛け算以外の演算
+    "3 + 5 を計算して",
+    "2の3乗を計算して",
+    "2の3乗を掛けて",
+    "10 から 4 を引く計算をして",
+    "3 と 5 を足して掛けて",
+    "3-5を掛けて",
+    # 英字キーワードの部分一致
+    "npm のバージョンは？",
+    "明日 3pm の予定",
+    # 汎用的なキーワードだけ
+    "日本の人口は？",
+    "日本で一番高い山は？",
+    "政治について教えて",
+    "計算して",
+    # 複数の都市
+    "東京の天気と大阪の天気は？",
+    # 複数のツール
+    "東京の天気と日本の首相を教えて",
+])
+def test_leaves_ambiguous_queries_to_llm(router, query):
+    assert router.route(query) is None
+
+def test_hyphen_between_numbers_is_not_a_minus_sign():
+    assert extract_numbers("3-5") == [3, 5]
+    assert extract_numbers("10 - 4") == [10, 4]
+    assert extract_numbers("-3 と 5") == [-3, 5]
+    assert extract_numbers("1.5-2") == [1.5, 2]
+
+def test_find_city_names_prefers_longest_leftmost_match():
+    cities = ["東京", "京都", "大阪"]
+    assert find_city_names("東京都の天気", cities) == ["東京"]
+    assert find_city_names("京都と大阪と京都", cities) == ["京都", "大阪"]
@@ -0,0 +1,194 @@
+#
+# 処理フェーズごとのレイテンシ計測（スパン記録と Chrome trace / JSONL 出力）
+#
+
+# trace_utils.py
+import asyncio
+import json
+import os
+import time
+import weakref
+from collections import deque
+from typing import Any, Dict, List, Optional
+
+class Span:
+    """1区間の計測結果（大量に記録するため __slots__ で軽量化）"""
+    __slots__ = ("name", "category", "start_ns", "end_ns", "tid", "args")
+
+    def __init__(self, name: str, category: str, tid: int, args: Optional[Dict[str, Any]]):
+        self.name = name
+        self.category = category
+        self.start_ns = 0
+        self.end_ns = 0
+        self.tid = tid
+        self.args = args
+
+    @property
+    def duration_ms(self) -> float:
+        return (self.end_ns - self.start_ns) / 1_000_000
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "name": self.name,
+            "category": self.category,
+            "start_ns": self.start_ns,
+            "end_ns": self.end_ns,
+            "duration_ms": self.duration_ms,
+            "tid": self.tid,
+            "args": self.args or {}
+        }
+
+class _SpanContext:
+    """スパンを計測する with 文用のコンテキスト"""
+    __slots__ = ("_tracer", "_span")
+
+    def __init__(self, tracer: "Tracer", span: Span):
+        self._tracer = tracer
+        self._span = span
+
+    def __enter__(self) -> "_SpanContext":
+        self._span.start_ns = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> bool:
+        self._span.end_ns = time.perf_counter_ns()
+        if exc_type is not None:
+            self.set(error=exc_type.__name__)
+        self._tracer._spans.append(self._span)
+        return False
+
+    def set(self, **args: Any):
+        """スパンに属性を追加"""
+        if self._span.args is None:
+            self._span.args = {}
+        self._span.args.update(args)
+
+class _NullSpanContext:
+    """トレース無効時に返す何もしないコンテキスト（1つのインスタンスを使い回す）"""
+    __slots__ = ()
+
+    def __enter__(self) -> "_NullSpanContext":
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> bool:
+        return False
+
+    def set(self, **args: Any):
+        pass
+
+NULL_SPAN = _NullSpanContext()
+
+class Tracer:
+    """スパンを記録するトレーサー
+
+    無効時の span() は共有の NULL_SPAN を返すだけなので、計測コストはほぼゼロ。
+    並行実行中のクエリは asyncio のタスクごとに別スレッド（tid）として表示される。
+    """
+
+    def __init__(self, enabled: bool = False, max_spans: int = 100000,
+                 chrome_trace_path: Optional[str] = None, jsonl_path: Optional[str] = None):
+        self.enabled = enabled
+        self.chrome_trace_path = chrome_trace_path
+        self.jsonl_path = jsonl_path
+        self._spans: deque = deque(maxlen=max_spans)
+        # タスク自体をキーにし、終わったタスクは自動で消える（id() は再利用されるので使わない）
+        self._task_ids: "weakref.WeakKeyDictionary[asyncio.Task, int]" = weakref.WeakKeyDictionary()
+        self._next_tid = 1
+        self._origin_ns = time.perf_counter_ns()
+
+    @classmethod
+    def from_config(cls, tracing_config: Dict[str, Any]) -> "Tracer":
+        """mcp.json の agent.tracing 設定から生成"""
+        return cls(
+            enabled=tracing_config.get("enabled", False),
+            max_spans=tracing_config.get("maxSpans", 100000),
+            chrome_trace_path=tracing_config.get("chromeTracePath"),
+            jsonl_path=tracing_config.get("jsonlPath")
+        )
+
+    def span(self, name: str, category: str = "agent", **args: Any):
+        """with 文で区間を計測する"""
+        if not self.enabled:
+            return NULL_SPAN
+        return _SpanContext(self, Span(name, category, self._current_tid(), args or None))
+
+    def record(self, name: str, start_ns: int, end_ns: int, category: str = "agent", **args: Any):
+        """計測済みの区間を後から記録する"""
+        if not self.enabled:
+            return
+        span = Span(name, category, self._current_tid(), args or None)
+        span.start_ns = start_ns
+        span.end_ns = end_ns
+        self._spans.append(span)
+
+    def _current_tid(self) -> int:
+        """実行中のタスクを小さな連番に対応付ける（タスク外は0）"""
+        try:
+            task = asyncio.current_task()
+        except RuntimeError:
+            task = None
+        if task is None:
+            return 0
+        tid = self._task_ids.get(task)
+        if tid is None:
+            tid = self._task_ids[task] = self._next_tid
+            self._next_tid += 1
+        return tid
+
+    @property
+    def spans(self) -> List[Span]:
+        return list(self._spans)
+
+    def to_chrome_trace(self) -> Dict[str, Any]:
+        """Chrome trace-event 形式（chrome://tracing や Perfetto で表示可能）に変換"""
+        pid = os.getpid()
+        events = []
+        for span in self._spans:
+            events.append({
+                "name": span.name,
+                "cat": span.category,
+                "ph": "X",
+                "ts": (span.start_ns - self._origin_ns) / 1000,
+                "dur": (span.end_ns - span.start_ns) / 1000,
+                "pid": pid,
+                "tid": span.tid,
+                "args": span.args or {}
+            })
+        return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+    def export_chrome_trace(self, path: str):
+        """Chrome trace-event JSON として保存"""
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.to_chrome_trace(), f, ensure_ascii=False, default=str)
+
+    def export_jsonl(self, path: str):
+        """1行1スパンのJSONLとして保存"""
+        with open(path, "w", encoding="utf-8") as f:
+            for span in self._spans:
+                f.write(json.dumps(span.to_dict(), ensure_ascii=False, default=str) + "\n")
+
+    def export(self) -> List[str]:
+        """設定された出力先へ保存し、保存したパスを返す"""
+        if not self.enabled or not self._spans:
+            return []
+        written = []
+        if self.chrome_trace_path:
+            self.export_chrome_trace(self.chrome_trace_path)
+            written.append(self.chrome_trace_path)
+        if self.jsonl_path:
+            self.export_jsonl(self.jsonl_path)
+            written.append(self.jsonl_path)
+        return written
+
+    def get_summary(self) -> Dict[str, Dict[str, float]]:
+        """スパン名ごとの回数・合計・平均・最大（ミリ秒）を返す"""
+        summary: Dict[str, Dict[str, float]] = {}
+        for span in self._spans:
+            entry = summary.setdefault(span.name, {"count": 0, "total_ms": 0.0, "max_ms": 0.0})
+            duration = span.duration_ms
+            entry["count"] += 1
+            entry["total_ms"] += duration
+            entry["max_ms"] = max(entry["max_ms"], duration)
+        for entry in summary.values():
+            entry["average_ms"] = entry["total_ms"] / entry["count"]
+        return summary